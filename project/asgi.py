@@ -3,6 +3,9 @@ ASGI config for project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve with an ASGI server (e.g. ``uvicorn project.asgi:application``) to use the live
+run event stream at /api/runs/{id}/stream/.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
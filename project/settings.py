@@ -4,7 +4,9 @@ Django settings for project.
 Generated for tracker automation build and test system.
 """
 
+import os
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -36,6 +38,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'tracker.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -68,14 +71,91 @@ WSGI_APPLICATION = 'project.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
+#
+# Configured from the environment. TRACKER_DB_ENGINE is 'sqlite' (default, single node) or
+# 'postgresql' (needs psycopg; use it when many agents report concurrently or for several nodes).
+
+TRACKER_DB_ENGINE = os.environ.get('TRACKER_DB_ENGINE', 'sqlite')
+
+if TRACKER_DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('TRACKER_DB_NAME', 'tracker'),
+            'USER': os.environ.get('TRACKER_DB_USER', ''),
+            'PASSWORD': os.environ.get('TRACKER_DB_PASSWORD', ''),
+            'HOST': os.environ.get('TRACKER_DB_HOST', ''),
+            'PORT': os.environ.get('TRACKER_DB_PORT', ''),
+            # Behind a transaction-pooling PgBouncer, run exports cannot use server-side cursors
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('TRACKER_DB_DISABLE_SERVER_SIDE_CURSORS') == '1',
+        }
+    }
+elif TRACKER_DB_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('TRACKER_DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                # Seconds a writer waits for the database lock before failing with "database is locked"
+                'timeout': float(os.environ.get('TRACKER_DB_TIMEOUT', 20)),
+                # Take the write lock when a transaction begins: a read transaction that later writes
+                # cannot wait for the lock and would fail at once under concurrent writers
+                'transaction_mode': 'IMMEDIATE',
+            },
+            # A file rather than the default in-memory database, so that tests with several writer
+            # threads get WAL and lock waits like a deployment does
+            'TEST': {'NAME': str(BASE_DIR / 'test_db.sqlite3')},
+        }
+    }
+else:
+    raise ImproperlyConfigured(f"TRACKER_DB_ENGINE must be 'sqlite' or 'postgresql', not {TRACKER_DB_ENGINE!r}")
+
+# Persistent connections (seconds, 0 = one per request), checked for health before reuse. The
+# default of 0 suits ASGI (project/asgi.py), as Django recommends for async servers; WSGI workers
+# can set TRACKER_DB_CONN_MAX_AGE=60 to reuse connections across requests.
+DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('TRACKER_DB_CONN_MAX_AGE', 0))
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# PRAGMAs applied to every new SQLite connection (see tracker/db.py). WAL lets readers proceed
+# while one connection writes; synchronous=NORMAL is durable in WAL mode except on power loss.
+TRACKER_SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+}
 
-DATABASES = {
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tracker-default',
     }
 }
 
+# Cache alias and timeout (seconds, None = forever) for serialized pipeline definitions.
+# Entries are keyed by Pipeline.structure_version, so they never need explicit invalidation.
+TRACKER_PIPELINE_CACHE = 'default'
+TRACKER_PIPELINE_CACHE_TIMEOUT = None
+
+# Seconds between keep-alive comments on idle run event streams (/api/runs/{id}/stream/)
+TRACKER_EVENT_STREAM_KEEPALIVE = 15
+
+# Optional write-behind buffer for update_stage substage progress (see tracker/buffer.py)
+TRACKER_WRITE_BUFFER = {
+    'ENABLED': False,
+    'FLUSH_INTERVAL_MS': 250,
+    'MAX_PENDING': 1000,
+}
+
+# Per-request query/timing metrics served at /metrics (see tracker/metrics.py). Requests issuing
+# more than QUERY_WARNING_THRESHOLD queries are logged as likely N+1 patterns (None disables).
+TRACKER_METRICS = {
+    'ENABLED': True,
+    'QUERY_WARNING_THRESHOLD': 50,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -121,5 +201,9 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 100
+    'PAGE_SIZE': 100,
+    'DEFAULT_RENDERER_CLASSES': [
+        'tracker.metrics.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
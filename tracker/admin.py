@@ -1,7 +1,7 @@
 from django.contrib import admin
 from .models import (
-    Organization, Team, Project, Pipeline,
-    Stage, SubStage, Run, StageResult, SubStageResult
+    Organization, Team, Project, Pipeline, PipelineVersion,
+    Stage, SubStage, Run, StageResult, SubStageResult, TrendBucket
 )
 
 
@@ -22,29 +22,51 @@ class ProjectAdmin(admin.ModelAdmin):
 
 @admin.register(Pipeline)
 class PipelineAdmin(admin.ModelAdmin):
-    list_display = ('name', 'project', 'version')
+    list_display = ('name', 'project', 'version', 'content_hash', 'retention_days', 'retention_runs')
+    readonly_fields = ('content_hash',)
+
+
+@admin.register(PipelineVersion)
+class PipelineVersionAdmin(admin.ModelAdmin):
+    list_display = ('pipeline', 'short_hash', 'created_at')
+    list_filter = ('pipeline',)
+    readonly_fields = ('pipeline', 'content_hash', 'definition', 'created_at')
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
 
 @admin.register(Stage)
 class StageAdmin(admin.ModelAdmin):
-    list_display = ('name', 'pipeline', 'weight', 'order')
+    list_display = ('name', 'pipeline', 'weight', 'order', 'archived')
+    list_filter = ('archived',)
 
 
 @admin.register(SubStage)
 class SubStageAdmin(admin.ModelAdmin):
-    list_display = ('name', 'stage', 'weight', 'order')
+    list_display = ('name', 'stage', 'weight', 'order', 'archived')
+    list_filter = ('archived',)
 
 
 @admin.register(Run)
 class RunAdmin(admin.ModelAdmin):
-    list_display = ('id', 'pipeline', 'status', 'start_time', 'end_time')
+    list_display = ('id', 'pipeline', 'pipeline_version', 'status', 'score', 'start_time', 'end_time', 'compacted')
+    readonly_fields = ('pipeline_version', 'score', 'trend_recorded', 'compacted', 'stage_summary')
 
 
 @admin.register(StageResult)
 class StageResultAdmin(admin.ModelAdmin):
-    list_display = ('run', 'stage', 'completion_percent', 'status')
+    list_display = ('run', 'stage', 'completion_percent', 'weight', 'weighted_score', 'status')
+    readonly_fields = ('weight', 'weighted_score')
 
 
 @admin.register(SubStageResult)
 class SubStageResultAdmin(admin.ModelAdmin):
-    list_display = ('stage_result', 'substage', 'completion_percent', 'status')
+    list_display = ('stage_result', 'substage', 'completion_percent', 'weight', 'status')
+    readonly_fields = ('weight',)
+
+
+@admin.register(TrendBucket)
+class TrendBucketAdmin(admin.ModelAdmin):
+    list_display = ('pipeline', 'stage', 'granularity', 'bucket_start', 'run_count', 'mean_score')
+    list_filter = ('granularity',)
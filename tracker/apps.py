@@ -7,4 +7,4 @@ class TrackerConfig(AppConfig):
 
     def ready(self):
         # import signals to ensure they are registered
-        from . import signals  # noqa: F401
+        from . import db, signals  # noqa: F401
@@ -0,0 +1,126 @@
+"""Async versions of the hot run-reporting endpoints, mounted under /api/async/.
+
+They mirror RunViewSet.create / update_stage / summary and PipelineViewSet.trend, but are plain
+Django async views using the async ORM, so under ASGI a worker does not hold a thread while it
+waits on the database. Writes that need a transaction (run creation with its result rows, result
+updates with rollup and score refresh) run through ``sync_to_async``, as Django's async ORM does
+not support transactions yet.
+"""
+import json
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed, JsonResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.exceptions import ValidationError
+from .buffer import flush_pending, flush_pipeline_pending, report_progress
+from .caching import etag_matches, if_match_revision
+from .models import Pipeline, Run
+from .serializers import RunSerializer
+from .services import StaleRevision
+from .views import filter_trend_buckets, trend_bucket_data
+
+
+def _json(data, status=200, **kwargs) -> JsonResponse:
+    return JsonResponse(data, status=status, encoder=DjangoJSONEncoder, safe=False, **kwargs)
+
+
+def _parse_body(request):
+    try:
+        return json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+
+
+def _api_view(methods):
+    """Restrict methods and exempt from CSRF like DRF's APIView (works for async views on Django 4.2+)."""
+    def decorator(view):
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+            return await view(request, *args, **kwargs)
+        wrapper.csrf_exempt = True
+        wrapper.__name__ = view.__name__
+        wrapper.__doc__ = view.__doc__
+        return wrapper
+    return decorator
+
+
+def _create_run(serializer):
+    with transaction.atomic():
+        run = serializer.save()
+    return RunSerializer(Run.objects.with_results().get(pk=run.pk)).data
+
+
+@_api_view(['POST'])
+async def create_run(request):
+    """Async POST /api/async/runs/ (same payload and response as POST /api/runs/)."""
+    payload = _parse_body(request)
+    if not isinstance(payload, dict):
+        return _json({'detail': 'JSON object body required'}, status=400)
+    serializer = RunSerializer(data=payload)
+    if not await sync_to_async(serializer.is_valid)():
+        return _json(serializer.errors, status=400)
+    return _json(await sync_to_async(_create_run)(serializer), status=201)
+
+
+@_api_view(['POST'])
+async def update_stage(request, pk):
+    """Async POST /api/async/runs/{id}/update_stage/ (same payload and If-Match handling as the sync endpoint)."""
+    payload = _parse_body(request)
+    if not isinstance(payload, dict):
+        return _json({'detail': 'JSON object body required'}, status=400)
+    if not await Run.objects.filter(pk=pk).aexists():
+        raise Http404
+    try:
+        report = await sync_to_async(report_progress)(pk, payload, if_match_revision(request, f'run-{pk}'))
+    except ValueError as e:
+        return _json({'detail': str(e)}, status=400)
+    except ObjectDoesNotExist:
+        raise Http404
+    except StaleRevision as e:
+        return _json({'detail': e.detail}, status=412, headers={'ETag': Run(id=pk, revision=e.revision).etag})
+    headers = {'ETag': Run(id=pk, revision=report.revision).etag} if report.revision else None
+    return _json(report.data, headers=headers)
+
+
+@_api_view(['GET'])
+async def run_summary(request, pk):
+    """Async GET /api/async/runs/{id}/summary/ with the same ETag / If-None-Match handling."""
+    await sync_to_async(flush_pending)(pk)
+    revision = await Run.objects.filter(pk=pk).values_list('revision', flat=True).afirst()
+    if revision is None:
+        raise Http404
+    etag = Run(id=pk, revision=revision).etag
+    if etag_matches(request, etag):
+        response = HttpResponse(status=304)
+        response['ETag'] = etag
+        return response
+    run = await Run.objects.select_related('pipeline').with_results().aget(pk=pk)
+    # The tree is prefetched, so serializing does not query the database
+    return _json(RunSerializer(run).data, headers={'ETag': etag})
+
+
+@_api_view(['GET'])
+async def pipeline_trend(request, pk):
+    """Async GET /api/async/pipelines/{id}/trend/ (``n`` or ``bucket``/``since``/``until``/``stage``)."""
+    if not await Pipeline.objects.filter(pk=pk).aexists():
+        raise Http404
+    await sync_to_async(flush_pipeline_pending)(pk)
+    params = request.GET
+    if params.get('bucket'):
+        try:
+            buckets = filter_trend_buckets(Pipeline(pk=pk).trend_buckets.all(), params)
+        except ValidationError as e:
+            return _json(e.detail, status=400)
+        return _json([trend_bucket_data(b) async for b in buckets])
+
+    try:
+        n = int(params.get('n', 10))
+    except ValueError:
+        return _json({'n': 'Expected an integer'}, status=400)
+    runs = Run.objects.filter(pipeline_id=pk).order_by('-start_time').values_list('id', 'start_time', 'score')[:n]
+    return _json([
+        {'run_id': run_id, 'start_time': start_time, 'overall_score': round(score * 100, 2)}
+        async for run_id, start_time, score in runs
+    ])
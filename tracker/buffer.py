@@ -0,0 +1,207 @@
+"""Optional write-behind buffer for high-frequency substage progress reports.
+
+Agents often report 10%, 20%, ... for the same substage many times a second. With
+``TRACKER_WRITE_BUFFER['ENABLED']`` set, update_stage keeps only the latest value per
+SubStageResult in memory and writes them in batches (through ``services.apply_result_updates``,
+i.e. one transaction, one rollup and one score refresh per run) every ``FLUSH_INTERVAL_MS``, as
+soon as ``MAX_PENDING`` entries accumulate, or immediately for terminal statuses.
+
+Run reads flush the run's pending entries first (see RunViewSet), so the API never serves
+values older than the last accepted report. Flushes run one at a time and a run counts as
+pending while a flush is writing it, so ``flush_pending`` also waits for an in-flight batch:
+batches commit in the order they were taken, and a direct write issued after ``flush_pending``
+is never overwritten by an older buffered value. The buffer is per process: enable it only where
+reads and writes of a run reach the same worker, and note that pending entries of a killed
+process are lost (a normal interpreter exit flushes them).
+"""
+import atexit
+import logging
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, Mapping, NamedTuple, Optional, Set, Tuple
+from django.conf import settings
+from django.db import connection
+from .models import Run, SubStageResult
+from .services import apply_result_updates, update_result
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ('completed', 'failed')
+
+
+class ProgressBuffer:
+    """Coalesce substage updates per (run id, substage id) and flush them in batches."""
+
+    def __init__(self, flush_interval_ms: int = 250, max_pending: int = 1000):
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple[int, int], dict] = {}
+        self._timer: Optional[threading.Timer] = None
+        # Held for a whole flush; _flushing holds the run ids of the batch being written
+        self._flush_lock = threading.Lock()
+        self._flushing: Set[int] = set()
+
+    def add(self, run_id: int, substage_id: int, completion_percent: float, status: Optional[str] = None) -> bool:
+        """Buffer an update, replacing any pending one for the same substage result.
+
+        Returns True if the update was flushed to the database before returning (terminal
+        status or buffer full).
+        """
+        with self._lock:
+            update = {'substage_id': substage_id, 'completion_percent': completion_percent}
+            previous = self._pending.get((run_id, substage_id), {})
+            if status is not None or 'status' in previous:
+                update['status'] = status if status is not None else previous['status']
+            self._pending[(run_id, substage_id)] = update
+            flush_now = status in TERMINAL_STATUSES or len(self._pending) >= self.max_pending
+            if not flush_now and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self._flush_from_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        if flush_now:
+            self.flush(run_id if status in TERMINAL_STATUSES else None)
+        return flush_now
+
+    def has_pending(self, run_id: Optional[int] = None) -> bool:
+        """True if updates (of one run, or any) are buffered or being written by a flush."""
+        with self._lock:
+            if run_id is None:
+                return bool(self._pending or self._flushing)
+            return run_id in self._flushing or any(key[0] == run_id for key in self._pending)
+
+    def pending_run_ids(self) -> Set[int]:
+        """Ids of the runs with updates buffered or being written by a flush."""
+        with self._lock:
+            return {key[0] for key in self._pending} | self._flushing
+
+    def flush(self, run_id: Optional[int] = None) -> int:
+        """Write pending updates (of one run, or all) to the database; returns how many were written.
+
+        Waits for a flush in progress first, so when this returns every update accepted before
+        the call is committed.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if run_id is None:
+                    batch, self._pending = self._pending, {}
+                else:
+                    batch = {key: update for key, update in self._pending.items() if key[0] == run_id}
+                    for key in batch:
+                        del self._pending[key]
+                if not self._pending and self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                self._flushing = {key[0] for key in batch}
+
+            by_run = defaultdict(list)
+            for (pending_run_id, _), update in batch.items():
+                by_run[pending_run_id].append(update)
+            try:
+                for pending_run_id, updates in by_run.items():
+                    try:
+                        apply_result_updates(Run(id=pending_run_id), updates)
+                    except ValueError:
+                        # Results deleted since the update was accepted; nothing left to write
+                        logger.warning('Dropped %d buffered updates for run id=%s', len(updates), pending_run_id)
+            finally:
+                with self._lock:
+                    self._flushing = set()
+        return len(batch)
+
+    def _flush_from_timer(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        finally:
+            # The timer thread opened its own connection; don't leak it
+            connection.close()
+
+
+_buffer: Optional[ProgressBuffer] = None
+_buffer_lock = threading.Lock()
+
+
+def get_progress_buffer() -> Optional[ProgressBuffer]:
+    """The process-wide buffer, or None when TRACKER_WRITE_BUFFER is not enabled."""
+    global _buffer
+    config = getattr(settings, 'TRACKER_WRITE_BUFFER', {})
+    if not config.get('ENABLED'):
+        return None
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = ProgressBuffer(
+                flush_interval_ms=config.get('FLUSH_INTERVAL_MS', 250),
+                max_pending=config.get('MAX_PENDING', 1000),
+            )
+            atexit.register(_buffer.flush)
+    return _buffer
+
+
+def flush_pending(run_id: Optional[int] = None) -> None:
+    """Flush buffered updates of ``run_id`` (or all runs) before a read; no-op when disabled."""
+    buffer = get_progress_buffer()
+    if buffer is not None and buffer.has_pending(run_id):
+        buffer.flush(run_id)
+
+
+def flush_pending_runs(run_ids: Iterable[int]) -> bool:
+    """Flush buffered updates of the given runs only; True if any of them had updates pending."""
+    buffer = get_progress_buffer()
+    if buffer is None:
+        return False
+    pending = buffer.pending_run_ids().intersection(run_ids)
+    for run_id in sorted(pending):
+        buffer.flush(run_id)
+    return bool(pending)
+
+
+def flush_pipeline_pending(pipeline_id: int) -> None:
+    """Flush buffered updates of the runs of one pipeline; only queries when something is pending."""
+    buffer = get_progress_buffer()
+    pending = buffer.pending_run_ids() if buffer is not None else None
+    if pending:
+        flush_pending_runs(Run.objects.filter(pipeline_id=pipeline_id, id__in=pending).values_list('id', flat=True))
+
+
+class ProgressReport(NamedTuple):
+    """Response body of update_stage and, for direct writes, the run's new revision (its ETag)."""
+    data: dict
+    revision: Optional[int] = None
+
+
+def report_progress(run_id: int, data: Mapping, expected_revision: Optional[int] = None) -> ProgressReport:
+    """Validate and apply one update_stage payload (``stage_id`` or ``substage_id``, ``completion_percent``,
+    optional ``status``) for an existing run; shared by the sync and async endpoints.
+
+    Unconditional substage reports go through the buffer when it is enabled; everything else is
+    written with ``services.update_result`` after flushing the run's pending entries, so a direct
+    write is never overtaken by an older buffered value. Raises ValueError for an invalid payload,
+    ObjectDoesNotExist if the stage/substage has no result in the run and StaleRevision if
+    ``expected_revision`` no longer matches.
+    """
+    stage_id = data.get('stage_id')
+    substage_id = data.get('substage_id')
+    if not substage_id and not stage_id:
+        raise ValueError('stage_id or substage_id required')
+    try:
+        completion_percent = float(data.get('completion_percent', 0))
+    except (TypeError, ValueError):
+        raise ValueError('completion_percent must be a number')
+
+    buffer = get_progress_buffer()
+    # Conditional updates must be checked against the database, so they are never buffered
+    if buffer is not None and substage_id and expected_revision is None:
+        if not SubStageResult.objects.of_run(run_id).filter(substage_id=substage_id).exists():
+            raise SubStageResult.DoesNotExist(f"Run id={run_id} has no result for substage id={substage_id}")
+        flushed = buffer.add(run_id, int(substage_id), completion_percent, data.get('status'))
+        score = Run.objects.filter(pk=run_id).values_list('score', flat=True).get()
+        return ProgressReport({'overall_score': round(score * 100, 2), 'buffered': not flushed})
+
+    flush_pending(run_id)
+    new_score = update_result(
+        run_id, completion_percent, status=data.get('status'),
+        stage_id=stage_id, substage_id=substage_id, expected_revision=expected_revision,
+    )
+    return ProgressReport({'overall_score': round(new_score.score * 100, 2)}, new_score.revision)
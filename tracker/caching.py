@@ -0,0 +1,82 @@
+"""Response caching helpers for pipeline definitions and conditional GETs.
+
+Pipeline representations are cached under a key that includes ``Pipeline.structure_version``,
+which signals bump whenever the pipeline or one of its stages/substages is saved or deleted.
+A changed definition therefore simply stops hitting its old cache entry; nothing is ever
+explicitly invalidated. The cache alias is configurable via ``TRACKER_PIPELINE_CACHE``.
+"""
+import hashlib
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.http import parse_etags
+
+
+def get_pipeline_cache():
+    return caches[getattr(settings, 'TRACKER_PIPELINE_CACHE', 'default')]
+
+
+def pipeline_cache_key(pipeline_id: int, structure_version: int) -> str:
+    return f'tracker:pipeline:{pipeline_id}:v{structure_version}'
+
+
+def versions_etag(prefix: str, versions: Iterable[Tuple[int, int]], extra: Tuple = ()) -> str:
+    """Strong ETag for a list of (object id, version) pairs.
+
+    ``extra`` holds anything else the response depends on, such as a list page's total count and
+    page parameters (which decide the ``count``/``next``/``previous`` fields).
+    """
+    digest = hashlib.sha1(repr((list(versions), tuple(extra))).encode()).hexdigest()[:20]
+    return f'"{prefix}-{digest}"'
+
+
+def etag_matches(request, etag: str) -> bool:
+    """True if the request's If-None-Match header matches ``etag`` (weak comparison, as for GET)."""
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    candidates = parse_etags(header)
+    if '*' in candidates:
+        return True
+    strip = lambda tag: tag[2:] if tag.startswith('W/') else tag  # noqa: E731
+    return strip(etag) in {strip(tag) for tag in candidates}
+
+
+def if_match_revision(request, prefix: str) -> Optional[int]:
+    """Revision named by the request's If-Match header, for ETags of the form ``"{prefix}-{revision}"``.
+
+    None if there is no header or it is ``*``. A header naming no revision of this resource
+    (including weak ETags, which If-Match never matches) gives 0, which matches no revision.
+    """
+    header = request.headers.get('If-Match')
+    if not header:
+        return None
+    candidates = parse_etags(header)
+    if '*' in candidates:
+        return None
+    for tag in candidates:
+        value = tag[len(prefix) + 2:-1] if tag.startswith(f'"{prefix}-') and tag.endswith('"') else ''
+        if value.isdigit():
+            return int(value)
+    return 0
+
+
+def get_pipeline_representations(
+    versions: List[Tuple[int, int]],
+    build: Callable[[List[int]], Dict[int, dict]],
+) -> List[dict]:
+    """Return the serialized pipelines for (id, structure_version) pairs, in order.
+
+    Cached entries are fetched with one ``get_many``; only missing pipelines are passed to
+    ``build`` (which returns ``{pipeline_id: data}``) and then stored.
+    """
+    cache = get_pipeline_cache()
+    keys = {pipeline_id: pipeline_cache_key(pipeline_id, version) for pipeline_id, version in versions}
+    cached = cache.get_many(list(keys.values()))
+    missing = [pipeline_id for pipeline_id, key in keys.items() if key not in cached]
+    if missing:
+        built = build(missing)
+        fresh = {keys[pipeline_id]: data for pipeline_id, data in built.items()}
+        cache.set_many(fresh, timeout=getattr(settings, 'TRACKER_PIPELINE_CACHE_TIMEOUT', None))
+        cached.update(fresh)
+    return [cached[keys[pipeline_id]] for pipeline_id, _ in versions if keys[pipeline_id] in cached]
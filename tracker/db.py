@@ -0,0 +1,30 @@
+"""Per-connection database setup.
+
+New SQLite connections get ``TRACKER_SQLITE_PRAGMAS`` (WAL journal by default), so API readers are
+not blocked while an agent's update is being written. The busy timeout and the IMMEDIATE
+transaction mode come from ``DATABASES['default']['OPTIONS']`` (see project/settings.py).
+
+Every connection also gets the request metrics query wrapper (see tracker/middleware.py). It is
+installed here rather than per request because connections are per thread, and an async request
+runs its queries on the connections of sync_to_async threads.
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from .middleware import record_query
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'TRACKER_SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    # Created again on reconnect; insert first so execute_wrapper() blocks still pop their own wrapper
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
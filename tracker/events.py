@@ -0,0 +1,103 @@
+"""In-process pub/sub for live run progress (served as server-sent events, see views.run_event_stream).
+
+Writers call ``notify_run_changed`` from any thread; once the surrounding transaction commits, the
+changed rows are read once and fanned out to every subscriber of that run. With no subscribers
+nothing is read at all. Subscribers are asyncio queues living on the ASGI event loop, so no
+external broker is needed; the fan-out is per process.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, Optional, Set, Tuple
+from django.db import transaction
+from .models import Run, StageResult, SubStageResult
+
+# Events kept per subscriber before the oldest ones are dropped for a slow consumer
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class RunEventBroker:
+    """Fan out run events to asyncio queues, safe to publish from any thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Dict[int, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = defaultdict(set)
+
+    def subscribe(self, run_id: int) -> asyncio.Queue:
+        """Register a queue on the running event loop for events of ``run_id``."""
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[run_id].add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, run_id: int, queue: asyncio.Queue) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(run_id, set())
+            subscribers.difference_update({sub for sub in subscribers if sub[1] is queue})
+            if not subscribers:
+                self._subscribers.pop(run_id, None)
+
+    def has_subscribers(self, run_id: int) -> bool:
+        with self._lock:
+            return bool(self._subscribers.get(run_id))
+
+    def publish(self, run_id: int, event: dict) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.get(run_id, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, event)
+            except RuntimeError:
+                # Loop already closed; the subscriber's stream is gone
+                self.unsubscribe(run_id, queue)
+
+
+def _offer(queue: asyncio.Queue, event: dict) -> None:
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(event)
+
+
+broker = RunEventBroker()
+
+
+def run_snapshot(run_id: int) -> Optional[dict]:
+    """Run-level fields included in every event."""
+    run = Run.objects.filter(id=run_id).values('id', 'status', 'end_time', 'score', 'revision').first()
+    if run is None:
+        return None
+    return {
+        'run_id': run['id'],
+        'status': run['status'],
+        'end_time': run['end_time'].isoformat() if run['end_time'] else None,
+        'overall_score': round(run['score'] * 100, 2),
+        'revision': run['revision'],
+    }
+
+
+def notify_run_changed(
+    run_id: int,
+    stage_result_ids: Iterable[int] = (),
+    substage_result_ids: Iterable[int] = (),
+) -> None:
+    """Publish the changed results and new score of ``run_id`` after the current transaction commits."""
+    stage_result_ids = list(stage_result_ids)
+    substage_result_ids = list(substage_result_ids)
+
+    def publish():
+        if not broker.has_subscribers(run_id):
+            return
+        event = run_snapshot(run_id)
+        if event is None:
+            return
+        event['stage_results'] = list(
+            StageResult.objects.filter(id__in=stage_result_ids)
+            .values('id', 'stage', 'status', 'completion_percent')
+        )
+        event['substage_results'] = list(
+            SubStageResult.objects.filter(id__in=substage_result_ids)
+            .values('id', 'substage', 'stage_result', 'status', 'completion_percent')
+        )
+        broker.publish(run_id, event)
+
+    transaction.on_commit(publish)
@@ -0,0 +1,32 @@
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+
+class RunFilterBackend(BaseFilterBackend):
+    """Filter runs by query parameters, each backed by an index on Run.
+
+    Supported: ``pipeline`` (id), ``status``, ``triggered_by`` and the start-time window
+    ``started_after`` / ``started_before`` (ISO 8601 datetimes, inclusive / exclusive).
+    """
+    exact_params = {'pipeline': 'pipeline_id', 'status': 'status', 'triggered_by': 'triggered_by'}
+    integer_params = ('pipeline',)
+    window_params = {'started_after': 'start_time__gte', 'started_before': 'start_time__lt'}
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        for param, lookup in self.exact_params.items():
+            if params.get(param):
+                value = params[param]
+                if param in self.integer_params:
+                    if not value.isdigit():
+                        raise ValidationError({param: 'Expected an integer id'})
+                    value = int(value)
+                queryset = queryset.filter(**{lookup: value})
+        for param, lookup in self.window_params.items():
+            if params.get(param):
+                value = parse_datetime(params[param])
+                if value is None:
+                    raise ValidationError({param: 'Expected an ISO 8601 datetime'})
+                queryset = queryset.filter(**{lookup: value})
+        return queryset
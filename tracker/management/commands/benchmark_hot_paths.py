@@ -0,0 +1,271 @@
+import io
+import itertools
+import json
+import platform
+import random
+import statistics
+import tempfile
+import time
+import django
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connection
+from django.test import Client
+from django.test.utils import override_settings, setup_databases, teardown_databases
+from django.utils import timezone
+from tracker.models import Organization, Pipeline, Project, Run, Stage, SubStage, SubStageResult, Team
+from tracker.services import calculate_run_score
+
+OPERATIONS = ('create_run', 'update_stage', 'summary', 'trend', 'trend_buckets', 'calculate_run_score')
+
+
+def int_list(value):
+    try:
+        return [int(item) for item in value.split(',') if item]
+    except ValueError:
+        raise CommandError(f'Expected a comma-separated list of integers, got {value!r}')
+
+
+class QueryMeter:
+    """``connection.execute_wrapper`` counting queries, rows fetched by SELECTs and rows written by DML."""
+
+    def __init__(self):
+        self.queries = self.rows_read = self.rows_written = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        result = execute(sql, params, many, context)
+        cursor = context['cursor']
+        if sql.lstrip()[:6].upper() not in ('INSERT', 'UPDATE', 'DELETE'):
+            self._count_fetched(cursor, 'rows_read')
+        elif ' RETURNING ' in sql.upper():
+            # rowcount is not reliable before the returned rows are read
+            self._count_fetched(cursor, 'rows_written')
+        else:
+            self.rows_written += max(cursor.rowcount, 0)
+        return result
+
+    def _count_fetched(self, cursor, counter):
+        """Rows are fetched after execute() returns, so count them on the way out of the cursor."""
+        def counting(fetch):
+            def counted(*args, **kwargs):
+                rows = fetch(*args, **kwargs)
+                if isinstance(rows, list):
+                    setattr(self, counter, getattr(self, counter) + len(rows))
+                elif rows is not None:
+                    setattr(self, counter, getattr(self, counter) + 1)
+                return rows
+            return counted
+
+        for name in ('fetchone', 'fetchmany', 'fetchall'):
+            setattr(cursor, name, counting(getattr(cursor, name)))
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the tracker hot paths (run creation, update_stage, summary, trend, calculate_run_score) '
+            'on seeded pipelines of every --stages x --substages x --history combination. All data is created '
+            'in a scratch database (as the test runner creates it) that is destroyed afterwards, so every '
+            'write really commits. Use --json to save results and --baseline to compare.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stages', type=int_list, default=[3, 10], help='Stages per pipeline (default 3,10)')
+        parser.add_argument('--substages', type=int_list, default=[3], help='Substages per stage (default 3)')
+        parser.add_argument('--history', type=int_list, default=[100, 1000],
+                            help='Finished runs seeded per pipeline (default 100,1000)')
+        parser.add_argument('--iterations', type=int, default=50, help='Timed calls per operation (default 50)')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed calls per operation first (default 3)')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for datasets and inputs (default 0)')
+        parser.add_argument('--json', action='store_true', help='Emit machine-readable JSON instead of a table')
+        parser.add_argument('--baseline', help='JSON output of an earlier run; fail on query count or latency regressions')
+        parser.add_argument('--max-slowdown', type=float, default=0.25,
+                            help='Allowed relative p50 latency increase over the baseline (default 0.25)')
+        parser.add_argument('--min-slowdown-ms', type=float, default=1.0,
+                            help='Ignore p50 latency increases smaller than this many ms (default 1.0)')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be positive')
+        baseline = self._load_baseline(options['baseline']) if options['baseline'] else None
+        rng = random.Random(options['seed'])
+
+        self.client = Client()
+        results = []
+        # Result writes must hit the database synchronously, and the test client uses the 'testserver' host
+        with tempfile.TemporaryDirectory() as scratch_dir, override_settings(
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+            TRACKER_WRITE_BUFFER={**getattr(settings, 'TRACKER_WRITE_BUFFER', {}), 'ENABLED': False},
+        ):
+            old_config = self._setup_scratch_database(scratch_dir)
+            try:
+                for stages, substages, history in itertools.product(options['stages'], options['substages'], options['history']):
+                    scenario = {'stages': stages, 'substages': substages, 'history': history}
+                    dataset = self._seed(scenario, options['seed'])
+                    for operation in OPERATIONS:
+                        results.append({
+                            'scenario': scenario,
+                            'operation': operation,
+                            **self._measure(getattr(self, f'_op_{operation}'), dataset, rng, options['iterations'], options['warmup']),
+                        })
+                    if not options['json']:
+                        self._print_scenario(scenario, results[-len(OPERATIONS):])
+            finally:
+                teardown_databases(old_config, verbosity=0)
+
+        report = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'database': connection.vendor,
+                'iterations': options['iterations'],
+                'seed': options['seed'],
+            },
+            'results': results,
+        }
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        if baseline is not None:
+            self._compare(baseline, results, options['max_slowdown'], options['min_slowdown_ms'])
+
+    def _setup_scratch_database(self, scratch_dir):
+        """Create and migrate a ``test_``-prefixed copy of the default database and switch to it.
+
+        Writes commit for real, so on_commit hooks run and the commit (WAL append, fsync) is part of
+        every measured write; a rolled-back outer transaction would also hold the SQLite write lock
+        throughout. SQLite's test database is in memory by default, so it is put in ``scratch_dir``.
+        """
+        test_settings = connection.settings_dict['TEST']
+        if connection.vendor == 'sqlite' and not test_settings.get('NAME'):
+            test_settings['NAME'] = f'{scratch_dir}/benchmark.sqlite3'
+        return setup_databases(verbosity=0, interactive=False, aliases={DEFAULT_DB_ALIAS}, serialized_aliases=set())
+
+    def _seed(self, scenario, seed):
+        """Create a pipeline of the scenario's shape with ``history`` finished runs (see simulate_run).
+
+        Returns the ids the operations pick their inputs from.
+        """
+        org = Organization.objects.create(name='benchmark')
+        project = Project.objects.create(team=Team.objects.create(organization=org, name='benchmark'), name='benchmark')
+        pipeline = Pipeline.objects.create(project=project, name=f'benchmark {scenario}')
+        stages = Stage.objects.bulk_create([
+            Stage(pipeline=pipeline, name=f'stage {i}', weight=1.0 / scenario['stages'], order=i)
+            for i in range(scenario['stages'])
+        ])
+        SubStage.objects.bulk_create([
+            SubStage(stage=stage, name=f'substage {j}', weight=1.0 / scenario['substages'], order=j)
+            for stage in stages
+            for j in range(scenario['substages'])
+        ])
+        if scenario['history']:
+            call_command('simulate_run', pipeline.id, runs=scenario['history'], seed=seed, stdout=io.StringIO())
+        pipeline.refresh_from_db()
+        run_ids = list(pipeline.runs.values_list('id', flat=True))
+        live_run = Run.objects.create(pipeline=pipeline, triggered_by='benchmark')
+        return {
+            'pipeline_id': pipeline.id,
+            'run_ids': run_ids or [live_run.id],
+            'live_run_id': live_run.id,
+            'substage_ids': list(
+                SubStageResult.objects.filter(stage_result__run=live_run).values_list('substage_id', flat=True)
+            ),
+        }
+
+    def _measure(self, operation, dataset, rng, iterations, warmup):
+        for _ in range(warmup):
+            operation(dataset, rng)
+        latencies, queries, rows_read, rows_written = [], [], [], []
+        for _ in range(iterations):
+            meter = QueryMeter()
+            with connection.execute_wrapper(meter):
+                started = time.perf_counter()
+                operation(dataset, rng)
+                latencies.append((time.perf_counter() - started) * 1000.0)
+            queries.append(meter.queries)
+            rows_read.append(meter.rows_read)
+            rows_written.append(meter.rows_written)
+
+        latencies.sort()
+        pick = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))]  # noqa: E731
+        return {
+            'calls': iterations,
+            'mean_ms': round(statistics.mean(latencies), 3),
+            'p50_ms': round(pick(0.50), 3),
+            'p90_ms': round(pick(0.90), 3),
+            'p99_ms': round(pick(0.99), 3),
+            'max_ms': round(latencies[-1], 3),
+            'queries_mean': round(statistics.mean(queries), 2),
+            'queries_max': max(queries),
+            'rows_read_mean': round(statistics.mean(rows_read), 1),
+            'rows_written_mean': round(statistics.mean(rows_written), 1),
+        }
+
+    def _request(self, method, path, data=None):
+        if method == 'post':
+            response = self.client.post(path, data=json.dumps(data), content_type='application/json')
+        else:
+            response = self.client.get(path)
+        if response.status_code >= 300:
+            raise CommandError(f'{method.upper()} {path} returned {response.status_code}')
+        return response
+
+    def _op_create_run(self, dataset, rng):
+        self._request('post', '/api/runs/', {'pipeline': dataset['pipeline_id'], 'triggered_by': 'benchmark'})
+
+    def _op_update_stage(self, dataset, rng):
+        if not dataset['substage_ids']:
+            raise CommandError('update_stage needs pipelines with substages (--substages > 0)')
+        self._request('post', f"/api/runs/{dataset['live_run_id']}/update_stage/", {
+            'substage_id': rng.choice(dataset['substage_ids']),
+            'completion_percent': rng.choice([10, 25, 50, 75, 100]),
+        })
+
+    def _op_summary(self, dataset, rng):
+        self._request('get', f"/api/runs/{rng.choice(dataset['run_ids'])}/summary/")
+
+    def _op_trend(self, dataset, rng):
+        self._request('get', f"/api/pipelines/{dataset['pipeline_id']}/trend/?n=10")
+
+    def _op_trend_buckets(self, dataset, rng):
+        self._request('get', f"/api/pipelines/{dataset['pipeline_id']}/trend/?bucket=day")
+
+    def _op_calculate_run_score(self, dataset, rng):
+        calculate_run_score(rng.choice(dataset['run_ids']))
+
+    def _print_scenario(self, scenario, results):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"\n{scenario['stages']} stages x {scenario['substages']} substages, {scenario['history']} runs of history"
+        ))
+        for r in results:
+            self.stdout.write(
+                f"{r['operation']:>20}: p50 {r['p50_ms']:8.2f} ms  p90 {r['p90_ms']:8.2f} ms  p99 {r['p99_ms']:8.2f} ms  "
+                f"queries {r['queries_mean']:6.1f}  rows read {r['rows_read_mean']:8.1f}  written {r['rows_written_mean']:6.1f}"
+            )
+
+    def _load_baseline(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Failed to read baseline {path}: {e}')
+
+    def _compare(self, baseline, results, max_slowdown, min_slowdown_ms):
+        """Fail if an operation issues more queries, or is slower at p50 than allowed, than in ``baseline``."""
+        key = lambda r: (tuple(sorted(r['scenario'].items())), r['operation'])  # noqa: E731
+        previous = {key(r): r for r in baseline.get('results', [])}
+        regressions = []
+        for r in results:
+            old = previous.get(key(r))
+            if old is None:
+                continue
+            label = f"{r['operation']} {r['scenario']}"
+            if r['queries_max'] > old['queries_max']:
+                regressions.append(f"{label}: queries {old['queries_max']} -> {r['queries_max']}")
+            slowdown = r['p50_ms'] - old['p50_ms']
+            if slowdown > old['p50_ms'] * max_slowdown and slowdown >= min_slowdown_ms:
+                regressions.append(f"{label}: p50 {old['p50_ms']:.2f} ms -> {r['p50_ms']:.2f} ms")
+        for line in regressions:
+            self.stderr.write(line)
+        if regressions:
+            raise CommandError(f'{len(regressions)} regressions against the baseline')
+        self.stderr.write(self.style.SUCCESS(f'No regressions against the baseline ({len(previous)} results)'))
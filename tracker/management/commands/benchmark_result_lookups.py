@@ -0,0 +1,70 @@
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from tracker.models import StageResult, SubStageResult
+
+
+class Command(BaseCommand):
+    help = ('Show the query plan and latency of the update_stage result lookups on a seeded database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=200, help='Number of timed lookups per query (default 200)')
+        parser.add_argument('--seed', type=int, help='Random seed for picking sample rows')
+
+    def handle(self, *args, **options):
+        samples = options['samples']
+        rng = random.Random(options.get('seed'))
+        substage_pairs = self._sample(SubStageResult, 'stage_result__run_id', 'substage_id', samples, rng)
+        stage_pairs = self._sample(StageResult, 'run_id', 'stage_id', samples, rng)
+        if not substage_pairs or not stage_pairs:
+            raise CommandError('No results to sample; seed the database first (e.g. simulate_run)')
+
+        self._report_indexes()
+        self._benchmark(
+            'SubStageResult by substage_id + run (SubStageResult.objects.of_run)',
+            lambda run_id, substage_id: SubStageResult.objects.of_run(run_id).filter(substage_id=substage_id),
+            substage_pairs,
+        )
+        self._benchmark(
+            'StageResult by stage_id + run',
+            lambda run_id, stage_id: StageResult.objects.filter(stage_id=stage_id, run_id=run_id),
+            stage_pairs,
+        )
+
+    def _sample(self, model, run_field, target_field, samples, rng):
+        """Pick (run_id, target_id) pairs by seeking to random primary keys (no ORDER BY RANDOM scans)."""
+        bounds = model.objects.order_by('id').values_list('id', flat=True)
+        low, high = bounds.first(), bounds.last()
+        if low is None:
+            return []
+        pairs = []
+        for _ in range(samples):
+            row = model.objects.filter(id__gte=rng.randint(low, high)).order_by('id').values_list(run_field, target_field).first()
+            pairs.append(row)
+        return pairs
+
+    def _report_indexes(self):
+        with connection.cursor() as cursor:
+            for model in (StageResult, SubStageResult):
+                constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+                names = sorted(name for name, info in constraints.items() if info['index'] and not info['primary_key'])
+                self.stdout.write(f'{model._meta.db_table} indexes: {", ".join(names) or "(none)"}')
+        self.stdout.write(f'Rows: {StageResult.objects.count()} stage results, {SubStageResult.objects.count()} substage results')
+
+    def _benchmark(self, label, build_query, pairs):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'\n{label}'))
+        self.stdout.write(build_query(*pairs[0]).explain())
+
+        timings = []
+        for run_id, target_id in pairs:
+            started = time.perf_counter()
+            list(build_query(run_id, target_id))
+            timings.append((time.perf_counter() - started) * 1000.0)
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(
+            f'{len(timings)} lookups: mean {statistics.mean(timings):.3f} ms, '
+            f'p50 {statistics.median(timings):.3f} ms, p95 {p95:.3f} ms, max {timings[-1]:.3f} ms'
+        )
@@ -0,0 +1,196 @@
+import json
+import logging
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.test import Client
+from django.test.utils import override_settings
+from tracker.models import Organization, Pipeline, Project, Run, Stage, StageResult, SubStage, SubStageResult, Team
+from tracker.services import calculate_run_score
+
+# Attempts per update with --if-match before it counts as an error
+MAX_CONFLICT_RETRIES = 100
+
+
+class Command(BaseCommand):
+    help = ('Check the configured database under concurrent writers: N threads post update_stage to shared '
+            'runs, each on its own connection (with --batch, every other request is an update_stages batch). '
+            'Every substage is owned by one writer, so its final value is '
+            'known; reports "database is locked" and other errors, latency, lost writes, stage rollups and '
+            'run scores that no longer match their results. Scratch data is deleted afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8, help='Concurrent writer threads (default 8)')
+        parser.add_argument('--updates', type=int, default=50, help='update_stage calls per writer (default 50)')
+        parser.add_argument('--runs', type=int, default=2, help='Runs the writers share (default 2)')
+        parser.add_argument('--substages', type=int, default=10, help='Substages per stage of the scratch pipeline (default 10)')
+        parser.add_argument('--batch', type=int, default=1,
+                            help='Substages per update_stages request; above 1, writers alternate update_stage and '
+                                 'update_stages so both lock paths interleave (default 1: update_stage only)')
+        parser.add_argument('--seed', type=int, help='Random seed for the generated updates')
+        parser.add_argument('--if-match', action='store_true',
+                            help='Send the last seen run ETag as If-Match and retry on 412, like an optimistic client')
+        parser.add_argument('--json', action='store_true', help='Emit machine-readable JSON instead of text')
+
+    def handle(self, *args, **options):
+        if min(options['writers'], options['updates'], options['runs'], options['substages'], options['batch']) < 1:
+            raise CommandError('--writers, --updates, --runs, --substages and --batch must be positive')
+        org = self._seed(options['runs'], options['substages'])
+        try:
+            # Result writes must hit the database synchronously, and the test client uses the 'testserver' host
+            with override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                TRACKER_WRITE_BUFFER={**getattr(settings, 'TRACKER_WRITE_BUFFER', {}), 'ENABLED': False},
+            ):
+                report, expected = self._run_writers(org, options)
+            report['lost_writes'] = self._check_writes(expected)
+            report['stale_stages'] = self._check_stages(org)
+            report['inconsistent_scores'] = self._check_scores(org)
+        finally:
+            org.delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.stdout.write(
+                f"{report['database']}: {report['writers']} writers x {report['updates']} updates in {report['seconds']:.1f}s "
+                f"({report['throughput_rps']:.0f} updates/s), p50 {report['p50_ms']:.1f} ms, p99 {report['p99_ms']:.1f} ms\n"
+                f"database is locked: {report['locked']}, other errors: {report['errors']}, "
+                f"If-Match conflicts retried: {report['conflicts']}\n"
+                f"lost writes: {report['lost_writes']}, stale stage rollups: {report['stale_stages']}, "
+                f"runs with a stale score: {report['inconsistent_scores']}"
+            )
+        if any(report[key] for key in ('locked', 'errors', 'lost_writes', 'stale_stages', 'inconsistent_scores')):
+            raise CommandError('Concurrent writers failed; see the report above')
+
+    def _seed(self, runs, substages):
+        org = Organization.objects.create(name='check_concurrency')
+        project = Project.objects.create(team=Team.objects.create(organization=org, name='check_concurrency'), name='check_concurrency')
+        pipeline = Pipeline.objects.create(project=project, name='check_concurrency')
+        for i in range(2):
+            stage = Stage.objects.create(pipeline=pipeline, name=f'stage {i}', weight=0.5, order=i)
+            SubStage.objects.bulk_create([
+                SubStage(stage=stage, name=f'substage {j}', weight=1.0 / substages, order=j) for j in range(substages)
+            ])
+        for _ in range(runs):
+            Run.objects.create(pipeline=pipeline, triggered_by='check_concurrency')
+        return org
+
+    def _run_writers(self, org, options):
+        targets = list(
+            SubStageResult.objects.filter(stage_result__run__pipeline__project__team__organization=org)
+            .order_by('id').values_list('id', 'stage_result__run_id', 'substage_id')
+        )
+        seed = options.get('seed')
+        latencies, locked, errors = [], [], []
+        conflicts = [0] * options['writers']
+        # Last acknowledged completion per substage result; each target has exactly one writer
+        expected = {}
+        start = threading.Barrier(options['writers'])
+
+        def writer(index):
+            rng = random.Random(f'{seed}:{index}') if seed is not None else random.Random()
+            owned = targets[index::options['writers']]
+            etags = {}
+            client = Client()
+            try:
+                start.wait()
+                for number in range(options['updates'] if owned else 0):
+                    run_id = rng.choice(owned)[1]
+                    if options['batch'] > 1 and number % 2:
+                        of_run = [target for target in owned if target[1] == run_id]
+                        picked = rng.sample(of_run, min(options['batch'], len(of_run)))
+                    else:
+                        picked = [rng.choice([target for target in owned if target[1] == run_id])]
+                    percents = {result_id: round(rng.uniform(0, 100), 3) for result_id, _, _ in picked}
+                    updates = [
+                        {'substage_id': substage_id, 'completion_percent': percents[result_id]}
+                        for result_id, _, substage_id in picked
+                    ]
+                    path, payload = (
+                        ('update_stages', {'updates': updates}) if len(updates) > 1 else ('update_stage', updates[0])
+                    )
+                    started = time.perf_counter()
+                    try:
+                        for _ in range(MAX_CONFLICT_RETRIES):
+                            headers = {'If-Match': etags[run_id]} if options['if_match'] and etags.get(run_id) else {}
+                            response = client.post(
+                                f'/api/runs/{run_id}/{path}/',
+                                data=json.dumps(payload),
+                                content_type='application/json',
+                                headers=headers,
+                            )
+                            etags[run_id] = response.get('ETag')
+                            if response.status_code != 412:
+                                break
+                            conflicts[index] += 1
+                    except OperationalError as e:
+                        (locked if 'locked' in str(e) else errors).append(str(e))
+                        continue
+                    latencies.append((time.perf_counter() - started) * 1000.0)
+                    if response.status_code == 200:
+                        expected.update(percents)
+                    else:
+                        errors.append(f'HTTP {response.status_code}')
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(options['writers'])]
+        # Failed requests are counted in the report; don't log a traceback for each of them
+        request_logger = logging.getLogger('django.request')
+        previous_level = request_logger.level
+        request_logger.setLevel(logging.CRITICAL)
+        started = time.perf_counter()
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            request_logger.setLevel(previous_level)
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        pick = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] if latencies else 0.0  # noqa: E731
+        return {
+            'database': connection.vendor,
+            'writers': options['writers'],
+            'batch': options['batch'],
+            'updates': options['writers'] * options['updates'],
+            'seconds': round(elapsed, 3),
+            'throughput_rps': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(pick(0.50), 3),
+            'p99_ms': round(pick(0.99), 3),
+            'mean_ms': round(statistics.mean(latencies), 3) if latencies else 0.0,
+            'locked': len(locked),
+            'errors': len(errors),
+            'conflicts': sum(conflicts),
+            'error_samples': sorted(set(locked + errors))[:5],
+        }, expected
+
+    def _check_writes(self, expected):
+        """Substage results whose stored completion is not the last value acknowledged to their writer."""
+        stored = dict(SubStageResult.objects.filter(id__in=expected).values_list('id', 'completion_percent'))
+        return sum(1 for result_id, percent in expected.items() if abs(stored.get(result_id, -1.0) - percent) > 1e-9)
+
+    def _check_stages(self, org):
+        """Stage results whose completion differs from the weighted mean of their substages."""
+        totals = defaultdict(lambda: [0.0, 0.0])
+        for stage_result_id, weight, percent in SubStageResult.objects.filter(
+            stage_result__run__pipeline__project__team__organization=org,
+        ).values_list('stage_result_id', 'weight', 'completion_percent'):
+            totals[stage_result_id][0] += weight * percent
+            totals[stage_result_id][1] += weight
+        stages = StageResult.objects.filter(id__in=totals).values_list('id', 'completion_percent')
+        return sum(1 for stage_result_id, stored in stages
+                   if abs(totals[stage_result_id][0] / totals[stage_result_id][1] - stored) > 1e-6)
+
+    def _check_scores(self, org):
+        """Runs whose stored score differs from the score computed from their results."""
+        runs = Run.objects.filter(pipeline__project__team__organization=org).values_list('id', 'score')
+        return sum(1 for run_id, stored in runs if abs(calculate_run_score(run_id) - stored) > 1e-9)
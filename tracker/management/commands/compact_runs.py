@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from tracker.models import Pipeline
+from tracker.retention import COMPACT_BATCH_SIZE, compact_pipeline_runs, compactable_runs
+
+
+class Command(BaseCommand):
+    help = ('Compact finished runs beyond each pipeline\'s retention policy (retention_days / retention_runs) '
+            'into summary rows, deleting their stage/substage results in batches. Safe to run periodically.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pipeline-id', type=int, help='Only compact runs of this pipeline (optional)')
+        parser.add_argument('--batch-size', type=int, default=COMPACT_BATCH_SIZE,
+                            help=f'Runs per transaction (default {COMPACT_BATCH_SIZE})')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many runs would be compacted')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        pipelines = Pipeline.objects.filter(Q(retention_days__isnull=False) | Q(retention_runs__isnull=False)).order_by('id')
+        if options.get('pipeline_id'):
+            if not Pipeline.objects.filter(id=options['pipeline_id']).exists():
+                raise CommandError(f"Pipeline id={options['pipeline_id']} not found")
+            pipelines = pipelines.filter(id=options['pipeline_id'])
+
+        total = 0
+        for pipeline in pipelines:
+            if options['dry_run']:
+                compacted = compactable_runs(pipeline).count()
+            else:
+                compacted = sum(compact_pipeline_runs(pipeline, batch_size=options['batch_size']))
+            total += compacted
+            if compacted:
+                self.stdout.write(f'Pipeline "{pipeline.name}": {compacted} runs')
+
+        verb = 'Would compact' if options['dry_run'] else 'Compacted'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {total} runs'))
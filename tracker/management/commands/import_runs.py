@@ -0,0 +1,39 @@
+import sys
+from contextlib import nullcontext
+from django.core.management.base import BaseCommand, CommandError
+from tracker.models import Pipeline
+from tracker.transfer import IMPORT_BATCH_SIZE, import_run_lines
+
+
+class Command(BaseCommand):
+    help = ('Import runs with their stage/substage results from NDJSON written by GET /api/runs/export/. '
+            'Stages and substages are matched by name; each batch is one transaction.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='NDJSON file to import, or - for stdin')
+        parser.add_argument('--pipeline-id', type=int,
+                            help='Import every run into this pipeline (default: the pipeline with the exported name)')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+                            help=f'Runs per INSERT batch/transaction (default {IMPORT_BATCH_SIZE})')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        pipeline = None
+        if options.get('pipeline_id'):
+            pipeline = Pipeline.objects.filter(id=options['pipeline_id']).first()
+            if pipeline is None:
+                raise CommandError(f"Pipeline id={options['pipeline_id']} not found")
+
+        imported = 0
+        try:
+            with (nullcontext(sys.stdin) if options['path'] == '-' else open(options['path'], encoding='utf-8')) as lines:
+                for count in import_run_lines(lines, pipeline=pipeline, batch_size=options['batch_size']):
+                    imported += count
+                    self.stdout.write(f'{imported} runs imported')
+        except OSError as e:
+            raise CommandError(f"Failed to read {options['path']}: {e}")
+        except ValueError as e:
+            raise CommandError(f'{e} ({imported} runs imported before it)')
+
+        self.stdout.write(self.style.SUCCESS(f'Imported {imported} runs'))
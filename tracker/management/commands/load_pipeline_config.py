@@ -1,19 +1,81 @@
 import json
+from pathlib import Path
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
-from tracker.models import Pipeline, Stage, SubStage, Project
+from django.db.models import F
+from tracker.models import Pipeline, PipelineVersion, Stage, SubStage, Project
+from tracker.services import DEFINITION_FIELDS, definition_hash, pipeline_definition
+
+STAGE_FIELDS = [*DEFINITION_FIELDS, 'archived']
+
+
+def stage_values(s, order):
+    return {
+        'weight': float(s.get('weight', 0.0)),
+        'order': order,
+        'definition_of_done': s.get('definition_of_done', ''),
+        'auto_check_endpoint': s.get('endpoint', '') or s.get('auto_check_endpoint', ''),
+        'dod_type': s.get('type', 'manual'),
+        'archived': False,
+    }
+
+
+def substage_values(ss, order):
+    return {
+        'weight': float(ss.get('weight', 0.0)),
+        'order': order,
+        'definition_of_done': ss.get('definition_of_done', ''),
+        'auto_check_endpoint': ss.get('endpoint', ''),
+        'dod_type': ss.get('type', 'manual'),
+        'archived': False,
+    }
+
+
+def by_name(items, what):
+    names = [item['name'] for item in items]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise CommandError(f'Duplicate {what} names in JSON: {", ".join(duplicates)}')
+    return {item['name']: item for item in items}
 
 
 class Command(BaseCommand):
-    help = 'Load or update a pipeline configuration from JSON file'
+    help = ('Load or update pipeline configuration(s) from a JSON file or a directory of JSON files. '
+            'Each distinct config is stored as a content-hashed PipelineVersion; reloading an unchanged '
+            'config is a no-op. Stages/substages missing from the JSON are archived: they leave the definition '
+            'but keep their historical results and trends, and are restored if they reappear.')
 
     def add_arguments(self, parser):
-        parser.add_argument('path', type=str, help='Path to pipeline JSON file')
+        parser.add_argument('path', type=str, help='Path to a pipeline JSON file, or a directory of them (e.g. configs/)')
         parser.add_argument('--project-id', type=int, help='Project id to attach pipeline to (optional)')
 
     def handle(self, *args, **options):
-        path = options['path']
+        path = Path(options['path'])
         project_id = options.get('project_id')
+
+        project = None
+        if project_id:
+            project = Project.objects.filter(id=project_id).first()
+            if not project:
+                raise CommandError(f'Project id={project_id} not found')
+
+        paths = sorted(path.glob('*.json')) if path.is_dir() else [path]
+        if not paths:
+            raise CommandError(f'No JSON files found in {path}')
+
+        failures = []
+        for config_path in paths:
+            try:
+                self.load(config_path, project)
+            except CommandError as e:
+                if len(paths) == 1:
+                    raise
+                failures.append(config_path)
+                self.stderr.write(f'{config_path}: {e}')
+        if failures:
+            raise CommandError(f'{len(failures)} of {len(paths)} configs failed to load')
+
+    def load(self, path, project):
         try:
             with open(path, 'r') as f:
                 cfg = json.load(f)
@@ -23,45 +85,121 @@ class Command(BaseCommand):
         pipeline_name = cfg.get('pipeline_name') or cfg.get('name')
         if not pipeline_name:
             raise CommandError('pipeline_name required in JSON')
-
-        project = None
-        if project_id:
-            project = Project.objects.filter(id=project_id).first()
-            if not project:
-                raise CommandError(f'Project id={project_id} not found')
+        stages_cfg = by_name(cfg.get('stages', []), 'stage')
 
         with transaction.atomic():
-            # Create or update pipeline
-            pipeline, _ = Pipeline.objects.get_or_create(name=pipeline_name, defaults={'project': project or Project.objects.first(), 'description': cfg.get('description', '')})
-            pipeline.description = cfg.get('description', pipeline.description)
-            pipeline.save()
-
-            # Stage ordering and creation
-            stages_cfg = cfg.get('stages', [])
-            for s_idx, s in enumerate(stages_cfg, start=1):
-                stage_obj, created = Stage.objects.update_or_create(
-                    pipeline=pipeline,
-                    name=s['name'],
-                    defaults={
-                        'weight': float(s.get('weight', 0.0)),
-                        'order': s_idx,
-                        'definition_of_done': s.get('definition_of_done', ''),
-                        'auto_check_endpoint': s.get('endpoint', '') or s.get('auto_check_endpoint', ''),
-                        'dod_type': s.get('type', 'manual')
-                    }
-                )
-                # Substages
-                for ss_idx, ss in enumerate(s.get('substages', []), start=1):
-                    SubStage.objects.update_or_create(
-                        stage=stage_obj,
-                        name=ss['name'],
-                        defaults={
-                            'weight': float(ss.get('weight', 0.0)),
-                            'order': ss_idx,
-                            'definition_of_done': ss.get('definition_of_done', ''),
-                            'auto_check_endpoint': ss.get('endpoint', ''),
-                            'dod_type': ss.get('type', 'manual')
-                        }
+            pipelines = Pipeline.objects.filter(name=pipeline_name)
+            if project:
+                pipelines = pipelines.filter(project=project)
+            pipeline = pipelines.select_for_update().first()
+            if pipeline is None:
+                owner = project or Project.objects.first()
+                if owner is None:
+                    raise CommandError('No project exists to attach the pipeline to')
+                pipeline = Pipeline(name=pipeline_name, project=owner, description='')
+            changed_fields = {
+                field: cfg[field] for field in ('description', 'version')
+                if field in cfg and cfg[field] != getattr(pipeline, field)
+            }
+            for field, value in changed_fields.items():
+                setattr(pipeline, field, value)
+
+            definition = self.definition(pipeline, stages_cfg)
+            content_hash = definition_hash(definition)
+            if pipeline.pk and pipeline.content_hash == content_hash:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Pipeline "{pipeline_name}" unchanged (version {content_hash[:12]})'
+                ))
+                return
+
+            if pipeline.pk is None or changed_fields:
+                pipeline.save()
+            stats = self.apply_diff(pipeline, stages_cfg)
+            PipelineVersion.objects.get_or_create(
+                pipeline=pipeline, content_hash=content_hash, defaults={'definition': definition}
+            )
+            # bulk operations bypass the Stage/SubStage signals that normally bump structure_version
+            Pipeline.objects.filter(pk=pipeline.pk).update(
+                structure_version=F('structure_version') + 1, content_hash=content_hash
+            )
+
+        summary = ', '.join(f'{count} {key}' for key, count in stats.items() if count) or 'no changes'
+        self.stdout.write(self.style.SUCCESS(
+            f'Loaded/updated pipeline "{pipeline_name}" as version {content_hash[:12]} ({summary})'
+        ))
+
+    def definition(self, pipeline, stages_cfg):
+        """The PipelineVersion definition of the JSON config, hashed the same way as stored pipelines."""
+        return pipeline_definition(pipeline, [
+            {
+                'name': name,
+                **stage_values(s, s_idx),
+                'substages': [
+                    {'name': sub_name, **substage_values(ss, ss_idx)}
+                    for ss_idx, (sub_name, ss) in enumerate(
+                        by_name(s.get('substages', []), f'substage (stage "{name}")').items(), start=1
                     )
+                ],
+            }
+            for s_idx, (name, s) in enumerate(stages_cfg.items(), start=1)
+        ])
+
+    def apply_diff(self, pipeline, stages_cfg):
+        """Diff the JSON against the stored stages/substages and apply it with bulk operations."""
+        stats = dict.fromkeys(
+            ['stages created', 'stages updated', 'stages archived',
+             'substages created', 'substages updated', 'substages archived'], 0)
+        existing = {stage.name: stage for stage in pipeline.stages.prefetch_related('substages')}
+
+        # Archive rather than delete: a delete would cascade to the results of every past run
+        removed = [stage.pk for name, stage in existing.items() if name not in stages_cfg and not stage.archived]
+        if removed:
+            stats['stages archived'] = len(removed)
+            Stage.objects.filter(pk__in=removed).update(archived=True)
+
+        new_stages, changed_stages = [], []
+        for s_idx, (name, s) in enumerate(stages_cfg.items(), start=1):
+            values = stage_values(s, s_idx)
+            stage = existing.get(name)
+            if stage is None:
+                new_stages.append(Stage(pipeline=pipeline, name=name, **values))
+            elif any(getattr(stage, field) != value for field, value in values.items()):
+                for field, value in values.items():
+                    setattr(stage, field, value)
+                changed_stages.append(stage)
+        Stage.objects.bulk_create(new_stages)
+        Stage.objects.bulk_update(changed_stages, STAGE_FIELDS)
+        stats['stages created'] = len(new_stages)
+        stats['stages updated'] = len(changed_stages)
+        if any(stage.pk is None for stage in new_stages):
+            # Backends that cannot return ids from a bulk INSERT
+            new_stages = list(pipeline.stages.filter(name__in=[stage.name for stage in new_stages]))
+        stages = {**existing, **{stage.name: stage for stage in new_stages}}
 
-            self.stdout.write(self.style.SUCCESS(f'Loaded/updated pipeline "{pipeline_name}"'))
+        new_substages, changed_substages, removed_substages = [], [], []
+        for name, s in stages_cfg.items():
+            stage = stages[name]
+            # substages of pre-existing stages were prefetched above; new stages have none yet
+            current = {sub.name: sub for sub in stage.substages.all()} if name in existing else {}
+            substages_cfg = by_name(s.get('substages', []), f'substage (stage "{name}")')
+            removed_substages.extend(
+                sub.pk for sub_name, sub in current.items() if sub_name not in substages_cfg and not sub.archived
+            )
+            for ss_idx, (sub_name, ss) in enumerate(substages_cfg.items(), start=1):
+                values = substage_values(ss, ss_idx)
+                sub = current.get(sub_name)
+                if sub is None:
+                    new_substages.append(SubStage(stage=stage, name=sub_name, **values))
+                elif any(getattr(sub, field) != value for field, value in values.items()):
+                    for field, value in values.items():
+                        setattr(sub, field, value)
+                    changed_substages.append(sub)
+        if removed_substages:
+            SubStage.objects.filter(pk__in=removed_substages).update(archived=True)
+        SubStage.objects.bulk_create(new_substages)
+        SubStage.objects.bulk_update(changed_substages, STAGE_FIELDS)
+        stats['substages created'] = len(new_substages)
+        stats['substages updated'] = len(changed_substages)
+        stats['substages archived'] = len(removed_substages)
+        # Weight changes only apply to new runs; existing results keep their pinned weights
+        return stats
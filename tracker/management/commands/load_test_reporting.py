@@ -0,0 +1,116 @@
+import asyncio
+import json
+import random
+import statistics
+import time
+import urllib.request
+from urllib.parse import urlsplit
+from django.core.management.base import BaseCommand, CommandError
+
+ENDPOINTS = {
+    'sync': '/api/runs/{run_id}/update_stage/',
+    'async': '/api/async/runs/{run_id}/update_stage/',
+}
+
+
+class Command(BaseCommand):
+    help = ('Load test update_stage reporting against a running server, comparing the sync (DRF) and '
+            'async endpoints. Serve project.asgi:application (e.g. with uvicorn) so both run under ASGI.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Base URL of the running server')
+        parser.add_argument('--pipeline-id', type=int, default=1, help='Pipeline to create the test run for')
+        parser.add_argument('--clients', type=int, default=500, help='Concurrent reporting clients (default 500)')
+        parser.add_argument('--requests', type=int, default=10, help='Requests per client (default 10)')
+        parser.add_argument('--mode', choices=['sync', 'async', 'both'], default='both')
+        parser.add_argument('--seed', type=int, help='Random seed for the generated updates')
+        parser.add_argument('--json', action='store_true', help='Emit machine-readable JSON instead of a table')
+
+    def handle(self, *args, **options):
+        base = options['url'].rstrip('/')
+        rng = random.Random(options.get('seed'))
+        run_id, substage_ids = self._create_run(base, options['pipeline_id'])
+        modes = ['sync', 'async'] if options['mode'] == 'both' else [options['mode']]
+
+        results = {}
+        for mode in modes:
+            path = ENDPOINTS[mode].format(run_id=run_id)
+            results[mode] = asyncio.run(
+                self._load(base, path, substage_ids, options['clients'], options['requests'], rng)
+            )
+
+        if options['json']:
+            self.stdout.write(json.dumps({'run_id': run_id, 'clients': options['clients'], 'results': results}, indent=2))
+            return
+        self.stdout.write(f'run id={run_id}, {options["clients"]} clients x {options["requests"]} requests')
+        for mode, r in results.items():
+            self.stdout.write(
+                f'{mode:>5}: {r["throughput_rps"]:8.1f} req/s  p50 {r["p50_ms"]:7.1f} ms  '
+                f'p95 {r["p95_ms"]:7.1f} ms  p99 {r["p99_ms"]:7.1f} ms  errors {r["errors"]}'
+            )
+
+    def _create_run(self, base, pipeline_id):
+        body = json.dumps({'pipeline': pipeline_id, 'triggered_by': 'load_test_reporting'}).encode()
+        request = urllib.request.Request(f'{base}/api/runs/', data=body, headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request) as response:
+                run = json.load(response)
+        except OSError as e:
+            raise CommandError(f'Could not create a run at {base}: {e}')
+        substage_ids = [ssr['substage'] for sr in run['stage_results'] for ssr in sr['substage_results']]
+        if not substage_ids:
+            raise CommandError(f'Pipeline id={pipeline_id} has no substages to report on')
+        return run['id'], substage_ids
+
+    async def _load(self, base, path, substage_ids, clients, requests, rng):
+        target = urlsplit(base)
+        latencies = []
+        errors = 0
+
+        async def client():
+            nonlocal errors
+            for _ in range(requests):
+                body = json.dumps({
+                    'substage_id': rng.choice(substage_ids),
+                    'completion_percent': rng.choice([10, 25, 50, 75, 100]),
+                }).encode()
+                started = time.perf_counter()
+                try:
+                    status = await self._post(target, path, body)
+                except OSError:
+                    status = None
+                latencies.append((time.perf_counter() - started) * 1000.0)
+                if status != 200:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        pick = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))]  # noqa: E731
+        return {
+            'requests': len(latencies),
+            'errors': errors,
+            'elapsed_s': round(elapsed, 3),
+            'throughput_rps': round(len(latencies) / elapsed, 1),
+            'mean_ms': round(statistics.mean(latencies), 2),
+            'p50_ms': round(pick(0.50), 2),
+            'p95_ms': round(pick(0.95), 2),
+            'p99_ms': round(pick(0.99), 2),
+        }
+
+    async def _post(self, target, path, body):
+        """Minimal HTTP/1.1 POST over asyncio streams (one connection per request); returns the status code."""
+        reader, writer = await asyncio.open_connection(target.hostname, target.port or 80)
+        try:
+            writer.write(
+                f'POST {path} HTTP/1.1\r\nHost: {target.netloc}\r\nContent-Type: application/json\r\n'
+                f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body
+            )
+            await writer.drain()
+            status_line = await reader.readline()
+            await reader.read()
+            return int(status_line.split()[1])
+        finally:
+            writer.close()
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from tracker.models import Pipeline, Run, StageResult
+from tracker.services import refresh_run_scores, refresh_stage_contributions
+
+
+class Command(BaseCommand):
+    help = 'Backfill the stored Run.score / StageResult.weighted_score columns and verify them against calculate_run_score'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pipeline-id', type=int, help='Only process runs of this pipeline (optional)')
+        parser.add_argument('--verify-only', action='store_true', help='Do not write, only compare stored scores')
+        parser.add_argument('--tolerance', type=float, default=1e-9, help='Allowed absolute difference when verifying')
+
+    def handle(self, *args, **options):
+        pipeline_id = options.get('pipeline_id')
+        runs = Run.objects.all()
+        stage_results = StageResult.objects.all()
+        if pipeline_id:
+            if not Pipeline.objects.filter(id=pipeline_id).exists():
+                raise CommandError(f'Pipeline id={pipeline_id} not found')
+            runs = runs.filter(pipeline_id=pipeline_id)
+            stage_results = stage_results.filter(run__pipeline_id=pipeline_id)
+
+        if not options['verify_only']:
+            with transaction.atomic():
+                updated_results = refresh_stage_contributions(stage_results)
+                updated_runs = refresh_run_scores(runs)
+            self.stdout.write(f'Backfilled {updated_results} stage results and {updated_runs} runs')
+
+        mismatches = 0
+        checked = 0
+        # Same aggregation as services.calculate_run_score, for all runs in one query. Compacted
+        # runs have no results left to score; their stored score is authoritative.
+        verified = runs.filter(compacted=False).with_scores()
+        for run_id, stored, expected in verified.values_list('id', 'score', 'computed_score').iterator():
+            checked += 1
+            if abs(expected - stored) > options['tolerance']:
+                mismatches += 1
+                self.stderr.write(f'Run id={run_id}: stored score {stored:.6f} != computed {expected:.6f}')
+
+        if mismatches:
+            raise CommandError(f'{mismatches} of {checked} runs have a stale stored score')
+        self.stdout.write(self.style.SUCCESS(f'Verified stored scores for {checked} runs'))
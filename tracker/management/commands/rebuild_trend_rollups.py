@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from tracker.models import Pipeline, Run, TrendBucket
+from tracker.services import record_run_trend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the hourly/daily TrendBucket rollups from finished runs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pipeline-id', type=int, help='Only rebuild rollups of this pipeline (optional)')
+
+    def handle(self, *args, **options):
+        pipeline_id = options.get('pipeline_id')
+        runs = Run.objects.filter(end_time__isnull=False)
+        buckets = TrendBucket.objects.all()
+        if pipeline_id:
+            if not Pipeline.objects.filter(id=pipeline_id).exists():
+                raise CommandError(f'Pipeline id={pipeline_id} not found')
+            runs = runs.filter(pipeline_id=pipeline_id)
+            buckets = buckets.filter(pipeline_id=pipeline_id)
+
+        with transaction.atomic():
+            buckets.delete()
+            runs.update(trend_recorded=False)
+            recorded = sum(record_run_trend(run_id) for run_id in runs.values_list('id', flat=True).iterator())
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt trend rollups from {recorded} finished runs'))
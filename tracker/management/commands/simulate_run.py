@@ -1,49 +1,189 @@
 import random
-from django.core.management.base import BaseCommand
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
 from django.utils import timezone
 from tracker.models import Pipeline, Run, StageResult, SubStageResult
+from tracker.services import (
+    COMPLETE_PERCENT, add_trend_observation, bulk_add_trend_totals, completion_status, get_pipeline_version,
+    get_result_template, merge_trend_deltas, stage_contribution,
+)
+
+TRIGGERS = ('Jenkins', 'GitHub Actions', 'Nightly', 'Manual')
+# Seconds a substage (or a stage without substages) takes once started
+STEP_SECONDS = (30, 900)
+# Run ids per UPDATE when flagging the created runs as recorded in the trend rollups
+MARK_BATCH_SIZE = 5000
+
+
+def _rollup(weights_and_percents):
+    """Stage completion from (weight, completion_percent) pairs, as services.rollup_stage_results does."""
+    total_weight = sum(weight for weight, _ in weights_and_percents)
+    if total_weight:
+        return sum(weight * pct for weight, pct in weights_and_percents) / total_weight
+    return sum(pct for _, pct in weights_and_percents) / len(weights_and_percents)
+
+
+def _step(rng, clock, pct):
+    """(start, end, new clock) of one unit of work that reached ``pct`` percent, starting at ``clock``."""
+    if not pct:
+        return None, None, clock
+    end = clock + timedelta(seconds=rng.uniform(*STEP_SECONDS))
+    return clock, (end if pct >= COMPLETE_PERCENT else None), end
+
+
+def simulate_chunk(task):
+    """Create one batch of simulated runs with bulk INSERTs; runs in the worker processes.
+
+    Returns (ids of the created runs, TrendBucket totals of the batch). The totals are written by
+    the caller once for all batches, which keeps the number of bucket writes constant.
+    """
+    chunk_index, count, seed, pipelines, complete, days, now = task
+    rng = random.Random(f'{seed}:{chunk_index}') if seed is not None else random.Random()
+    runs, stage_rows, totals = [], [], {}
+
+    for _ in range(count):
+        pipeline_id, version_id, stages = rng.choice(pipelines)
+        start = now - timedelta(seconds=rng.uniform(0, days * 86400))
+        clock = start
+        results = []
+        for stage_id, weight, substages in stages:
+            sub_results = []
+            stage_start = None
+            for substage_id, sub_weight in substages:
+                pct = 100.0 if complete else rng.choice([0.0, 50.0, 100.0])
+                sub_start, sub_end, clock = _step(rng, clock, pct)
+                stage_start = stage_start or sub_start
+                sub_results.append(SubStageResult(
+                    substage_id=substage_id, weight=sub_weight, completion_percent=pct,
+                    status=completion_status(pct), start_time=sub_start, end_time=sub_end,
+                ))
+            if sub_results:
+                pct = _rollup([(sub.weight, sub.completion_percent) for sub in sub_results])
+                stage_end = clock if pct >= COMPLETE_PERCENT else None
+            else:
+                pct = 100.0 if complete else rng.choice([0.0, 50.0, 100.0])
+                stage_start, stage_end, clock = _step(rng, clock, pct)
+            results.append((StageResult(
+                stage_id=stage_id, weight=weight, completion_percent=pct, status=completion_status(pct),
+                weighted_score=stage_contribution(weight, pct), start_time=stage_start, end_time=stage_end,
+            ), sub_results))
+
+        total_weight = sum(sr.weight for sr, _ in results)
+        score = sum(sr.weighted_score for sr, _ in results) / total_weight if total_weight > 0 else 0.0
+        runs.append(Run(
+            pipeline_id=pipeline_id, pipeline_version_id=version_id, triggered_by=rng.choice(TRIGGERS),
+            start_time=start, end_time=clock, score=score,
+            status='completed' if score * 100.0 >= COMPLETE_PERCENT else 'failed',
+        ))
+        stage_rows.append(results)
+        add_trend_observation(totals, pipeline_id, None, start, score, (clock - start).total_seconds())
+        for sr, _ in results:
+            add_trend_observation(
+                totals, pipeline_id, sr.stage_id, start, sr.completion_percent / 100.0,
+                (sr.end_time - sr.start_time).total_seconds() if sr.start_time and sr.end_time else None,
+            )
+
+    # bulk_create bypasses the Run signals, so version pinning, results and score are all set here
+    with transaction.atomic():
+        Run.objects.bulk_create(runs)
+        for run, results in zip(runs, stage_rows):
+            for sr, _ in results:
+                sr.run_id = run.pk
+        StageResult.objects.bulk_create([sr for results in stage_rows for sr, _ in results])
+        sub_results = []
+        for results in stage_rows:
+            for sr, subs in results:
+                for sub in subs:
+                    sub.stage_result_id = sr.pk
+                sub_results.extend(subs)
+        SubStageResult.objects.bulk_create(sub_results)
+    return [run.pk for run in runs], totals
+
+
+def _init_worker():
+    django.setup()
+    connections.close_all()
 
 
 class Command(BaseCommand):
-    help = 'Simulate a run for a pipeline (creates a Run and random Stage/SubStage results)'
+    help = ('Simulate finished runs with random Stage/SubStage results (load generator). '
+            'Rows are written with bulk INSERTs in batches, optionally from several processes; '
+            '--workers > 1 needs a server database such as PostgreSQL.')
 
     def add_arguments(self, parser):
-        parser.add_argument('pipeline_id', type=int, help='Pipeline id to simulate')
+        parser.add_argument('pipeline_id', type=int, nargs='?',
+                            help='Pipeline id to simulate (default: every pipeline, e.g. all loaded from configs/)')
         parser.add_argument('--complete', action='store_true', help='Make all substages complete')
+        parser.add_argument('--runs', type=int, default=1, help='Number of runs to create (default 1)')
+        parser.add_argument('--workers', type=int, default=1, help='Worker processes writing batches (default 1)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Runs per INSERT batch/transaction (default 1000)')
+        parser.add_argument('--days', type=float, default=30.0, help='Spread run start times over the last N days (default 30)')
+        parser.add_argument('--seed', type=int, help='Random seed; the same seed and --batch-size create the same data')
 
     def handle(self, *args, **options):
-        pipeline_id = options['pipeline_id']
-        complete = options['complete']
-        pipeline = Pipeline.objects.filter(id=pipeline_id).first()
-        if not pipeline:
-            self.stderr.write(f'Pipeline id={pipeline_id} not found')
-            return
-
-        run = Run.objects.create(pipeline=pipeline, start_time=timezone.now(), status='running')
-        # StageResults and SubStageResults are created by signals
-        run.refresh_from_db()
-
-        for sr in run.stage_results.all():
-            for ssr in sr.substage_results.all():
-                if complete:
-                    val = 100.0
-                else:
-                    val = random.choice([0.0, 50.0, 100.0])
-                ssr.completion_percent = val
-                ssr.status = 'completed' if val >= 100.0 else ('partial' if val > 0 else 'pending')
-                ssr.save()
-
-            # aggregate stage completion as weighted average of substage completions
-            sub_vals = [x.completion_percent for x in sr.substage_results.all()]
-            if sub_vals:
-                sr.completion_percent = sum(sub_vals) / len(sub_vals)
-            else:
-                sr.completion_percent = 0.0
-            sr.status = 'completed' if sr.completion_percent >= 100.0 else ('partial' if sr.completion_percent > 0 else 'pending')
-            sr.save()
+        pipeline_id = options.get('pipeline_id')
+        runs, workers, batch_size = options['runs'], options['workers'], options['batch_size']
+        if min(runs, workers, batch_size) < 1:
+            raise CommandError('--runs, --workers and --batch-size must be positive')
+        if not connection.features.can_return_rows_from_bulk_insert:
+            raise CommandError(f'The {connection.vendor} backend does not return ids from bulk INSERTs')
+        if workers > 1 and connection.vendor == 'sqlite':
+            raise CommandError('SQLite allows a single writer; use --workers 1 or a server database')
+
+        pipelines = Pipeline.objects.order_by('id')
+        if pipeline_id:
+            pipelines = pipelines.filter(id=pipeline_id)
+        pipelines = list(pipelines)
+        if not pipelines:
+            raise CommandError(f'Pipeline id={pipeline_id} not found' if pipeline_id else 'No pipelines; load configs/ first')
+        # Resolve templates and versions once; workers only receive plain ids and weights
+        layouts = [(p.id, get_pipeline_version(p).id, get_result_template(p).stages) for p in pipelines]
+
+        now = timezone.now()
+        tasks = [
+            (index, min(batch_size, runs - offset), options.get('seed'), layouts, options['complete'], options['days'], now)
+            for index, offset in enumerate(range(0, runs, batch_size))
+        ]
+        started = time.perf_counter()
+        if workers == 1:
+            run_ids, totals = self._collect(map(simulate_chunk, tasks), runs)
+        else:
+            # Forked workers must not share the parent's database connections
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+                run_ids, totals = self._collect(pool.map(simulate_chunk, tasks), runs)
+
+        # Fold all runs into the rollups in one pass. Runs of an interrupted invocation stay
+        # unrecorded and are picked up by rebuild_trend_rollups.
+        with transaction.atomic():
+            bulk_add_trend_totals(totals)
+            for offset in range(0, len(run_ids), MARK_BATCH_SIZE):
+                Run.objects.filter(pk__in=run_ids[offset:offset + MARK_BATCH_SIZE]).update(trend_recorded=True)
 
-        run.status = 'completed'
-        run.end_time = timezone.now()
-        run.save()
+        created = len(run_ids)
+        if created == 1:
+            pipeline_id = Run.objects.values_list('pipeline_id', flat=True).get(pk=run_ids[0])
+            self.stdout.write(self.style.SUCCESS(f'Created simulated run id={run_ids[0]} (pipeline={pipeline_id})'))
+        else:
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(
+                f'Created {created} simulated runs across {len(pipelines)} pipelines in {elapsed:.1f}s '
+                f'({created / elapsed:.0f} runs/s)'
+            ))
 
-        self.stdout.write(self.style.SUCCESS(f'Created simulated run id={run.id} (pipeline={pipeline_id})'))
+    def _collect(self, results, total):
+        run_ids, reported, totals = [], 0, {}
+        for chunk_ids, chunk_totals in results:
+            run_ids.extend(chunk_ids)
+            created = len(run_ids)
+            for key, delta in chunk_totals.items():
+                totals[key] = merge_trend_deltas(totals[key], delta) if key in totals else delta
+            if created * 10 // total > reported:
+                reported = created * 10 // total
+                if reported < 10:
+                    self.stdout.write(f'{created}/{total} runs')
+        return run_ids, totals
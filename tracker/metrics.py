@@ -0,0 +1,154 @@
+"""Per-endpoint request metrics, exposed in the Prometheus text format at /metrics.
+
+RequestMetricsMiddleware (see tracker/middleware.py) measures every request: wall time, number
+and duration of database queries, serialization time (building serializer ``.data`` plus JSON
+rendering, recorded through ``record_time``) and response size. Requests are tagged with the
+viewset and action that handled them, e.g. ``run.update_stage`` or ``pipeline.trend``, or the URL
+name for plain views.
+
+Metrics are kept in memory per process; with several workers each exposes its own values, which
+Prometheus aggregates per scrape target.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+# Seconds spent per kind ('serialization', ...) by the request being handled in this context
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar('tracker_request_timings', default=None)
+
+
+@contextmanager
+def record_time(kind: str):
+    """Add the time spent in the block to ``kind`` for the current request, if it is measured."""
+    timings = _request_timings.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[kind] = timings.get(kind, 0.0) + time.perf_counter() - started
+
+
+@contextmanager
+def measure_request():
+    """Collect ``record_time`` timings of the enclosed request handling into the yielded dict."""
+    timings: Dict[str, float] = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """JSONRenderer that records its rendering time as serialization time."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with record_time('serialization'):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class EndpointStats:
+    def __init__(self):
+        self.requests: Dict[Tuple[str, int], int] = {}  # (method, status) -> count
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.db_seconds = 0.0
+        self.serialization_seconds = 0.0
+        self.response_bytes = 0
+        self.query_warnings = 0
+
+
+class MetricsRegistry:
+    """Thread-safe in-process aggregate of request measurements, keyed by endpoint tag."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints: Dict[str, EndpointStats] = {}
+
+    def observe(
+        self, endpoint: str, method: str, status: int, duration: float, queries: int, db_seconds: float,
+        serialization_seconds: float, response_bytes: Optional[int], query_warning: bool = False,
+    ) -> None:
+        with self._lock:
+            stats = self._endpoints.setdefault(endpoint, EndpointStats())
+            stats.requests[(method, status)] = stats.requests.get((method, status), 0) + 1
+            stats.duration.observe(duration)
+            stats.queries.observe(queries)
+            stats.db_seconds += db_seconds
+            stats.serialization_seconds += serialization_seconds
+            stats.response_bytes += response_bytes or 0
+            stats.query_warnings += query_warning
+
+    def reset(self) -> None:
+        with self._lock:
+            self._endpoints.clear()
+
+    def render(self) -> str:
+        """The current values in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            lines = []
+
+            def family(name, kind, help_text):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+
+            family('tracker_requests_total', 'counter', 'Requests handled, by endpoint, method and status.')
+            for endpoint, stats in endpoints:
+                for (method, status), count in sorted(stats.requests.items()):
+                    lines.append(
+                        f'tracker_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}'
+                    )
+            for name, attr, help_text in (
+                ('tracker_request_duration_seconds', 'duration', 'Request wall time.'),
+                ('tracker_request_db_queries', 'queries', 'Database queries per request.'),
+            ):
+                family(name, 'histogram', help_text)
+                for endpoint, stats in endpoints:
+                    histogram = getattr(stats, attr)
+                    cumulative = 0
+                    for bound, count in zip((*histogram.buckets, '+Inf'), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {histogram.sum}')
+                    lines.append(f'{name}_count{{endpoint="{endpoint}"}} {cumulative}')
+            for name, attr, help_text in (
+                ('tracker_request_db_seconds_total', 'db_seconds', 'Time spent executing database queries.'),
+                ('tracker_request_serialization_seconds_total', 'serialization_seconds',
+                 'Time spent building serializer data and rendering JSON.'),
+                ('tracker_response_bytes_total', 'response_bytes', 'Response body bytes (streaming responses excluded).'),
+                ('tracker_query_threshold_exceeded_total', 'query_warnings',
+                 'Requests that exceeded the N+1 query warning threshold.'),
+            ):
+                family(name, 'counter', help_text)
+                for endpoint, stats in endpoints:
+                    lines.append(f'{name}{{endpoint="{endpoint}"}} {getattr(stats, attr)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def metrics_view(request):
+    """GET /metrics: the request metrics of this process for Prometheus to scrape."""
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
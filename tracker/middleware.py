@@ -0,0 +1,131 @@
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from .metrics import measure_request, registry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUERY_WARNING_THRESHOLD = 50
+
+
+class QueryRecorder:
+    """Execute wrapper counting queries, their total time and repeats of each statement.
+
+    One request may run queries from several threads (``sync_to_async``), so updates are locked.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.seconds += elapsed
+                self.count += 1
+                self.statements[sql] += 1
+
+
+# Recorder of the request handled in this context. Context variables follow the request into the
+# sync_to_async threads its queries may run in, each on that thread's own connection.
+_query_recorder: ContextVar[Optional[QueryRecorder]] = ContextVar('tracker_query_recorder', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper installed on every connection (see tracker/db.py), feeding the current request's recorder."""
+    recorder = _query_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+@contextmanager
+def record_queries():
+    """Count the queries of the enclosed request handling, in whichever thread they run."""
+    recorder = QueryRecorder()
+    token = _query_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _query_recorder.reset(token)
+
+
+def endpoint_tag(request, view_func) -> str:
+    """``{basename}.{action}`` for viewset actions (e.g. ``run.update_stage``), else the URL name."""
+    initkwargs = getattr(view_func, 'initkwargs', None) or {}
+    actions = getattr(view_func, 'actions', None) or {}
+    action = actions.get(request.method.lower())
+    if initkwargs.get('basename') and action:
+        return f"{initkwargs['basename']}.{action}"
+    match = request.resolver_match
+    return (match and match.url_name) or getattr(view_func, '__name__', 'unknown')
+
+
+class RequestMetricsMiddleware:
+    """Record query count, DB time, serialization time and response size per request (see tracker/metrics.py).
+
+    Requests issuing more than ``TRACKER_METRICS['QUERY_WARNING_THRESHOLD']`` queries are logged as
+    likely N+1 patterns, with the most repeated statement. Works in both sync and async mode, so
+    under ASGI it does not force async views onto a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not getattr(settings, 'TRACKER_METRICS', {}).get('ENABLED', True):
+            return self.get_response(request)
+        started = time.perf_counter()
+        with record_queries() as recorder, measure_request() as timings:
+            response = self.get_response(request)
+        self.observe(request, response, time.perf_counter() - started, recorder, timings)
+        return response
+
+    async def __acall__(self, request):
+        if not getattr(settings, 'TRACKER_METRICS', {}).get('ENABLED', True):
+            return await self.get_response(request)
+        started = time.perf_counter()
+        with record_queries() as recorder, measure_request() as timings:
+            response = await self.get_response(request)
+        self.observe(request, response, time.perf_counter() - started, recorder, timings)
+        return response
+
+    def observe(self, request, response, duration, recorder, timings):
+        endpoint = getattr(request, '_metrics_endpoint', 'unmatched')
+        if endpoint == 'metrics':
+            return
+        threshold = getattr(settings, 'TRACKER_METRICS', {}).get('QUERY_WARNING_THRESHOLD', DEFAULT_QUERY_WARNING_THRESHOLD)
+        exceeded = threshold is not None and recorder.count > threshold
+        if exceeded:
+            sql, repeats = recorder.statements.most_common(1)[0]
+            logger.warning(
+                '%s %s (%s) issued %d queries (threshold %d); most repeated (%dx): %s',
+                request.method, request.path, endpoint, recorder.count, threshold, repeats, sql[:500],
+            )
+        registry.observe(
+            endpoint, request.method, response.status_code, duration, recorder.count, recorder.seconds,
+            timings.get('serialization', 0.0),
+            None if response.streaming else len(response.content),
+            query_warning=exceeded,
+        )
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics_endpoint = endpoint_tag(request, view_func)
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='score',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='stageresult',
+            name='weighted_score',
+            field=models.FloatField(default=0.0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0002_run_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pipeline',
+            name='structure_version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0003_pipeline_structure_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='run',
+            index=models.Index(fields=['start_time', 'id'], name='run_start_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='run',
+            index=models.Index(fields=['pipeline', 'start_time'], name='run_pipeline_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='run',
+            index=models.Index(fields=['status', 'start_time'], name='run_status_start_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0004_run_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='trend_recorded',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='TrendBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=10)),
+                ('bucket_start', models.DateTimeField()),
+                ('run_count', models.PositiveIntegerField(default=0)),
+                ('score_sum', models.FloatField(default=0.0)),
+                ('score_min', models.FloatField(blank=True, null=True)),
+                ('score_max', models.FloatField(blank=True, null=True)),
+                ('completed_count', models.PositiveIntegerField(default=0)),
+                ('duration_sum', models.FloatField(default=0.0)),
+                ('duration_count', models.PositiveIntegerField(default=0)),
+                ('pipeline', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trend_buckets', to='tracker.pipeline')),
+                ('stage', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='trend_buckets', to='tracker.stage')),
+            ],
+            options={
+                'ordering': ['bucket_start'],
+                'indexes': [models.Index(fields=['pipeline', 'granularity', 'bucket_start'], name='trendbucket_lookup_idx')],
+                'unique_together': {('pipeline', 'stage', 'granularity', 'bucket_start')},
+                'constraints': [models.UniqueConstraint(condition=models.Q(('stage__isnull', True)), fields=('pipeline', 'granularity', 'bucket_start'), name='trendbucket_run_bucket_uniq')],
+            },
+        ),
+    ]
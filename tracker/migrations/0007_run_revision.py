@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0006_trend_buckets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='revision',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:28
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def copy_current_weights(apps, schema_editor):
+    """Existing results predate pinning; give them the weights their scores were computed with."""
+    Stage = apps.get_model('tracker', 'Stage')
+    SubStage = apps.get_model('tracker', 'SubStage')
+    StageResult = apps.get_model('tracker', 'StageResult')
+    SubStageResult = apps.get_model('tracker', 'SubStageResult')
+    StageResult.objects.update(weight=models.Subquery(
+        Stage.objects.filter(pk=models.OuterRef('stage_id')).values('weight')[:1]
+    ))
+    SubStageResult.objects.update(weight=models.Subquery(
+        SubStage.objects.filter(pk=models.OuterRef('substage_id')).values('weight')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0007_run_revision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pipeline',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='stageresult',
+            name='weight',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='substageresult',
+            name='weight',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.RunPython(copy_current_weights, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='PipelineVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('definition', models.JSONField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('pipeline', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='versions', to='tracker.pipeline')),
+            ],
+            options={
+                'ordering': ['created_at', 'id'],
+                'unique_together': {('pipeline', 'content_hash')},
+            },
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='pipeline_version',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='runs', to='tracker.pipelineversion'),
+        ),
+    ]
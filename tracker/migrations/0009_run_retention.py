@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0008_pipeline_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pipeline',
+            name='retention_days',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='pipeline',
+            name='retention_runs',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='compacted',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='stage_summary',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0009_run_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stage',
+            name='archived',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='substage',
+            name='archived',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0012_stage_archived'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stageresult',
+            name='stage',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.RESTRICT, to='tracker.stage'),
+        ),
+        migrations.AlterField(
+            model_name='substageresult',
+            name='substage',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.RESTRICT, to='tracker.substage'),
+        ),
+    ]
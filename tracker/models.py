@@ -1,3 +1,4 @@
+from typing import Optional
 from django.db import models
 from django.utils import timezone
 
@@ -35,11 +36,42 @@ class Pipeline(models.Model):
     name = models.CharField(max_length=200)
     description = models.TextField(blank=True)
     version = models.CharField(max_length=50, default='v1.0')
+    # Bumped whenever the pipeline or one of its Stages/SubStages is saved or deleted (see signals)
+    structure_version = models.PositiveIntegerField(default=1)
+    # content_hash of the PipelineVersion the pipeline was last loaded as; cleared by any later edit
+    content_hash = models.CharField(max_length=64, blank=True)
+    # Retention policy: keep full result detail of runs from the last N days and of the last K runs;
+    # finished runs outside both limits (unset = unlimited) are compacted (see tracker/retention.py)
+    retention_days = models.PositiveIntegerField(null=True, blank=True)
+    retention_runs = models.PositiveIntegerField(null=True, blank=True)
 
     def __str__(self) -> str:
         return f"{self.project} / {self.name}"
 
 
+class PipelineVersion(models.Model):
+    """Immutable snapshot of a pipeline definition, identified by the SHA-256 of its canonical JSON.
+
+    Runs pin the version they were created from and copy its weights onto their results, so later
+    edits of the pipeline never change historical scores (see services.pipeline_definition).
+    """
+    pipeline = models.ForeignKey(Pipeline, on_delete=models.CASCADE, related_name='versions')
+    content_hash = models.CharField(max_length=64)
+    definition = models.JSONField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['created_at', 'id']
+        unique_together = ('pipeline', 'content_hash')
+
+    def __str__(self) -> str:
+        return f"{self.pipeline} @ {self.short_hash}"
+
+    @property
+    def short_hash(self) -> str:
+        return self.content_hash[:12]
+
+
 class Stage(models.Model):
     pipeline = models.ForeignKey(Pipeline, on_delete=models.CASCADE, related_name='stages')
     name = models.CharField(max_length=200)
@@ -48,6 +80,8 @@ class Stage(models.Model):
     definition_of_done = models.TextField(blank=True)
     auto_check_endpoint = models.CharField(max_length=500, blank=True)
     dod_type = models.CharField(max_length=10, choices=(('manual', 'Manual'), ('auto', 'Auto')), default='manual')
+    # Removed from the pipeline definition; kept so historical results and trends still refer to it
+    archived = models.BooleanField(default=False)
 
     class Meta:
         ordering = ['order']
@@ -64,6 +98,8 @@ class SubStage(models.Model):
     definition_of_done = models.TextField(blank=True)
     auto_check_endpoint = models.CharField(max_length=500, blank=True)
     dod_type = models.CharField(max_length=10, choices=(('manual', 'Manual'), ('auto', 'Auto')), default='manual')
+    # See Stage.archived
+    archived = models.BooleanField(default=False)
 
     class Meta:
         ordering = ['order']
@@ -72,49 +108,123 @@ class SubStage(models.Model):
         return f"{self.stage} / {self.order} - {self.name}"
 
 
+class RunQuerySet(models.QuerySet):
+    def with_scores(self) -> 'RunQuerySet':
+        """Annotate each run with ``computed_score`` (0.0 .. 1.0) aggregated in the database.
+
+        The weighted sum of ``weight * completion_percent`` is computed with a grouped annotation
+        over the run's StageResults (using the weights pinned at run creation), so any number of
+        runs is scored in one query.
+        Avoid combining with other multi-valued joins, which would duplicate the summed rows.
+        """
+        return self.annotate(
+            score_weighted=models.Sum(
+                models.F('stage_results__weight') * models.F('stage_results__completion_percent'),
+                output_field=models.FloatField(),
+            ),
+            score_total_weight=models.Sum('stage_results__weight'),
+        ).annotate(
+            computed_score=models.Case(
+                models.When(
+                    score_total_weight__gt=0,
+                    then=models.F('score_weighted') / (models.F('score_total_weight') * 100.0),
+                ),
+                default=models.Value(0.0),
+                output_field=models.FloatField(),
+            )
+        )
+
+    def with_results(self) -> 'RunQuerySet':
+        """Prefetch the StageResult -> SubStageResult tree (with stage/substage names) in two queries.
+
+        This is what RunSerializer walks, so serializing any number of runs costs a constant
+        number of queries.
+        """
+        return self.prefetch_related(
+            models.Prefetch(
+                'stage_results',
+                queryset=StageResult.objects.select_related('stage').order_by('stage__order'),
+            ),
+            models.Prefetch(
+                'stage_results__substage_results',
+                queryset=SubStageResult.objects.select_related('substage').order_by('substage__order'),
+            ),
+        )
+
+
 class Run(models.Model):
     pipeline = models.ForeignKey(Pipeline, on_delete=models.CASCADE, related_name='runs')
+    # Definition the run was created from; set automatically on creation (see signals)
+    pipeline_version = models.ForeignKey(
+        PipelineVersion, on_delete=models.SET_NULL, null=True, blank=True, related_name='runs'
+    )
     triggered_by = models.CharField(max_length=200, blank=True)
     start_time = models.DateTimeField(default=timezone.now)
     end_time = models.DateTimeField(null=True, blank=True)
     status = models.CharField(max_length=20, default='running')
+    # Denormalized overall score (0.0 .. 1.0), maintained by signals/services on every result change
+    score = models.FloatField(default=0.0)
+    # Set once the finished run has been folded into its pipeline's TrendBuckets
+    trend_recorded = models.BooleanField(default=False)
+    # Monotonic revision, bumped on every change to the run or its results; used for ETags
+    revision = models.PositiveIntegerField(default=1)
+    # Set once the run's result rows were replaced by ``stage_summary`` (see tracker/retention.py)
+    compacted = models.BooleanField(default=False)
+    # [[stage_id, weight, completion_percent, duration_seconds or null], ...] of a compacted run
+    stage_summary = models.JSONField(null=True, blank=True)
+
+    objects = RunQuerySet.as_manager()
+
+    # Columns maintained with queryset UPDATEs by services/signals. A plain save() of an
+    # instance loaded earlier must not write back stale values for them.
+    derived_fields = ('score', 'trend_recorded', 'revision', 'compacted', 'stage_summary')
 
     class Meta:
         ordering = ['-start_time']
+        indexes = [
+            # Back cursor pagination and the pipeline/status/start-time filters of the runs API
+            models.Index(fields=['start_time', 'id'], name='run_start_time_idx'),
+            models.Index(fields=['pipeline', 'start_time'], name='run_pipeline_start_idx'),
+            models.Index(fields=['status', 'start_time'], name='run_status_start_idx'),
+        ]
 
     def __str__(self) -> str:
         return f"Run {self.id} - {self.pipeline} - {self.status}"
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.derived_fields
+            ]
+        super().save(*args, **kwargs)
+
+    @property
+    def etag(self) -> str:
+        return f'"run-{self.id}-{self.revision}"'
+
     @property
     def overall_score(self) -> float:
-        """Compute the overall weighted score dynamically by aggregating StageResults.
-        Returns a float in 0.0 to 1.0 range (not percent).
+        """Overall weighted score of the run as a float in 0.0 to 1.0 range (not percent).
+
+        Reads the stored ``score`` column, which is kept up to date whenever a StageResult
+        changes (see ``services.refresh_run_score``), so no extra queries are issued.
         """
-        stage_results = self.stage_results.all()
-        if not stage_results:
-            return 0.0
-        
-        total_stage_weight = sum([sr.stage.weight for sr in stage_results])
-        if total_stage_weight <= 0:
-            return 0.0
-        
-        total = 0.0
-        for sr in stage_results:
-            # sr.completion_percent is 0..100, so divide by 100
-            completion_frac = (sr.completion_percent or 0.0) / 100.0
-            total += sr.stage.weight * completion_frac
-        
-        # Normalize by total stage weight
-        return total / total_stage_weight
+        return self.score
 
 
 class StageResult(models.Model):
     run = models.ForeignKey(Run, on_delete=models.CASCADE, related_name='stage_results')
-    stage = models.ForeignKey(Stage, on_delete=models.CASCADE)
+    # Results keep their pinned weights; archive a stage (Stage.archived) instead of deleting it
+    stage = models.ForeignKey(Stage, on_delete=models.RESTRICT)
     start_time = models.DateTimeField(null=True, blank=True)
     end_time = models.DateTimeField(null=True, blank=True)
     status = models.CharField(max_length=20, default='pending')
     completion_percent = models.FloatField(default=0.0)
+    # Stage weight copied from the run's PipelineVersion when the result is created
+    weight = models.FloatField(default=0.0)
+    # Stored contribution to the run score: weight * completion_percent / 100
+    weighted_score = models.FloatField(default=0.0)
 
     class Meta:
         unique_together = ('run', 'stage')
@@ -123,16 +233,83 @@ class StageResult(models.Model):
         return f"Run {self.run.id} - StageResult {self.stage.name} - {self.completion_percent}%"
 
 
+class SubStageResultQuerySet(models.QuerySet):
+    def of_run(self, run_id: int) -> 'SubStageResultQuerySet':
+        """Substage results of one run, looked up from the run side.
+
+        Filtering on ``stage_result__run_id`` lets the planner start from the ``substage_id`` index,
+        which holds that substage's row of every run ever recorded. The subquery instead resolves
+        the run's few StageResults first and then seeks the unique (stage_result, substage) index.
+        """
+        return self.filter(stage_result__in=StageResult.objects.filter(run_id=run_id).values('id'))
+
+
 class SubStageResult(models.Model):
     stage_result = models.ForeignKey(StageResult, on_delete=models.CASCADE, related_name='substage_results')
-    substage = models.ForeignKey(SubStage, on_delete=models.CASCADE)
+    substage = models.ForeignKey(SubStage, on_delete=models.RESTRICT)
     start_time = models.DateTimeField(null=True, blank=True)
     end_time = models.DateTimeField(null=True, blank=True)
     status = models.CharField(max_length=20, default='pending')
     completion_percent = models.FloatField(default=0.0)
+    # SubStage weight copied from the run's PipelineVersion when the result is created
+    weight = models.FloatField(default=0.0)
+
+    objects = SubStageResultQuerySet.as_manager()
 
     class Meta:
         unique_together = ('stage_result', 'substage')
 
     def __str__(self) -> str:
         return f"Run {self.stage_result.run.id} - SubStage {self.substage.name} - {self.completion_percent}%"
+
+
+class TrendBucket(models.Model):
+    """Pre-aggregated run statistics of a pipeline for one hour/day time bucket.
+
+    Rows with ``stage`` unset describe whole runs (score = Run.score); rows with a stage describe
+    that stage's results (score = completion_percent / 100). Means are derived from the stored
+    sums, so buckets can be updated incrementally as runs finish (see services.record_run_trend).
+    """
+    GRANULARITY_CHOICES = (('hour', 'Hour'), ('day', 'Day'))
+
+    pipeline = models.ForeignKey(Pipeline, on_delete=models.CASCADE, related_name='trend_buckets')
+    stage = models.ForeignKey(Stage, on_delete=models.CASCADE, null=True, blank=True, related_name='trend_buckets')
+    granularity = models.CharField(max_length=10, choices=GRANULARITY_CHOICES)
+    bucket_start = models.DateTimeField()
+    run_count = models.PositiveIntegerField(default=0)
+    score_sum = models.FloatField(default=0.0)
+    score_min = models.FloatField(null=True, blank=True)
+    score_max = models.FloatField(null=True, blank=True)
+    completed_count = models.PositiveIntegerField(default=0)
+    duration_sum = models.FloatField(default=0.0)
+    duration_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['bucket_start']
+        unique_together = ('pipeline', 'stage', 'granularity', 'bucket_start')
+        constraints = [
+            # unique_together never matches NULL stages, so run-level rows need their own constraint
+            models.UniqueConstraint(
+                fields=['pipeline', 'granularity', 'bucket_start'], condition=models.Q(stage__isnull=True),
+                name='trendbucket_run_bucket_uniq',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['pipeline', 'granularity', 'bucket_start'], name='trendbucket_lookup_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.pipeline} / {self.stage or 'run'} / {self.granularity} {self.bucket_start:%Y-%m-%d %H:00}"
+
+    @property
+    def mean_score(self) -> float:
+        return self.score_sum / self.run_count if self.run_count else 0.0
+
+    @property
+    def completion_rate(self) -> float:
+        return self.completed_count / self.run_count if self.run_count else 0.0
+
+    @property
+    def mean_duration(self) -> Optional[float]:
+        """Mean duration in seconds of the runs/stages that recorded both start and end time."""
+        return self.duration_sum / self.duration_count if self.duration_count else None
@@ -0,0 +1,12 @@
+from rest_framework.pagination import CursorPagination
+
+
+class RunCursorPagination(CursorPagination):
+    """Keyset pagination over (start_time, id), newest first.
+
+    Each page seeks directly to the cursor position using the Run(start_time) indexes instead of
+    OFFSET-scanning the history, so deep pages cost the same as the first one.
+    """
+    ordering = ('-start_time', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
@@ -0,0 +1,91 @@
+"""Run history retention: compact old runs of a pipeline down to a single summary row.
+
+A finished run is kept in full while it started within the last ``Pipeline.retention_days`` days
+or is one of the last ``Pipeline.retention_runs`` runs; an unset limit keeps everything. Beyond
+that, compaction packs each stage's pinned weight, completion and duration into
+``Run.stage_summary``, flags the run ``compacted`` and deletes its StageResults and
+SubStageResults.
+
+The stored ``Run.score`` and the TrendBuckets are left untouched, so the trend endpoints and
+scorecards read compacted history exactly as before; ``record_run_trend`` (and thus
+rebuild_trend_rollups) reads stage figures from the summary. Compacted runs are frozen: result
+updates answer 404 and score refreshes skip them.
+
+Runs are compacted in batches of ``batch_size``, one short transaction each, so row locks are
+only ever held on one batch of result rows at a time.
+"""
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import Pipeline, Run, StageResult, SubStageResult
+
+COMPACT_BATCH_SIZE = 500
+
+
+def compactable_runs(pipeline: Pipeline, now: Optional[datetime] = None):
+    """Finished, not yet compacted runs of ``pipeline`` that fall outside its retention policy."""
+    if pipeline.retention_days is None and pipeline.retention_runs is None:
+        return Run.objects.none()
+    runs = Run.objects.filter(pipeline=pipeline, compacted=False, end_time__isnull=False)
+    if pipeline.retention_days is not None:
+        runs = runs.filter(start_time__lt=(now or timezone.now()) - timedelta(days=pipeline.retention_days))
+    if pipeline.retention_runs is not None:
+        # Everything older than the K-th newest run (of any status) on the (start_time, id) order
+        boundary = (
+            Run.objects.filter(pipeline=pipeline).order_by('-start_time', '-id')
+            .values_list('start_time', 'id')[pipeline.retention_runs:pipeline.retention_runs + 1]
+        )
+        boundary = boundary[0] if boundary else None
+        if boundary is None:
+            return Run.objects.none()
+        start_time, run_id = boundary
+        runs = runs.filter(Q(start_time__lt=start_time) | Q(start_time=start_time, id__lte=run_id))
+    return runs
+
+
+def compact_run_batch(run_ids: List[int]) -> int:
+    """Replace the result rows of ``run_ids`` by their stage summaries; returns the runs compacted.
+
+    Rows are locked substage results, then stage results, then runs, each in id order: the order
+    ``services.update_result`` and ``apply_result_updates`` use, so compaction cannot deadlock with
+    result updates. An update waiting on a compacted run's rows finds them deleted and answers 404.
+    """
+    with transaction.atomic():
+        stage_result_ids = StageResult.objects.filter(run_id__in=run_ids, run__compacted=False).values('id')
+        # Subqueries rather than joins, so FOR UPDATE only locks rows of the table being read
+        list(SubStageResult.objects.select_for_update().filter(stage_result__in=stage_result_ids)
+             .order_by('id').values_list('id', flat=True))
+        list(StageResult.objects.select_for_update().filter(id__in=stage_result_ids).order_by('id').values_list('id', flat=True))
+        runs = list(Run.objects.select_for_update().filter(id__in=run_ids, compacted=False).order_by('id').only('id'))
+        if not runs:
+            return 0
+        summaries = {run.id: [] for run in runs}
+        for run_id, stage_id, weight, percent, start, end in (
+            StageResult.objects.filter(run_id__in=summaries)
+            .order_by('run_id', 'stage__order', 'id')
+            .values_list('run_id', 'stage_id', 'weight', 'completion_percent', 'start_time', 'end_time')
+        ):
+            summaries[run_id].append([stage_id, weight, percent, (end - start).total_seconds() if start and end else None])
+        SubStageResult.objects.filter(stage_result__run_id__in=summaries).delete()
+        StageResult.objects.filter(run_id__in=summaries).delete()
+        for run in runs:
+            run.stage_summary = summaries[run.id]
+            run.compacted = True
+        Run.objects.bulk_update(runs, ['stage_summary', 'compacted'])
+        # The representation changed, so conditional GETs must not answer 304 with the old ETag
+        Run.objects.filter(id__in=summaries).update(revision=F('revision') + 1)
+    return len(runs)
+
+
+def compact_pipeline_runs(
+    pipeline: Pipeline, batch_size: int = COMPACT_BATCH_SIZE, now: Optional[datetime] = None,
+) -> Iterator[int]:
+    """Compact every run of ``pipeline`` beyond its retention policy, yielding the count per batch."""
+    now = now or timezone.now()
+    while True:
+        run_ids = list(compactable_runs(pipeline, now).order_by('start_time', 'id').values_list('id', flat=True)[:batch_size])
+        if not run_ids:
+            return
+        yield compact_run_batch(run_ids)
@@ -0,0 +1,121 @@
+"""Organization → team → project → pipeline scorecards built from grouped aggregates.
+
+Each pipeline reports its latest run (score and status, via correlated subqueries that walk the
+(pipeline, start_time) index) and its pass rate over a time window: the share of finished runs that
+reached a 100% score (TrendBucket.completed_count / run_count). The pass rate is read from the
+daily whole-run TrendBuckets, so it costs one grouped query over the rollups instead of a scan of
+the runs. Parents aggregate their children in Python: the latest score of a project/team/org is the
+mean over its pipelines that have runs, and its pass rate pools the runs of all its pipelines.
+
+The whole tree takes a fixed five queries, however many pipelines it covers.
+"""
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional
+from django.db.models import OuterRef, Subquery, Sum
+from .models import Organization, Pipeline, Project, Run, Team, TrendBucket
+from .services import truncate_to_bucket
+
+
+def _summarize(node: dict, pipelines: List[dict]) -> None:
+    """Set the aggregate fields of ``node`` from the pipeline entries below it."""
+    scores = [p['latest_run']['score'] for p in pipelines if p['latest_run']]
+    runs = sum(p['run_count'] for p in pipelines)
+    passed = sum(p['passed_count'] for p in pipelines)
+    node.update({
+        'pipeline_count': len(pipelines),
+        'latest_score': round(sum(scores) / len(scores), 2) if scores else None,
+        'run_count': runs,
+        'passed_count': passed,
+        'pass_rate': round(passed * 100.0 / runs, 2) if runs else None,
+    })
+
+
+def build_scorecard(
+    since: datetime, organization: Optional[int] = None, team: Optional[int] = None, project: Optional[int] = None,
+) -> List[dict]:
+    """Scorecards of all organizations, or of the given organization/team/project subtree.
+
+    Pass rates count the finished runs that started on or after the (UTC) day of ``since``, as the
+    daily buckets cannot split a day.
+    """
+    organizations = Organization.objects.order_by('name', 'id')
+    teams = Team.objects.order_by('name', 'id')
+    projects = Project.objects.order_by('name', 'id')
+    pipelines = Pipeline.objects.order_by('name', 'id')
+    if organization:
+        organizations = organizations.filter(pk=organization)
+        teams = teams.filter(organization_id=organization)
+        projects = projects.filter(team__organization_id=organization)
+        pipelines = pipelines.filter(project__team__organization_id=organization)
+    if team:
+        organizations = organizations.filter(teams=team)
+        teams = teams.filter(pk=team)
+        projects = projects.filter(team_id=team)
+        pipelines = pipelines.filter(project__team_id=team)
+    if project:
+        organizations = organizations.filter(teams__projects=project)
+        teams = teams.filter(projects=project)
+        projects = projects.filter(pk=project)
+        pipelines = pipelines.filter(project_id=project)
+
+    latest = Run.objects.filter(pipeline=OuterRef('pk')).order_by('-start_time', '-id')
+    pipeline_rows = pipelines.annotate(
+        latest_run_id=Subquery(latest.values('id')[:1]),
+        latest_score=Subquery(latest.values('score')[:1]),
+        latest_status=Subquery(latest.values('status')[:1]),
+        latest_start_time=Subquery(latest.values('start_time')[:1]),
+    ).values('id', 'name', 'project_id', 'latest_run_id', 'latest_score', 'latest_status', 'latest_start_time')
+
+    window = {
+        row['pipeline_id']: row
+        for row in TrendBucket.objects.filter(
+            pipeline__in=pipelines.values('pk'), stage__isnull=True, granularity='day',
+            # The bucket holding ``since`` starts before it; comparing raw would drop that whole day
+            bucket_start__gte=truncate_to_bucket(since, 'day'),
+        ).order_by().values('pipeline_id').annotate(runs=Sum('run_count'), passed=Sum('completed_count'))
+    }
+
+    by_project: Dict[int, List[dict]] = defaultdict(list)
+    for row in pipeline_rows:
+        counts = window.get(row['id'], {})
+        runs, passed = counts.get('runs') or 0, counts.get('passed') or 0
+        by_project[row['project_id']].append({
+            'id': row['id'],
+            'name': row['name'],
+            'latest_run': {
+                'id': row['latest_run_id'],
+                'score': round(row['latest_score'] * 100, 2),
+                'status': row['latest_status'],
+                'start_time': row['latest_start_time'],
+            } if row['latest_run_id'] else None,
+            'run_count': runs,
+            'passed_count': passed,
+            'pass_rate': round(passed * 100.0 / runs, 2) if runs else None,
+        })
+
+    below: Dict[tuple, List[dict]] = defaultdict(list)  # ('team'|'organization', id) -> pipeline entries
+    by_team: Dict[int, List[dict]] = defaultdict(list)
+    for p in projects.select_related('team'):
+        entries = by_project.get(p.id, [])
+        node = {'id': p.id, 'name': p.name}
+        _summarize(node, entries)
+        node['pipelines'] = entries
+        by_team[p.team_id].append(node)
+        below[('team', p.team_id)].extend(entries)
+        below[('organization', p.team.organization_id)].extend(entries)
+
+    by_organization: Dict[int, List[dict]] = defaultdict(list)
+    for t in teams:
+        node = {'id': t.id, 'name': t.name}
+        _summarize(node, below[('team', t.id)])
+        node['projects'] = by_team.get(t.id, [])
+        by_organization[t.organization_id].append(node)
+
+    result = []
+    for o in organizations.distinct():
+        node = {'id': o.id, 'name': o.name}
+        _summarize(node, below[('organization', o.id)])
+        node['teams'] = by_organization.get(o.id, [])
+        result.append(node)
+    return result
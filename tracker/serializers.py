@@ -1,10 +1,41 @@
 from rest_framework import serializers
+from .metrics import record_time
 from .models import (
     Organization, Team, Project, Pipeline, Stage, SubStage,
     Run, StageResult, SubStageResult
 )
 
 
+class TimedDataMixin:
+    """Record building ``.data`` as serialization time of the current request (see tracker/metrics.py)."""
+
+    @property
+    def data(self):
+        with record_time('serialization'):
+            return super().data
+
+
+class TimedListSerializer(TimedDataMixin, serializers.ListSerializer):
+    pass
+
+
+class DynamicFieldsMixin:
+    """Allow callers to restrict the serialized fields via a ``fields`` keyword argument.
+
+    Unknown names raise a ValidationError (400) listing them, rather than being dropped silently.
+    """
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            unknown = sorted(set(fields) - set(self.fields))
+            if unknown:
+                raise serializers.ValidationError({'fields': f"Unknown fields: {', '.join(unknown)}"})
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
 class SubStageResultSerializer(serializers.ModelSerializer):
     substage_name = serializers.CharField(source='substage.name', read_only=True)
 
@@ -13,28 +44,51 @@ class SubStageResultSerializer(serializers.ModelSerializer):
         fields = ['id', 'substage', 'substage_name', 'start_time', 'end_time', 'status', 'completion_percent']
 
 
-class StageResultSerializer(serializers.ModelSerializer):
+class StageResultSerializer(TimedDataMixin, serializers.ModelSerializer):
     stage_name = serializers.CharField(source='stage.name', read_only=True)
     substage_results = SubStageResultSerializer(many=True, read_only=True)
 
     class Meta:
         model = StageResult
         fields = ['id', 'stage', 'stage_name', 'start_time', 'end_time', 'status', 'completion_percent', 'substage_results']
+        list_serializer_class = TimedListSerializer
 
 
-class RunSerializer(serializers.ModelSerializer):
+class RunSerializer(TimedDataMixin, DynamicFieldsMixin, serializers.ModelSerializer):
     stage_results = StageResultSerializer(many=True, read_only=True)
     overall_score = serializers.SerializerMethodField()
 
+    # Fields returned for ?view=compact; nested fields must be requested with ?expand=
+    compact_fields = ['id', 'pipeline', 'triggered_by', 'start_time', 'end_time', 'status', 'overall_score', 'revision']
+    expandable_fields = ['stage_results']
+
     class Meta:
         model = Run
-        fields = ['id', 'pipeline', 'triggered_by', 'start_time', 'end_time', 'status', 'stage_results', 'overall_score']
+        fields = [
+            'id', 'pipeline', 'pipeline_version', 'triggered_by', 'start_time', 'end_time', 'status',
+            'stage_results', 'overall_score', 'revision', 'compacted', 'stage_summary',
+        ]
+        read_only_fields = ['pipeline_version', 'revision', 'compacted', 'stage_summary']
+        list_serializer_class = TimedListSerializer
 
     def get_overall_score(self, obj):
         # return percent value 0..100 for convenience
         return round(obj.overall_score * 100, 2)
 
 
+class ResultUpdateSerializer(serializers.Serializer):
+    """One entry of a batch stage/substage update (see RunViewSet.update_stages)."""
+    stage_id = serializers.IntegerField(required=False)
+    substage_id = serializers.IntegerField(required=False)
+    completion_percent = serializers.FloatField(min_value=0.0, max_value=100.0)
+    status = serializers.CharField(max_length=20, required=False)
+
+    def validate(self, attrs):
+        if not attrs.get('stage_id') and not attrs.get('substage_id'):
+            raise serializers.ValidationError('stage_id or substage_id required')
+        return attrs
+
+
 class SubStageSerializer(serializers.ModelSerializer):
     class Meta:
         model = SubStage
@@ -49,12 +103,16 @@ class StageSerializer(serializers.ModelSerializer):
         fields = ['id', 'pipeline', 'name', 'weight', 'order', 'definition_of_done', 'auto_check_endpoint', 'dod_type', 'substages']
 
 
-class PipelineSerializer(serializers.ModelSerializer):
+class PipelineSerializer(TimedDataMixin, serializers.ModelSerializer):
     stages = StageSerializer(many=True, read_only=True)
 
     class Meta:
         model = Pipeline
-        fields = ['id', 'project', 'name', 'description', 'version', 'stages']
+        fields = [
+            'id', 'project', 'name', 'description', 'version', 'content_hash', 'retention_days', 'retention_runs', 'stages',
+        ]
+        read_only_fields = ['content_hash']
+        list_serializer_class = TimedListSerializer
 
 
 class ProjectSerializer(serializers.ModelSerializer):
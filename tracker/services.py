@@ -1,38 +1,527 @@
-from typing import Optional
-from .models import Run, StageResult, SubStageResult
+import hashlib
+import json
+from datetime import datetime, timezone as dt_timezone
+from functools import lru_cache
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Optional, Tuple
+from django.db import transaction
+from django.db.models import Avg, Case, Count, F, FloatField, OuterRef, Prefetch, Q, QuerySet, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest, Least
+from .events import notify_run_changed
+from .models import Pipeline, PipelineVersion, Run, Stage, StageResult, SubStage, SubStageResult, TrendBucket
+
+# Stage/SubStage columns that make up a pipeline definition (and thus its content hash)
+DEFINITION_FIELDS = ('weight', 'order', 'definition_of_done', 'auto_check_endpoint', 'dod_type')
+
+
+class ResultTemplate(NamedTuple):
+    content_hash: str
+    definition: dict
+    # (stage_id, stage_weight, ((substage_id, substage_weight), ...)) for every stage, in order
+    stages: Tuple[Tuple[int, float, Tuple[Tuple[int, float], ...]], ...]
+
+
+# Completion percentages at or above this count as done (absorbs float error of weighted means)
+COMPLETE_PERCENT = 100.0 - 1e-6
+TREND_GRANULARITIES = ('hour', 'day')
 
 
 def calculate_run_score(run_id: int) -> float:
     """Calculate the overall weighted score for a Run.
 
     Algorithm:
-    - For each StageResult in the run, read stage.weight (weight within pipeline) and
-      the StageResult.completion_percent (0..100).
-    - For each stage, contribution = (stage.weight) * (stage_result.completion_percent / 100.0)
+    - For each StageResult in the run, read its weight (the stage weight pinned when the run was
+      created) and the StageResult.completion_percent (0..100).
+    - For each stage, contribution = (weight) * (stage_result.completion_percent / 100.0)
     - Sum contributions. If pipeline stage weights don't sum to 1.0, normalize by total stage weight.
 
+    The aggregation runs in the database (see ``RunQuerySet.with_scores``), so this costs a
+    single query regardless of the number of stages.
+
+    Compacted runs have no results left (see tracker/retention.py); their stored score is returned.
+
     Returns the final score as a float in 0.0 .. 1.0 (not percent). Caller may multiply by 100.
     """
-    try:
-        run = Run.objects.get(id=run_id)
-    except Run.DoesNotExist:
-        raise ValueError(f"Run with id={run_id} does not exist")
-
-    stage_results = StageResult.objects.filter(run=run).select_related('stage')
-    if not stage_results.exists():
-        return 0.0
-
-    total_stage_weight = sum([sr.stage.weight for sr in stage_results])
-    if total_stage_weight <= 0:
-        return 0.0
-
-    total = 0.0
-    for sr in stage_results:
-        # sr.completion_percent is expected as 0..100
-        stage_weight = sr.stage.weight
-        completion_frac = (sr.completion_percent or 0.0) / 100.0
-        total += stage_weight * completion_frac
-
-    # Normalize in case weights don't sum to 1.0
-    normalized = total / total_stage_weight
-    return normalized
+    scores = Run.objects.filter(id=run_id).with_scores().values_list('computed_score', 'compacted', 'score')
+    for computed, compacted, stored in scores:
+        return stored if compacted else computed
+    raise ValueError(f"Run with id={run_id} does not exist")
+
+
+def stage_contribution(stage_weight: float, completion_percent: Optional[float]) -> float:
+    """Weighted contribution of a single StageResult: stage_weight * (completion_percent / 100)."""
+    return stage_weight * ((completion_percent or 0.0) / 100.0)
+
+
+class RunScore(NamedTuple):
+    score: float
+    # Run.revision after the refresh, i.e. the one in the run's ETag
+    revision: int
+
+
+class StaleRevision(Exception):
+    """A run changed since the revision an update was based on (see ``refresh_run_score``)."""
+
+    def __init__(self, run_id: int, revision: Optional[int]):
+        super().__init__(f"Run id={run_id} is at revision {revision}")
+        self.run_id = run_id
+        self.revision = revision
+
+    @property
+    def detail(self) -> str:
+        """Body text of the 412 answered to an If-Match naming an older revision."""
+        return f'Run changed since the If-Match revision; it is at revision {self.revision}'
+
+
+def refresh_run_score(run_id: int, expected_revision: Optional[int] = None) -> RunScore:
+    """Recompute the stored Run.score from the stored StageResult contributions.
+
+    Uses one aggregate query over the run's StageResults and one UPDATE, so the cost does not
+    depend on how many callers later read the score. Also bumps Run.revision, since every result
+    change goes through here.
+
+    The run row is locked before aggregating. The UPDATE would hold that lock until commit
+    anyway, but taking it first means the aggregate sees every result change committed by
+    concurrent writers, so the last writer to commit always stores the score of the final results.
+    With ``expected_revision`` the refresh raises StaleRevision (rolling back the caller's
+    transaction) if the run is no longer at that revision. Returns the new score (0.0 .. 1.0)
+    and revision.
+    """
+    with transaction.atomic(savepoint=False):
+        revision = Run.objects.select_for_update().filter(id=run_id).values_list('revision', flat=True).first()
+        if expected_revision is not None and revision != expected_revision:
+            raise StaleRevision(run_id, revision)
+        totals = StageResult.objects.filter(run_id=run_id).aggregate(
+            weighted=Sum('weighted_score'),
+            total_weight=Sum('weight'),
+        )
+        total_weight = totals['total_weight'] or 0.0
+        score = (totals['weighted'] or 0.0) / total_weight if total_weight > 0 else 0.0
+        Run.objects.filter(id=run_id).update(score=score, revision=F('revision') + 1)
+    return RunScore(score, (revision or 0) + 1)
+
+
+def refresh_run_scores(runs: QuerySet) -> int:
+    """Recompute the stored score for every Run in ``runs`` with a single UPDATE statement.
+
+    Compacted runs keep their stored score. Returns the number of runs updated.
+    """
+    scores = (
+        StageResult.objects.filter(run=OuterRef('pk'))
+        .order_by()
+        .values('run')
+        .annotate(weighted=Sum('weighted_score'), total_weight=Sum('weight'))
+        .annotate(value=Case(
+            When(total_weight__gt=0, then=F('weighted') / F('total_weight')),
+            default=Value(0.0),
+            output_field=FloatField(),
+        ))
+        .values('value')
+    )
+    return runs.filter(compacted=False).update(
+        score=Coalesce(Subquery(scores, output_field=FloatField()), Value(0.0)),
+        revision=F('revision') + 1,
+    )
+
+
+def refresh_stage_contributions(stage_results: QuerySet) -> int:
+    """Recompute the stored weighted_score of ``stage_results`` from their pinned weights."""
+    return stage_results.update(weighted_score=F('completion_percent') * F('weight') / 100.0)
+
+
+def completion_status(completion_percent: float) -> str:
+    """Status implied by a completion percentage: completed, partial or pending."""
+    if completion_percent >= COMPLETE_PERCENT:
+        return 'completed'
+    return 'partial' if completion_percent > 0 else 'pending'
+
+
+def rollup_stage_results(stage_result_ids: Iterable[int]) -> List[StageResult]:
+    """Recompute StageResult completion from its SubStageResults, weighted by their pinned weights.
+
+    All requested stage results are aggregated with one grouped query over their substage
+    results; stages whose substages all have zero weight fall back to the plain mean. A stage
+    with any failed substage is marked failed. StageResults without substages are left alone.
+    The stored run score is NOT refreshed here; callers refresh it once for the affected runs.
+
+    The StageResult rows are locked (in id order) before their substages are aggregated, so
+    concurrent updates to substages of one stage serialize on that stage only and the last of
+    them rolls up every substage value. Returns the updated StageResults.
+    """
+    with transaction.atomic(savepoint=False):
+        stage_results = list(
+            StageResult.objects.select_for_update().filter(id__in=list(stage_result_ids)).order_by('id')
+        )
+        totals = {
+            row['stage_result_id']: row
+            for row in SubStageResult.objects.filter(stage_result_id__in=[sr.id for sr in stage_results])
+            .order_by()
+            .values('stage_result_id')
+            .annotate(
+                weighted=Sum(F('weight') * F('completion_percent'), output_field=FloatField()),
+                total_weight=Sum('weight'),
+                mean=Avg('completion_percent'),
+                failed=Count('id', filter=Q(status='failed')),
+            )
+        } if stage_results else {}
+        stage_results = [sr for sr in stage_results if sr.id in totals]
+        for sr in stage_results:
+            row = totals[sr.id]
+            if row['total_weight']:
+                sr.completion_percent = row['weighted'] / row['total_weight']
+            else:
+                sr.completion_percent = row['mean'] or 0.0
+            sr.status = 'failed' if row['failed'] else completion_status(sr.completion_percent)
+            sr.weighted_score = stage_contribution(sr.weight, sr.completion_percent)
+        StageResult.objects.bulk_update(stage_results, ['completion_percent', 'status', 'weighted_score'])
+    return stage_results
+
+
+def definition_entry(obj) -> dict:
+    """Definition of one Stage/SubStage (stored instance or unsaved) as used in pipeline_definition."""
+    return {'name': obj.name, **{field: getattr(obj, field) for field in DEFINITION_FIELDS}}
+
+
+def pipeline_definition(pipeline: Pipeline, stages: Iterable[Mapping]) -> dict:
+    """Canonical definition of ``pipeline`` with ``stages``, as stored on PipelineVersion.
+
+    ``stages`` are ordered mappings of ``name`` plus DEFINITION_FIELDS, each with a ``substages``
+    list of the same shape (see definition_entry).
+    """
+    return {
+        'name': pipeline.name,
+        'description': pipeline.description,
+        'version': pipeline.version,
+        'stages': [
+            {
+                'name': stage['name'],
+                **{field: stage[field] for field in DEFINITION_FIELDS},
+                'substages': [
+                    {'name': sub['name'], **{field: sub[field] for field in DEFINITION_FIELDS}}
+                    for sub in stage['substages']
+                ],
+            }
+            for stage in stages
+        ],
+    }
+
+
+def definition_hash(definition: dict) -> str:
+    """SHA-256 of the canonical JSON encoding of a pipeline definition."""
+    encoded = json.dumps(definition, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+@lru_cache(maxsize=256)
+def _compile_result_template(pipeline_id: int, structure_version: int) -> ResultTemplate:
+    pipeline = Pipeline.objects.get(pk=pipeline_id)
+    stages = list(
+        Stage.objects.filter(pipeline_id=pipeline_id, archived=False).order_by('order', 'id')
+        .prefetch_related(Prefetch('substages', queryset=SubStage.objects.filter(archived=False).order_by('order', 'id')))
+    )
+    definition = pipeline_definition(pipeline, [
+        {**definition_entry(stage), 'substages': [definition_entry(sub) for sub in stage.substages.all()]}
+        for stage in stages
+    ])
+    return ResultTemplate(
+        content_hash=definition_hash(definition),
+        definition=definition,
+        stages=tuple(
+            (stage.id, stage.weight, tuple((sub.id, sub.weight) for sub in stage.substages.all()))
+            for stage in stages
+        ),
+    )
+
+
+def get_result_template(pipeline: Pipeline) -> ResultTemplate:
+    """Return the compiled definition and stage/substage layout used to materialize results for ``pipeline``.
+
+    Templates are cached per process keyed on ``Pipeline.structure_version``, which is bumped
+    whenever the pipeline or its stages/substages change, so stale layouts are never reused.
+    """
+    return _compile_result_template(pipeline.id, pipeline.structure_version)
+
+
+def get_pipeline_version(pipeline: Pipeline) -> PipelineVersion:
+    """Return the PipelineVersion of the current definition of ``pipeline``, creating it on first use.
+
+    Versions are content-addressed, so an unchanged definition always maps to the same row.
+    """
+    template = get_result_template(pipeline)
+    version, _ = PipelineVersion.objects.get_or_create(
+        pipeline_id=pipeline.id, content_hash=template.content_hash,
+        defaults={'definition': template.definition},
+    )
+    return version
+
+
+def materialize_run_results(run: Run) -> None:
+    """Create every StageResult and SubStageResult row for a new run with two bulk INSERTs.
+
+    Stage and substage weights are copied onto the rows, so later edits of the pipeline do not
+    change the run's score.
+    """
+    template = get_result_template(run.pipeline)
+    with transaction.atomic():
+        stage_results = StageResult.objects.bulk_create(
+            [StageResult(run=run, stage_id=stage_id, weight=weight) for stage_id, weight, _ in template.stages]
+        )
+        if any(sr.pk is None for sr in stage_results):
+            # Backends that cannot return ids from a bulk INSERT
+            stage_results = list(StageResult.objects.filter(run=run))
+        result_ids = {sr.stage_id: sr.pk for sr in stage_results}
+        SubStageResult.objects.bulk_create([
+            SubStageResult(stage_result_id=result_ids[stage_id], substage_id=substage_id, weight=weight)
+            for stage_id, _, substages in template.stages
+            for substage_id, weight in substages
+        ])
+
+
+def update_result(
+    run_id: int,
+    completion_percent: float,
+    status: Optional[str] = None,
+    stage_id: Optional[int] = None,
+    substage_id: Optional[int] = None,
+    expected_revision: Optional[int] = None,
+) -> RunScore:
+    """Update one substage (if ``substage_id`` is given) or stage result of a run.
+
+    The result row is locked and written with a single UPDATE of the given fields, then the stage
+    rollup and Run.score refresh run in the same transaction (see the consistency notes on
+    ``rollup_stage_results`` and ``refresh_run_score``). Rows are always locked substage, then
+    stage, then run, so concurrent updates cannot deadlock. Raises SubStageResult.DoesNotExist /
+    StageResult.DoesNotExist if the run has no such result, and StaleRevision if
+    ``expected_revision`` is given and the run is no longer at it. Returns the new run score
+    (0.0 .. 1.0) and revision.
+    """
+    fields = {'completion_percent': completion_percent}
+    if status is not None:
+        fields['status'] = status
+    with transaction.atomic():
+        if substage_id:
+            result = (
+                SubStageResult.objects.select_for_update(of=('self',)).only('id', 'stage_result_id')
+                .of_run(run_id).get(substage_id=substage_id)
+            )
+            SubStageResult.objects.filter(pk=result.pk).update(**fields)
+            # Queryset updates bypass the signals, so roll up and notify explicitly like apply_result_updates
+            rolled_up = rollup_stage_results([result.stage_result_id])
+            notify_run_changed(run_id, stage_result_ids=[sr.id for sr in rolled_up], substage_result_ids=[result.pk])
+        else:
+            result = StageResult.objects.select_for_update().only('id', 'weight').get(stage_id=stage_id, run_id=run_id)
+            StageResult.objects.filter(pk=result.pk).update(
+                weighted_score=stage_contribution(result.weight, completion_percent), **fields,
+            )
+            notify_run_changed(run_id, stage_result_ids=[result.pk])
+        return refresh_run_score(run_id, expected_revision)
+
+
+def apply_result_updates(run: Run, updates: Iterable[Mapping], expected_revision: Optional[int] = None) -> RunScore:
+    """Apply a batch of stage/substage updates to ``run`` and refresh its score once.
+
+    Each update is a mapping with ``substage_id`` or ``stage_id`` plus ``completion_percent`` and an
+    optional ``status``; when an id appears more than once the last update wins. Stages touched
+    through their substages are rolled up (see ``rollup_stage_results``). All rows are
+    written with ``bulk_update`` in one transaction, after locking the substage results and then
+    the stage results in id order, the same order ``update_result`` uses. Raises ValueError if an
+    id does not belong to the run, in which case nothing is written, and StaleRevision as
+    ``update_result`` does. Returns the new run score (0.0 .. 1.0) and revision.
+    """
+    substage_updates = {}
+    stage_updates = {}
+    for update in updates:
+        if update.get('substage_id'):
+            substage_updates[update['substage_id']] = update
+        else:
+            stage_updates[update['stage_id']] = update
+
+    with transaction.atomic():
+        # The run's stage result ids are resolved up front: with ``substage_id IN (...)`` next to a
+        # subquery, SQLite without ANALYZE statistics scans the substage_id index across every run.
+        run_stage_result_ids = list(
+            StageResult.objects.filter(run=run).values_list('id', flat=True)
+        ) if substage_updates else []
+        substage_results = list(
+            # Only the substage rows: joined StageResult rows would be locked here, out of id order
+            SubStageResult.objects.select_for_update(of=('self',))
+            .filter(stage_result_id__in=run_stage_result_ids, substage_id__in=substage_updates).order_by('id')
+        ) if substage_updates else []
+        # The explicitly updated stages and the parents to roll up, locked together in id order
+        parent_ids = {ssr.stage_result_id for ssr in substage_results}
+        locked_stage_results = list(StageResult.objects.select_for_update().filter(
+            Q(run=run, stage_id__in=stage_updates) | Q(id__in=parent_ids)
+        ).order_by('id')) if substage_updates or stage_updates else []
+        stage_results = [sr for sr in locked_stage_results if sr.stage_id in stage_updates]
+
+        missing_substages = set(substage_updates) - {ssr.substage_id for ssr in substage_results}
+        missing_stages = set(stage_updates) - {sr.stage_id for sr in stage_results}
+        if missing_substages or missing_stages:
+            raise ValueError(
+                f"Run id={run.id} has no results for substage ids {sorted(missing_substages)} "
+                f"/ stage ids {sorted(missing_stages)}"
+            )
+
+        for ssr in substage_results:
+            update = substage_updates[ssr.substage_id]
+            ssr.completion_percent = update['completion_percent']
+            ssr.status = update.get('status', ssr.status)
+        for sr in stage_results:
+            update = stage_updates[sr.stage_id]
+            sr.completion_percent = update['completion_percent']
+            sr.status = update.get('status', sr.status)
+            sr.weighted_score = stage_contribution(sr.weight, sr.completion_percent)
+
+        # bulk_update bypasses the per-row signals, so rollup and score refresh happen explicitly below
+        SubStageResult.objects.bulk_update(substage_results, ['completion_percent', 'status'])
+        StageResult.objects.bulk_update(stage_results, ['completion_percent', 'status', 'weighted_score'])
+        # Explicit stage updates in the same batch take precedence over the substage rollup
+        rolled_up = rollup_stage_results(parent_ids - {sr.id for sr in stage_results})
+        notify_run_changed(
+            run.id,
+            stage_result_ids=[sr.id for sr in stage_results + rolled_up],
+            substage_result_ids=[ssr.id for ssr in substage_results],
+        )
+        return refresh_run_score(run.id, expected_revision)
+
+
+def truncate_to_bucket(value: datetime, granularity: str) -> datetime:
+    """Start (UTC) of the hour or day bucket containing ``value``."""
+    value = value.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    if granularity == 'day':
+        value = value.replace(hour=0)
+    return value
+
+
+def _duration_seconds(start: Optional[datetime], end: Optional[datetime]) -> Optional[float]:
+    return (end - start).total_seconds() if start and end else None
+
+
+# (pipeline_id, stage_id or None, granularity, bucket_start) -> TrendBucket counter deltas
+TrendTotals = Dict[Tuple[int, Optional[int], str, datetime], Dict[str, float]]
+
+
+def merge_trend_deltas(a: Mapping, b: Mapping) -> dict:
+    """Combine two TrendBucket counter deltas (see add_trend_observation)."""
+    return {
+        'run_count': a['run_count'] + b['run_count'],
+        'score_sum': a['score_sum'] + b['score_sum'],
+        'score_min': min(a['score_min'], b['score_min']),
+        'score_max': max(a['score_max'], b['score_max']),
+        'completed_count': a['completed_count'] + b['completed_count'],
+        'duration_sum': a['duration_sum'] + b['duration_sum'],
+        'duration_count': a['duration_count'] + b['duration_count'],
+    }
+
+
+def add_trend_observation(
+    totals: TrendTotals, pipeline_id: int, stage_id: Optional[int], start_time: datetime,
+    score: float, duration: Optional[float],
+) -> None:
+    """Add one run (``stage_id`` None) or stage result to the hourly and daily entries of ``totals``."""
+    delta = {
+        'run_count': 1,
+        'score_sum': score,
+        'score_min': score,
+        'score_max': score,
+        'completed_count': 1 if score * 100.0 >= COMPLETE_PERCENT else 0,
+        'duration_sum': duration or 0.0,
+        'duration_count': 0 if duration is None else 1,
+    }
+    for granularity in TREND_GRANULARITIES:
+        key = (pipeline_id, stage_id, granularity, truncate_to_bucket(start_time, granularity))
+        totals[key] = merge_trend_deltas(totals[key], delta) if key in totals else delta
+
+
+def _bucket_increments(delta: Mapping) -> dict:
+    """F-expression updates folding a counter delta into a TrendBucket row."""
+    return {
+        'run_count': F('run_count') + delta['run_count'],
+        'score_sum': F('score_sum') + delta['score_sum'],
+        'score_min': Least(Coalesce('score_min', Value(delta['score_min'])), Value(delta['score_min'])),
+        'score_max': Greatest(Coalesce('score_max', Value(delta['score_max'])), Value(delta['score_max'])),
+        'completed_count': F('completed_count') + delta['completed_count'],
+        'duration_sum': F('duration_sum') + delta['duration_sum'],
+        'duration_count': F('duration_count') + delta['duration_count'],
+    }
+
+
+def add_trend_totals(totals: TrendTotals) -> None:
+    """Fold pre-aggregated observations into the TrendBuckets, creating missing rows.
+
+    Costs one INSERT plus one UPDATE per bucket, however many observations it aggregates, so bulk
+    writers can record many runs at once (see the simulate_run command). Missing rows are inserted
+    ignoring conflicts with the unique constraints (including the one on run-level rows), and the
+    counters are incremented in place with F() expressions, so concurrent writers are safe.
+    """
+    TrendBucket.objects.bulk_create([
+        TrendBucket(pipeline_id=pipeline_id, stage_id=stage_id, granularity=granularity, bucket_start=bucket_start)
+        for pipeline_id, stage_id, granularity, bucket_start in totals
+    ], ignore_conflicts=True)
+    for (pipeline_id, stage_id, granularity, bucket_start), delta in totals.items():
+        TrendBucket.objects.filter(
+            pipeline_id=pipeline_id, stage_id=stage_id, granularity=granularity, bucket_start=bucket_start
+        ).update(**_bucket_increments(delta))
+
+
+def bulk_add_trend_totals(totals: TrendTotals) -> None:
+    """Like add_trend_totals, but with a constant number of queries however many buckets are touched.
+
+    Existing rows are locked and merged in Python, then replaced together with the new rows by one
+    DELETE and a bulk INSERT. Meant for offline bulk writers (see the simulate_run command): a
+    concurrent writer creating the same new bucket makes this fail with IntegrityError.
+    """
+    if not totals:
+        return
+    with transaction.atomic():
+        candidates = TrendBucket.objects.select_for_update().filter(
+            pipeline_id__in={key[0] for key in totals},
+            granularity__in={key[2] for key in totals},
+            bucket_start__in={key[3] for key in totals},
+        )
+        merged, replaced = dict(totals), []
+        for bucket in candidates:
+            key = (bucket.pipeline_id, bucket.stage_id, bucket.granularity, bucket.bucket_start)
+            if key not in totals:
+                continue
+            current = {field: getattr(bucket, field) for field in totals[key]}
+            for field in ('score_min', 'score_max'):
+                if current[field] is None:
+                    current[field] = totals[key][field]
+            merged[key] = merge_trend_deltas(current, totals[key])
+            replaced.append(bucket.pk)
+        TrendBucket.objects.filter(pk__in=replaced).delete()
+        TrendBucket.objects.bulk_create([
+            TrendBucket(pipeline_id=pipeline_id, stage_id=stage_id, granularity=granularity, bucket_start=bucket_start, **delta)
+            for (pipeline_id, stage_id, granularity, bucket_start), delta in merged.items()
+        ])
+
+
+def record_run_trend(run_id: int) -> bool:
+    """Fold a finished run into the hourly and daily TrendBuckets of its pipeline.
+
+    Each run is recorded at most once (guarded by Run.trend_recorded); runs without an end_time
+    are skipped. Returns True if the run was recorded by this call.
+    """
+    with transaction.atomic():
+        claimed = Run.objects.filter(id=run_id, trend_recorded=False, end_time__isnull=False).update(trend_recorded=True)
+        if not claimed:
+            return False
+        run = Run.objects.values('pipeline_id', 'start_time', 'end_time', 'score', 'compacted', 'stage_summary').get(id=run_id)
+        if run['compacted']:
+            # Compacted runs keep (stage_id, weight, completion_percent, duration) per stage, see tracker/retention.py
+            stage_rows = [(stage_id, percent, duration) for stage_id, _, percent, duration in run['stage_summary'] or []]
+        else:
+            stage_rows = [
+                (row['stage_id'], row['completion_percent'], _duration_seconds(row['start_time'], row['end_time']))
+                for row in StageResult.objects.filter(run_id=run_id).values('stage_id', 'completion_percent', 'start_time', 'end_time')
+            ]
+
+        totals = {}
+        add_trend_observation(
+            totals, run['pipeline_id'], None, run['start_time'], run['score'],
+            _duration_seconds(run['start_time'], run['end_time']),
+        )
+        for stage_id, percent, duration in stage_rows:
+            add_trend_observation(totals, run['pipeline_id'], stage_id, run['start_time'], (percent or 0.0) / 100.0, duration)
+        add_trend_totals(totals)
+    return True
@@ -1,22 +1,106 @@
-from django.db.models.signals import post_save
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
-from .models import Run, StageResult, SubStageResult, Stage, SubStage
+from .events import notify_run_changed
+from .models import Pipeline, Run, StageResult, Stage, SubStage, SubStageResult
+from .services import (
+    get_pipeline_version, materialize_run_results, record_run_trend, refresh_run_score,
+    rollup_stage_results, stage_contribution,
+)
+
+
+@receiver(pre_save, sender=Run)
+def pin_pipeline_version(sender, instance: Run, raw: bool = False, **kwargs):
+    """Pin a new run to the PipelineVersion of its pipeline's current definition."""
+    if raw or not instance._state.adding or instance.pipeline_version_id:
+        return
+    instance.pipeline_version = get_pipeline_version(instance.pipeline)
 
 
 @receiver(post_save, sender=Run)
-def create_stage_and_substage_results(sender, instance: Run, created: bool, **kwargs):
+def create_stage_and_substage_results(sender, instance: Run, created: bool, raw: bool = False, **kwargs):
     """On Run creation, create StageResult for each Stage in the pipeline and corresponding SubStageResult.
 
     This ensures each run has an initial set of result rows that teams/automations can update.
+    Raw saves (fixtures, imports) bring their own results.
+    """
+    if raw or not created:
+        return
+
+    materialize_run_results(instance)
+
+
+@receiver(post_save, sender=Run)
+def bump_run_revision(sender, instance: Run, created: bool, raw: bool = False, **kwargs):
+    """Edits of the run's own fields invalidate its ETag as well (result changes bump it in services)."""
+    if raw or created:
+        return
+    Run.objects.filter(pk=instance.pk).update(revision=F('revision') + 1)
+    notify_run_changed(instance.pk)
+
+
+@receiver(post_save, sender=Run)
+def record_finished_run_trend(sender, instance: Run, raw: bool = False, **kwargs):
+    """Fold a run into the pipeline trend rollups once it has an end_time.
+
+    Buckets are a snapshot taken when the run finishes: later edits to the run or its results are
+    not applied to them. Run ``manage.py rebuild_trend_rollups`` to recompute them after such edits.
+    """
+    if raw or not instance.end_time or instance.trend_recorded:
+        return
+    record_run_trend(instance.id)
+
+
+@receiver(pre_save, sender=StageResult)
+def set_stage_result_contribution(sender, instance: StageResult, **kwargs):
+    """Keep the stored weighted contribution in sync with completion_percent."""
+    instance.weighted_score = stage_contribution(instance.weight, instance.completion_percent)
+
+
+@receiver(post_save, sender=StageResult)
+def update_run_score(sender, instance: StageResult, created: bool, raw: bool = False, **kwargs):
+    """Refresh the denormalized Run.score whenever one of its StageResults changes.
+
+    Freshly created results with no progress cannot change the score, so they are skipped.
     """
-    if not created:
+    if raw or (created and not instance.weighted_score):
+        return
+    refresh_run_score(instance.run_id)
+    notify_run_changed(instance.run_id, stage_result_ids=[instance.id])
+
+
+@receiver(post_save, sender=SubStageResult)
+def rollup_substage_result(sender, instance: SubStageResult, raw: bool = False, **kwargs):
+    """Propagate a substage change to its StageResult completion and then to the run score."""
+    if raw:
         return
+    for sr in rollup_stage_results([instance.stage_result_id]):
+        refresh_run_score(sr.run_id)
+        notify_run_changed(sr.run_id, stage_result_ids=[sr.id], substage_result_ids=[instance.id])
 
-    pipeline = instance.pipeline
-    stages = pipeline.stages.all()
-    for stage in stages:
-        sr, _ = StageResult.objects.get_or_create(run=instance, stage=stage)
-        # create substageresults
-        substages = stage.substages.all()
-        for sub in substages:
-            SubStageResult.objects.get_or_create(stage_result=sr, substage=sub)
+
+# Stage edits need no score refresh: results carry the weights pinned at run creation, and
+# stages with results cannot be deleted (they are archived instead).
+@receiver(post_save, sender=Stage)
+@receiver(post_delete, sender=Stage)
+def bump_structure_version_on_stage_change(sender, instance: Stage, **kwargs):
+    """Invalidate cached result templates of the pipeline (see services.get_result_template).
+
+    The pipeline no longer matches the config it was loaded from, so its content_hash is cleared too.
+    """
+    Pipeline.objects.filter(pk=instance.pipeline_id).update(structure_version=F('structure_version') + 1, content_hash='')
+
+
+@receiver(post_save, sender=SubStage)
+@receiver(post_delete, sender=SubStage)
+def bump_structure_version_on_substage_change(sender, instance: SubStage, **kwargs):
+    Pipeline.objects.filter(stages=instance.stage_id).update(structure_version=F('structure_version') + 1, content_hash='')
+
+
+@receiver(post_save, sender=Pipeline)
+def bump_structure_version_on_pipeline_save(sender, instance: Pipeline, raw: bool = False, **kwargs):
+    """Pipeline fields are part of the cached definition too (see tracker.caching)."""
+    if raw:
+        return
+    Pipeline.objects.filter(pk=instance.pk).update(structure_version=F('structure_version') + 1, content_hash='')
+    instance.refresh_from_db(fields=['structure_version', 'content_hash'])
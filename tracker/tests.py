@@ -0,0 +1,849 @@
+import asyncio
+import io
+import json
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import RestrictedError
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from rest_framework.pagination import PageNumberPagination
+from .models import (
+    Organization, Pipeline, PipelineVersion, Project, Run, Stage, StageResult, SubStage, SubStageResult, Team, TrendBucket,
+)
+from .buffer import ProgressBuffer
+from .caching import get_pipeline_cache
+from .metrics import registry
+from .middleware import record_queries
+from .retention import compact_pipeline_runs, compact_run_batch, compactable_runs
+from .scorecard import build_scorecard
+from .serializers import RunSerializer
+from .services import (
+    _compile_result_template, add_trend_observation, add_trend_totals, apply_result_updates, calculate_run_score,
+    update_result,
+)
+from .transfer import aexport_run_lines, export_run_lines, import_run_lines, run_record
+
+
+def create_pipeline(stages=2, substages=3, name='pipeline'):
+    # Rolled-back tests hand out the same pipeline ids and structure versions again
+    _compile_result_template.cache_clear()
+    org = Organization.objects.create(name=name)
+    project = Project.objects.create(team=Team.objects.create(organization=org, name=name), name=name)
+    pipeline = Pipeline.objects.create(project=project, name=name)
+    for i in range(stages):
+        stage = Stage.objects.create(pipeline=pipeline, name=f'stage {i}', weight=1.0 / stages, order=i)
+        for j in range(substages):
+            SubStage.objects.create(stage=stage, name=f'substage {j}', weight=1.0 / substages, order=j)
+    return pipeline
+
+
+class RunScoreTests(TestCase):
+    def setUp(self):
+        self.run = Run.objects.create(pipeline=create_pipeline(), triggered_by='tests')
+        self.stage_results = list(self.run.stage_results.order_by('id'))
+
+    def test_score_is_stored_on_every_update(self):
+        first, second = self.stage_results
+        update_result(self.run.id, 50.0, stage_id=first.stage_id)
+        self.run.refresh_from_db()
+        self.assertAlmostEqual(self.run.score, 0.25)
+        # Saving a result directly goes through the signals
+        second.completion_percent = 100.0
+        second.save()
+        self.run.refresh_from_db()
+        self.assertAlmostEqual(self.run.score, 0.75)
+        self.assertAlmostEqual(StageResult.objects.get(pk=second.pk).weighted_score, 0.5)
+
+    def test_substage_updates_reach_the_run_score(self):
+        substage = SubStage.objects.filter(stage=self.stage_results[0].stage).first()
+        update_result(self.run.id, 100.0, substage_id=substage.id)
+        self.run.refresh_from_db()
+        # One of three equally weighted substages of one of two equally weighted stages
+        self.assertAlmostEqual(self.run.score, 1 / 6)
+        self.assertEqual(self.run.overall_score, self.run.score)
+
+
+class ScoreAggregationTests(TestCase):
+    def test_with_scores_matches_calculate_run_score(self):
+        pipeline = create_pipeline(stages=3)
+        runs = [Run.objects.create(pipeline=pipeline, triggered_by='tests') for _ in range(3)]
+        stage_ids = list(Stage.objects.filter(pipeline=pipeline).values_list('id', flat=True))
+        for run, percents in zip(runs, ([0, 0, 0], [100, 50, 0], [100, 100, 100])):
+            for stage_id, percent in zip(stage_ids, percents):
+                update_result(run.id, percent, stage_id=stage_id)
+
+        with self.assertNumQueries(1):
+            computed = dict(Run.objects.filter(pipeline=pipeline).with_scores().values_list('id', 'computed_score'))
+        for run, expected in zip(runs, (0.0, 0.5, 1.0)):
+            self.assertAlmostEqual(computed[run.id], expected)
+            self.assertAlmostEqual(calculate_run_score(run.id), expected)
+
+    def test_calculate_run_score_of_unknown_run(self):
+        with self.assertRaises(ValueError):
+            calculate_run_score(999999)
+
+
+class ResultMaterializationTests(TestCase):
+    def test_query_count_does_not_depend_on_pipeline_size(self):
+        for stages in (2, 10):
+            pipeline = create_pipeline(stages=stages, substages=5, name=f'{stages} stages')
+            pipeline.refresh_from_db()
+            Run.objects.create(pipeline=pipeline, triggered_by='tests')  # compiles the cached template
+            # Version lookup, run INSERT, then one bulk INSERT each for stage and substage results
+            # (inside a savepoint)
+            with self.subTest(stages=stages), self.assertNumQueries(6):
+                run = Run.objects.create(pipeline=pipeline, triggered_by='tests')
+            self.assertEqual(run.stage_results.count(), stages)
+            self.assertEqual(SubStageResult.objects.of_run(run.id).count(), stages * 5)
+            self.assertEqual(set(run.stage_results.values_list('weight', flat=True)), {1.0 / stages})
+
+
+class BatchUpdateTests(TestCase):
+    def setUp(self):
+        self.run = Run.objects.create(pipeline=create_pipeline(), triggered_by='tests')
+        self.url = f'/api/runs/{self.run.id}/update_stages/'
+        self.substage_ids = list(SubStageResult.objects.of_run(self.run.id).order_by('id').values_list('substage_id', flat=True))
+
+    def post(self, payload):
+        return self.client.post(self.url, json.dumps(payload), content_type='application/json')
+
+    def test_invalid_batches_are_rejected(self):
+        for payload in (
+            {'updates': []},
+            {'updates': 'all'},
+            [{'completion_percent': 50}],
+            [{'substage_id': self.substage_ids[0], 'completion_percent': 150}],
+            [{'substage_id': self.substage_ids[0]}],
+        ):
+            with self.subTest(payload=payload):
+                self.assertEqual(self.post(payload).status_code, 400)
+
+    def test_batch_with_an_unknown_id_writes_nothing(self):
+        response = self.post([
+            {'substage_id': self.substage_ids[0], 'completion_percent': 100},
+            {'substage_id': 999999, 'completion_percent': 100},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('999999', response.json()['detail'])
+        self.assertFalse(SubStageResult.objects.of_run(self.run.id).exclude(completion_percent=0).exists())
+        self.assertEqual(Run.objects.get(pk=self.run.pk).revision, self.run.revision)
+
+    def test_batch_is_applied_with_one_score_refresh(self):
+        stage_id = self.run.stage_results.order_by('id').last().stage_id
+        response = self.post({'updates': [
+            *({'substage_id': substage_id, 'completion_percent': 100} for substage_id in self.substage_ids[:3]),
+            {'stage_id': stage_id, 'completion_percent': 50, 'status': 'partial'},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['overall_score'], 75.0)
+        run = Run.objects.get(pk=self.run.pk)
+        self.assertEqual(run.revision, self.run.revision + 1)
+        self.assertEqual(response['ETag'], run.etag)
+        stage_results = response.json()['stage_results']
+        self.assertEqual([sr['status'] for sr in stage_results], ['completed', 'partial'])
+        self.assertAlmostEqual(stage_results[0]['completion_percent'], 100.0)
+
+
+class StageRollupTests(TestCase):
+    def setUp(self):
+        self.pipeline = create_pipeline(stages=1, substages=2)
+        self.substages = list(SubStage.objects.filter(stage__pipeline=self.pipeline).order_by('order'))
+
+    def stage_result(self, run):
+        return StageResult.objects.get(run=run)
+
+    def test_stage_completion_is_the_weighted_mean_of_its_substages(self):
+        # Saved one by one, so the signals bump the pipeline's structure version
+        for substage, weight in zip(self.substages, (3.0, 1.0)):
+            substage.weight = weight
+            substage.save()
+        run = Run.objects.create(pipeline=Pipeline.objects.get(pk=self.pipeline.pk), triggered_by='tests')
+        update_result(run.id, 100.0, substage_id=self.substages[0].id)
+        stage_result = self.stage_result(run)
+        self.assertAlmostEqual(stage_result.completion_percent, 75.0)
+        self.assertEqual(stage_result.status, 'partial')
+        update_result(run.id, 100.0, substage_id=self.substages[1].id)
+        self.assertEqual(self.stage_result(run).status, 'completed')
+        self.assertAlmostEqual(Run.objects.get(pk=run.pk).score, 1.0)
+
+    def test_zero_weights_fall_back_to_the_plain_mean(self):
+        for substage in self.substages:
+            substage.weight = 0.0
+            substage.save()
+        run = Run.objects.create(pipeline=Pipeline.objects.get(pk=self.pipeline.pk), triggered_by='tests')
+        update_result(run.id, 40.0, substage_id=self.substages[0].id)
+        self.assertAlmostEqual(self.stage_result(run).completion_percent, 20.0)
+
+    def test_a_failed_substage_fails_the_stage(self):
+        run = Run.objects.create(pipeline=self.pipeline, triggered_by='tests')
+        update_result(run.id, 100.0, substage_id=self.substages[0].id)
+        update_result(run.id, 10.0, status='failed', substage_id=self.substages[1].id)
+        self.assertEqual(self.stage_result(run).status, 'failed')
+
+
+class RunListQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.pipeline = create_pipeline()
+        for _ in range(20):
+            Run.objects.create(pipeline=cls.pipeline, triggered_by='tests')
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        # Runs, stage results and substage results: one query each, however many runs are on the page
+        for page_size in (2, 20):
+            with self.subTest(page_size=page_size), self.assertNumQueries(3):
+                response = self.client.get('/api/runs/', {'page_size': page_size})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()['results']), page_size)
+            self.assertTrue(all(run['stage_results'] for run in response.json()['results']))
+
+
+class FieldSelectionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tracked = Run.objects.create(pipeline=create_pipeline(), triggered_by='tests')
+
+    def test_fields_restrict_the_representation_and_skip_the_results(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/runs/', {'fields': 'id,overall_score'})
+        self.assertEqual(response.json()['results'], [{'id': self.tracked.id, 'overall_score': 0.0}])
+        response = self.client.get(f'/api/runs/{self.tracked.id}/summary/', {'fields': 'id,status'})
+        self.assertEqual(response.json(), {'id': self.tracked.id, 'status': 'running'})
+
+    def test_compact_view_and_expand(self):
+        compact = self.client.get(f'/api/runs/{self.tracked.id}/', {'view': 'compact'}).json()
+        self.assertEqual(list(compact), RunSerializer.compact_fields)
+        expanded = self.client.get(f'/api/runs/{self.tracked.id}/', {'view': 'compact', 'expand': 'stage_results'}).json()
+        self.assertEqual(set(expanded), {*RunSerializer.compact_fields, 'stage_results'})
+        self.assertEqual(len(expanded['stage_results']), 2)
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get(f'/api/runs/{self.tracked.id}/', {'fields': 'id,bogus,other'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'fields': 'Unknown fields: bogus, other'})
+        self.assertEqual(self.client.get('/api/runs/', {'fields': 'bogus'}).status_code, 400)
+
+
+class RunFilterTests(TestCase):
+    def test_malformed_pipeline_id_is_rejected(self):
+        for url in ('/api/runs/', '/api/runs/export/'):
+            with self.subTest(url=url):
+                response = self.client.get(url, {'pipeline': 'abc'})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('pipeline', response.json())
+
+
+class TrendBucketTests(TestCase):
+    def test_run_level_buckets_are_unique(self):
+        pipeline = create_pipeline()
+        start = datetime(2025, 1, 1, 10, 30, tzinfo=timezone.utc)
+        for score in (0.5, 1.0):
+            totals = {}
+            add_trend_observation(totals, pipeline.id, None, start, score, 60.0)
+            add_trend_totals(totals)
+        bucket = TrendBucket.objects.get(pipeline=pipeline, stage=None, granularity='day')
+        self.assertEqual((bucket.run_count, bucket.score_sum, bucket.completed_count), (2, 1.5, 1))
+
+    def test_imports_add_to_live_buckets(self):
+        pipeline = create_pipeline()
+        start = datetime(2025, 1, 1, 10, 30, tzinfo=timezone.utc)
+        run = Run.objects.create(pipeline=pipeline, triggered_by='tests', start_time=start)
+        for stage_result in run.stage_results.all():
+            update_result(run.id, 100.0, stage_id=stage_result.stage_id)
+        run.end_time = datetime(2025, 1, 1, 11, 0, tzinfo=timezone.utc)
+        run.save()
+        lines = list(export_run_lines(Run.objects.filter(pk=run.pk)))
+        self.assertEqual(sum(import_run_lines(lines, pipeline)), 1)
+        buckets = TrendBucket.objects.filter(pipeline=pipeline, granularity='day')
+        self.assertEqual(buckets.count(), 3)
+        self.assertEqual({(b.run_count, b.completed_count) for b in buckets}, {(2, 2)})
+
+    def test_malformed_stage_filter_is_rejected(self):
+        pipeline = create_pipeline()
+        response = self.client.get(f'/api/pipelines/{pipeline.id}/trend/', {'bucket': 'day', 'stage': 'abc'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('stage', response.json())
+
+
+class PipelineCacheTests(TestCase):
+    def setUp(self):
+        # Rolled-back tests hand out the same pipeline ids and structure versions again
+        get_pipeline_cache().clear()
+
+    def test_structure_changes_invalidate_etag_and_cache(self):
+        pipeline = create_pipeline()
+        response = self.client.get(f'/api/pipelines/{pipeline.id}/')
+        etag = response['ETag']
+        self.assertEqual(self.client.get(f'/api/pipelines/{pipeline.id}/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Served from the cache, so no queries beyond the version lookup
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(f'/api/pipelines/{pipeline.id}/').json(), response.json())
+
+        substage = SubStage.objects.filter(stage__pipeline=pipeline).first()
+        substage.name = 'renamed'
+        substage.save()
+        response = self.client.get(f'/api/pipelines/{pipeline.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['stages'][0]['substages'][0]['name'], 'renamed')
+
+        Stage.objects.filter(pipeline=pipeline).last().delete()
+        response = self.client.get(f'/api/pipelines/{pipeline.id}/')
+        self.assertEqual(len(response.json()['stages']), 1)
+
+    def test_list_etag_covers_count_and_page(self):
+        first = create_pipeline(name='first')
+        create_pipeline(name='second')
+        with mock.patch.object(PageNumberPagination, 'page_size', 1):
+            response = self.client.get('/api/pipelines/')
+            etag = response['ETag']
+            self.assertEqual(response.json()['count'], 2)
+            self.assertEqual(self.client.get('/api/pipelines/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertNotEqual(self.client.get('/api/pipelines/', {'page': 2})['ETag'], etag)
+
+            # Same first page, but a new pipeline changes the count
+            create_pipeline(name='third')
+            response = self.client.get('/api/pipelines/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['count'], 3)
+            self.assertEqual(response.json()['results'][0]['id'], first.id)
+
+
+class RunConditionalGetTests(TestCase):
+    def setUp(self):
+        self.tracked = Run.objects.create(pipeline=create_pipeline(), triggered_by='tests')
+        self.url = f'/api/runs/{self.tracked.id}/summary/'
+
+    def revision(self):
+        return Run.objects.filter(pk=self.tracked.pk).values_list('revision', flat=True).get()
+
+    def test_every_change_bumps_the_revision(self):
+        revision = self.revision()
+        stage_id = self.tracked.stage_results.first().stage_id
+        update_result(self.tracked.id, 50.0, stage_id=stage_id)
+        self.assertEqual(self.revision(), revision + 1)
+        apply_result_updates(self.tracked, [{'stage_id': stage_id, 'completion_percent': 75.0}])
+        self.assertEqual(self.revision(), revision + 2)
+        run = Run.objects.get(pk=self.tracked.pk)
+        run.triggered_by = 'someone else'
+        run.save()
+        self.assertEqual(self.revision(), revision + 3)
+
+    def test_unchanged_summary_is_answered_with_304(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertEqual(etag, f'"run-{self.tracked.id}-{self.revision()}"')
+        # Only the revision is read, no result rows
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response['ETag']), (304, etag))
+
+        stage_id = self.tracked.stage_results.first().stage_id
+        self.client.post(f'/api/runs/{self.tracked.id}/update_stage/', {'stage_id': stage_id, 'completion_percent': 100})
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['overall_score'], 50.0)
+
+
+def load_config(stages, substage_weight=0.5, stdout=None):
+    """Run load_pipeline_config for pipeline "loaded" with ``{stage name: [substage names]}``."""
+    config = {'pipeline_name': 'loaded', 'stages': [
+        {'name': name, 'weight': 1.0 / len(stages), 'substages': [{'name': sub, 'weight': substage_weight} for sub in subs]}
+        for name, subs in stages.items()
+    ]}
+    with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+        json.dump(config, f)
+        f.flush()
+        call_command('load_pipeline_config', f.name, stdout=stdout or io.StringIO())
+    return Pipeline.objects.get(name='loaded')
+
+
+class LoadPipelineConfigTests(TestCase):
+    def load(self, stages):
+        return load_config(stages)
+
+    def test_removed_stages_are_archived_with_their_history(self):
+        create_pipeline()
+        pipeline = self.load({'build': ['compile', 'lint'], 'deploy': ['push', 'verify']})
+        run = Run.objects.create(pipeline=pipeline, triggered_by='tests')
+        deploy = Stage.objects.get(pipeline=pipeline, name='deploy')
+        for sub in ('push', 'verify'):
+            update_result(run.id, 100.0, substage_id=SubStage.objects.get(stage=deploy, name=sub).id)
+        run.refresh_from_db()
+
+        pipeline = self.load({'build': ['compile']})
+        old = Run.objects.get(pk=run.pk)
+        self.assertEqual((old.score, old.revision), (run.score, run.revision))
+        self.assertEqual(StageResult.objects.get(run=run, stage=deploy).completion_percent, 100.0)
+        self.assertTrue(Stage.objects.get(pk=deploy.pk).archived)
+        self.assertTrue(SubStage.objects.get(stage__name='build', name='lint').archived)
+        new = Run.objects.create(pipeline=pipeline, triggered_by='tests')
+        self.assertEqual(list(new.stage_results.values_list('stage__name', flat=True)), ['build'])
+        self.assertEqual(SubStageResult.objects.of_run(new.id).count(), 1)
+        stages = self.client.get(f'/api/pipelines/{pipeline.id}/').json()['stages']
+        self.assertEqual([(s['name'], [sub['name'] for sub in s['substages']]) for s in stages], [('build', ['compile'])])
+
+        # Reappearing stages/substages are restored rather than recreated
+        pipeline = self.load({'build': ['compile', 'lint'], 'deploy': ['push', 'verify']})
+        self.assertFalse(Stage.objects.get(pk=deploy.pk).archived)
+        self.assertEqual(Stage.objects.filter(pipeline=pipeline).count(), 2)
+        self.assertEqual(Run.objects.create(pipeline=pipeline, triggered_by='tests').stage_results.count(), 2)
+
+
+class PipelineVersionTests(TestCase):
+    stages = {'build': ['compile', 'lint'], 'deploy': ['push']}
+
+    def setUp(self):
+        create_pipeline()
+
+    def test_unchanged_reload_is_a_no_op(self):
+        pipeline = load_config(self.stages)
+        stdout = io.StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            reloaded = load_config(self.stages, stdout=stdout)
+        self.assertIn('unchanged', stdout.getvalue())
+        writes = [q['sql'] for q in queries if q['sql'].split(None, 1)[0] in ('INSERT', 'UPDATE', 'DELETE')]
+        self.assertEqual(writes, [])
+        self.assertEqual(reloaded.structure_version, pipeline.structure_version)
+        self.assertEqual(pipeline.versions.count(), 1)
+
+    def test_runs_pin_the_version_they_were_created_from(self):
+        pipeline = load_config(self.stages)
+        first = Run.objects.create(pipeline=pipeline, triggered_by='tests')
+        same = Run.objects.create(pipeline=pipeline, triggered_by='tests')
+        self.assertEqual(same.pipeline_version_id, first.pipeline_version_id)
+        self.assertEqual(first.pipeline_version.content_hash, pipeline.content_hash)
+
+        pipeline = load_config(self.stages, substage_weight=0.25)
+        changed = Run.objects.create(pipeline=pipeline, triggered_by='tests')
+        self.assertNotEqual(changed.pipeline_version_id, first.pipeline_version_id)
+        self.assertEqual(pipeline.versions.count(), 2)
+        # The old version and the results pinned to it keep the weights they were created with
+        old = PipelineVersion.objects.get(pk=first.pipeline_version_id)
+        self.assertEqual({sub['weight'] for stage in old.definition['stages'] for sub in stage['substages']}, {0.5})
+        self.assertEqual(set(SubStageResult.objects.of_run(first.id).values_list('weight', flat=True)), {0.5})
+        self.assertEqual(set(SubStageResult.objects.of_run(changed.id).values_list('weight', flat=True)), {0.25})
+
+        # Going back to the first definition reuses its version
+        pipeline = load_config(self.stages)
+        self.assertEqual(Run.objects.create(pipeline=pipeline, triggered_by='tests').pipeline_version_id, first.pipeline_version_id)
+
+
+class StageDeletionTests(TestCase):
+    def test_stages_with_results_cannot_be_deleted(self):
+        pipeline = create_pipeline()
+        run = Run.objects.create(pipeline=pipeline, triggered_by='tests')
+        stage_result = run.stage_results.first()
+        update_result(run.id, 100.0, stage_id=stage_result.stage_id)
+        run.refresh_from_db()
+        for definition in (stage_result.stage, SubStage.objects.filter(stage__pipeline=pipeline).last()):
+            with self.subTest(definition=definition), self.assertRaises(RestrictedError):
+                definition.delete()
+        self.assertEqual(Run.objects.filter(pk=run.pk).values_list('score', 'revision').get(), (run.score, run.revision))
+
+    def test_pipelines_are_deleted_with_their_runs(self):
+        pipeline = create_pipeline()
+        Run.objects.create(pipeline=pipeline, triggered_by='tests')
+        pipeline.project.team.organization.delete()
+        self.assertFalse(StageResult.objects.exists())
+        self.assertFalse(Stage.objects.exists())
+
+
+def parse_sse(chunk) -> tuple:
+    """(event name, data) of one server-sent event message."""
+    fields = dict(line.split(': ', 1) for line in chunk.decode().strip().splitlines())
+    return fields['event'], json.loads(fields['data'])
+
+
+class RunEventStreamTests(TransactionTestCase):
+    # Events are published on transaction commit, so the writes must really commit
+
+    async def test_write_before_first_read_is_delivered(self):
+        run = await sync_to_async(lambda: Run.objects.create(pipeline=create_pipeline(), triggered_by='tests'))()
+        stage_result = await StageResult.objects.filter(run=run).afirst()
+        response = await self.async_client.get(f'/api/runs/{run.id}/stream/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        # Committed after the view returned but before the client reads anything
+        await sync_to_async(update_result)(run.id, 100.0, stage_id=stage_result.stage_id)
+
+        events = aiter(response.streaming_content)
+        name, snapshot = parse_sse(await asyncio.wait_for(anext(events), 5))
+        self.assertEqual((name, snapshot['overall_score']), ('snapshot', 0.0))
+        name, update = parse_sse(await asyncio.wait_for(anext(events), 5))
+        self.assertEqual(name, 'update')
+        self.assertEqual(update['overall_score'], round(stage_result.weight * 100, 2))
+        self.assertEqual([sr['id'] for sr in update['stage_results']], [stage_result.id])
+        await response.streaming_content.aclose()
+
+    async def test_unknown_run_is_404(self):
+        response = await self.async_client.get('/api/runs/999999/stream/')
+        self.assertEqual(response.status_code, 404)
+
+
+class UpdateStageEndpointTests(TestCase):
+    """The sync and async update_stage endpoints must answer every payload the same way."""
+
+    def setUp(self):
+        self.tracked = Run.objects.create(pipeline=create_pipeline(), triggered_by='tests')
+        self.stage_id = self.tracked.stage_results.first().stage_id
+        self.urls = (f'/api/runs/{self.tracked.id}/update_stage/', f'/api/async/runs/{self.tracked.id}/update_stage/')
+
+    def post(self, url, payload, **headers):
+        return self.client.post(url, json.dumps(payload), content_type='application/json', **headers)
+
+    def test_invalid_payloads_are_rejected_alike(self):
+        for payload in (
+            {'stage_id': self.stage_id, 'completion_percent': 'half'},
+            {'stage_id': self.stage_id, 'completion_percent': None},
+            {'completion_percent': 50},
+        ):
+            responses = [self.post(url, payload) for url in self.urls]
+            with self.subTest(payload=payload):
+                self.assertEqual([r.status_code for r in responses], [400, 400])
+                self.assertEqual(responses[0].json(), responses[1].json())
+        self.assertEqual(Run.objects.get(pk=self.tracked.pk).revision, self.tracked.revision)
+
+    def test_updates_and_stale_if_match_are_answered_alike(self):
+        etag = self.tracked.etag
+        for url, percent in zip(self.urls, (50, 100)):
+            response = self.post(url, {'stage_id': self.stage_id, 'completion_percent': percent})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['ETag'], Run.objects.get(pk=self.tracked.pk).etag)
+            self.assertEqual(response.json(), {'overall_score': percent / 2})
+
+        responses = [self.post(url, {'stage_id': self.stage_id}, HTTP_IF_MATCH=etag) for url in self.urls]
+        self.assertEqual([r.status_code for r in responses], [412, 412])
+        self.assertEqual(responses[0].json(), responses[1].json())
+        self.assertEqual(responses[0]['ETag'], responses[1]['ETag'])
+
+
+class RequestMetricsMiddlewareTests(TestCase):
+    def setUp(self):
+        registry.reset()
+
+    async def test_async_views_run_without_adapting_the_middleware(self):
+        run = await sync_to_async(lambda: Run.objects.create(pipeline=create_pipeline(), triggered_by='tests'))()
+        # Django logs every sync/async adaptation of a middleware when DEBUG is on
+        with override_settings(DEBUG=True), self.assertNoLogs('django.request', 'DEBUG'):
+            response = await self.async_client.get(f'/api/async/runs/{run.id}/summary/')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(registry._endpoints['async-run-summary'].queries.sum, 0)
+
+    async def test_queries_in_other_threads_are_counted(self):
+        def query():
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+            finally:
+                connection.close()
+
+        with record_queries() as recorder:
+            await sync_to_async(query, thread_sensitive=False)()
+        self.assertEqual(recorder.count, 1)
+
+    def test_sync_requests_are_measured(self):
+        pipeline = create_pipeline()
+        Run.objects.create(pipeline=pipeline, triggered_by='tests')
+        self.client.get('/api/runs/')
+        self.assertEqual(registry._endpoints['run.list'].queries.sum, 3)
+
+
+class ProgressBufferTests(TransactionTestCase):
+    # The flushes write from their own threads, which must see committed rows
+
+    def test_flush_waits_for_a_flush_in_progress(self):
+        run = Run.objects.create(pipeline=create_pipeline(), triggered_by='tests')
+        result = SubStageResult.objects.of_run(run.id).first()
+        buffer = ProgressBuffer(flush_interval_ms=60000)
+        buffer.add(run.id, result.substage_id, 50.0)
+
+        writing, release = threading.Event(), threading.Event()
+
+        def slow_apply(*args, **kwargs):
+            writing.set()
+            release.wait(5)
+            return apply_result_updates(*args, **kwargs)
+
+        def flush(run_id=None):
+            try:
+                buffer.flush(run_id)
+            finally:
+                connection.close()
+
+        with mock.patch('tracker.buffer.apply_result_updates', slow_apply):
+            timer_flush = threading.Thread(target=flush)
+            timer_flush.start()
+            self.assertTrue(writing.wait(5))
+            # The batch left the pending map but is not committed yet: reads must still wait for it
+            self.assertTrue(buffer.has_pending(run.id))
+            read_flush = threading.Thread(target=flush, args=(run.id,))
+            read_flush.start()
+            read_flush.join(0.2)
+            self.assertTrue(read_flush.is_alive())
+            release.set()
+            timer_flush.join(5)
+            read_flush.join(5)
+        self.assertFalse(buffer.has_pending(run.id))
+        result.refresh_from_db()
+        self.assertEqual(result.completion_percent, 50.0)
+
+
+class BufferedReadTests(TestCase):
+    """Reads and run updates flush the buffered progress of exactly the runs involved."""
+
+    def setUp(self):
+        self.buffer = ProgressBuffer(flush_interval_ms=60000)
+        patcher = mock.patch('tracker.buffer._buffer', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        settings = override_settings(TRACKER_WRITE_BUFFER={'ENABLED': True})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.pipeline = create_pipeline()
+
+    def report(self, run, stage_index=0):
+        """Buffer 100% for every substage of one stage, i.e. half of the run's score."""
+        stage = run.pipeline.stages.order_by('order')[stage_index]
+        for substage in stage.substages.all():
+            self.buffer.add(run.id, substage.id, 100.0)
+
+    def test_list_flushes_only_the_page(self):
+        older = Run.objects.create(pipeline=self.pipeline, triggered_by='tests')
+        newer = Run.objects.create(pipeline=self.pipeline, triggered_by='tests')
+        self.report(older)
+        self.report(newer)
+        results = self.client.get('/api/runs/', {'page_size': 1}).json()['results']
+        self.assertEqual([(r['id'], r['overall_score']) for r in results], [(newer.id, 50.0)])
+        self.assertFalse(self.buffer.has_pending(newer.id))
+        self.assertTrue(self.buffer.has_pending(older.id))
+
+    def test_trend_flushes_the_pipeline_runs(self):
+        other = Run.objects.create(pipeline=create_pipeline(name='other'), triggered_by='tests')
+        self.report(other)
+        for url in (f'/api/pipelines/{self.pipeline.id}/trend/', f'/api/async/pipelines/{self.pipeline.id}/trend/'):
+            with self.subTest(url=url):
+                run = Run.objects.create(pipeline=self.pipeline, triggered_by='tests')
+                self.report(run)
+                self.assertEqual(self.client.get(url, {'n': 1}).json()[0]['overall_score'], 50.0)
+                self.assertFalse(self.buffer.has_pending(run.id))
+        self.assertTrue(self.buffer.has_pending(other.id))
+
+    def test_finishing_a_run_snapshots_its_buffered_progress(self):
+        run = Run.objects.create(pipeline=self.pipeline, triggered_by='tests')
+        self.report(run)
+        response = self.client.patch(
+            f'/api/runs/{run.id}/', json.dumps({'end_time': '2025-01-01T12:00:00Z'}), content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['overall_score'], 50.0)
+        bucket = TrendBucket.objects.get(pipeline=self.pipeline, stage=None, granularity='day')
+        self.assertEqual(bucket.run_count, 1)
+        self.assertAlmostEqual(bucket.score_sum, 0.5)
+
+
+class SimulateRunTests(TestCase):
+    def simulate(self, pipeline, **options):
+        before = set(Run.objects.values_list('id', flat=True))
+        call_command('simulate_run', pipeline.id, stdout=io.StringIO(), **options)
+        return Run.objects.exclude(id__in=before).order_by('id')
+
+    def bucket_rows(self, pipeline):
+        return list(TrendBucket.objects.filter(pipeline=pipeline).order_by('stage_id', 'granularity', 'bucket_start').values_list(
+            'stage_id', 'granularity', 'bucket_start', 'run_count', 'completed_count', 'duration_count',
+        ))
+
+    def test_simulated_runs_match_the_live_write_path(self):
+        pipeline = create_pipeline(stages=3, substages=2)
+        runs = self.simulate(pipeline, runs=5, batch_size=2, seed=1)
+        self.assertEqual(len(runs), 5)
+        version_id = Run.objects.create(pipeline=pipeline, triggered_by='tests').pipeline_version_id
+        for run in runs:
+            with self.subTest(run=run.id):
+                self.assertEqual((run.pipeline_version_id, run.trend_recorded), (version_id, True))
+                self.assertIsNotNone(run.end_time)
+                self.assertEqual(run.stage_results.count(), 3)
+                self.assertEqual(SubStageResult.objects.of_run(run.id).count(), 6)
+                self.assertAlmostEqual(run.score, calculate_run_score(run.id))
+
+        # The rollups written in one pass equal the ones recorded run by run
+        buckets = self.bucket_rows(pipeline)
+        self.assertEqual(sum(row[3] for row in buckets if row[0] is None and row[1] == 'day'), 5)
+        call_command('rebuild_trend_rollups', pipeline_id=pipeline.id, stdout=io.StringIO())
+        self.assertEqual(self.bucket_rows(pipeline), buckets)
+
+    def test_same_seed_creates_the_same_runs(self):
+        pipeline = create_pipeline()
+        first, second = (
+            list(self.simulate(pipeline, runs=4, batch_size=3, seed=7).values_list('score', 'status', 'triggered_by'))
+            for _ in range(2)
+        )
+        self.assertEqual(first, second)
+        complete = self.simulate(pipeline, runs=3, complete=True)
+        for status_, score in complete.values_list('status', 'score'):
+            self.assertEqual(status_, 'completed')
+            self.assertAlmostEqual(score, 1.0)
+
+
+class ScorecardTests(TestCase):
+    def finish(self, pipeline, start, percent):
+        run = Run.objects.create(pipeline=pipeline, triggered_by='tests', start_time=start)
+        for stage_result in run.stage_results.all():
+            update_result(run.id, percent, stage_id=stage_result.stage_id)
+        run.end_time = start + timedelta(minutes=10)
+        run.save()
+        return run
+
+    def test_window_includes_the_day_of_since(self):
+        pipeline = create_pipeline()
+        since = datetime(2025, 1, 10, 12, 0, tzinfo=timezone.utc)
+        self.finish(pipeline, datetime(2025, 1, 9, 23, 0, tzinfo=timezone.utc), 100.0)
+        self.finish(pipeline, datetime(2025, 1, 10, 0, 30, tzinfo=timezone.utc), 100.0)
+        latest = self.finish(pipeline, datetime(2025, 1, 11, 8, 0, tzinfo=timezone.utc), 50.0)
+        [org] = build_scorecard(since)
+        entry = org['teams'][0]['projects'][0]['pipelines'][0]
+        self.assertEqual((entry['run_count'], entry['passed_count'], entry['pass_rate']), (2, 1, 50.0))
+        self.assertEqual((entry['latest_run']['id'], entry['latest_run']['score']), (latest.id, 50.0))
+        self.assertEqual((org['run_count'], org['latest_score']), (2, 50.0))
+
+    def test_tree_takes_five_queries(self):
+        start = datetime(2025, 1, 10, 8, 0, tzinfo=timezone.utc)
+        for name in ('a', 'b', 'c'):
+            pipeline = create_pipeline(name=name)
+            self.finish(pipeline, start, 100.0)
+            Pipeline.objects.create(project=pipeline.project, name=f'{name} without runs')
+        with self.assertNumQueries(5):
+            tree = build_scorecard(start - timedelta(days=1))
+        self.assertEqual([(org['name'], org['pipeline_count'], org['pass_rate']) for org in tree],
+                         [('a', 2, 100.0), ('b', 2, 100.0), ('c', 2, 100.0)])
+
+
+class RunTransferTests(TestCase):
+    def setUp(self):
+        self.pipeline = create_pipeline()
+        start = datetime(2025, 1, 1, 10, 0, tzinfo=timezone.utc)
+        for i in range(5):
+            run = Run.objects.create(pipeline=self.pipeline, triggered_by=f'run {i}', start_time=start + timedelta(hours=i))
+            update_result(run.id, 20.0 * i, stage_id=run.stage_results.first().stage_id)
+            if i % 2:
+                run.end_time = run.start_time + timedelta(minutes=5)
+                run.save()
+
+    async def test_export_streams_chunk_by_chunk(self):
+        with mock.patch('tracker.views.aexport_run_lines', partial(aexport_run_lines, chunk_size=2)), \
+                mock.patch('tracker.transfer.run_record', wraps=run_record) as record:
+            response = await self.async_client.get('/api/runs/export/')
+            self.assertTrue(response.is_async)
+            content = aiter(response.streaming_content)
+            first = await anext(content)
+            # Only the first chunk was read from the database so far
+            self.assertEqual(record.call_count, 2)
+            lines = [first, *[line async for line in content]]
+        self.assertEqual(record.call_count, 5)
+        self.assertEqual([json.loads(line)['triggered_by'] for line in lines], [f'run {i}' for i in range(5)])
+
+    def test_import_without_ids_from_bulk_inserts(self):
+        originals = Run.objects.filter(pipeline=self.pipeline)
+        lines = list(export_run_lines(originals))
+        last_id = originals.order_by('-id').values_list('id', flat=True).first()
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            self.assertEqual(sum(import_run_lines(lines, self.pipeline, batch_size=2)), 5)
+        imported = Run.objects.filter(id__gt=last_id)
+        self.assertEqual(list(export_run_lines(imported)), lines)
+        for run in imported:
+            self.assertAlmostEqual(run.score, calculate_run_score(run.id))
+
+
+class RetentionTests(TestCase):
+    now = datetime(2025, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+    def setUp(self):
+        self.pipeline = create_pipeline()
+
+    def finish(self, start, percent=100.0):
+        run = Run.objects.create(pipeline=self.pipeline, triggered_by='tests', start_time=start)
+        update_result(run.id, percent, stage_id=run.stage_results.first().stage_id)
+        run.end_time = start + timedelta(minutes=10)
+        run.save()
+        return run
+
+    def test_retention_cutoff_boundary(self):
+        cutoff = self.now - timedelta(days=30)
+        before, at, after = (self.finish(cutoff + timedelta(seconds=offset)) for offset in (-1, 0, 1))
+        Run.objects.create(pipeline=self.pipeline, triggered_by='unfinished', start_time=cutoff - timedelta(days=1))
+        self.pipeline.retention_days = 30
+        self.assertEqual(list(compactable_runs(self.pipeline, self.now)), [before])
+
+        # The last K runs (of any status) are kept; everything older is compactable
+        self.pipeline.retention_days, self.pipeline.retention_runs = None, 2
+        self.assertEqual(set(compactable_runs(self.pipeline, self.now)), {before})
+        self.pipeline.retention_runs = 1
+        self.assertEqual(set(compactable_runs(self.pipeline, self.now)), {before, at})
+
+    def test_compaction_leaves_scores_and_buckets_unchanged(self):
+        runs = [self.finish(self.now - timedelta(days=40, hours=i), 25.0 * i) for i in range(4)]
+        for run in runs:
+            run.refresh_from_db()
+        buckets = list(TrendBucket.objects.order_by('id').values())
+        self.pipeline.retention_days = 30
+        self.assertEqual(sum(compact_pipeline_runs(self.pipeline, batch_size=3, now=self.now)), 4)
+
+        self.assertEqual(list(TrendBucket.objects.order_by('id').values()), buckets)
+        self.assertFalse(StageResult.objects.filter(run__in=runs).exists())
+        for run in runs:
+            compacted = Run.objects.get(pk=run.pk)
+            self.assertTrue(compacted.compacted)
+            self.assertEqual((compacted.score, compacted.revision), (run.score, run.revision + 1))
+            self.assertEqual(len(compacted.stage_summary), 2)
+        # Rebuilding reads the summaries and arrives at the same rollups
+        call_command('rebuild_trend_rollups', stdout=io.StringIO())
+        key = ('pipeline_id', 'stage_id', 'granularity', 'bucket_start', 'run_count', 'completed_count', 'duration_count')
+        self.assertEqual(
+            sorted(TrendBucket.objects.values_list(*key), key=repr), sorted((tuple(b[k] for k in key) for b in buckets), key=repr),
+        )
+
+    def test_updating_a_compacted_run_is_404(self):
+        run = self.finish(self.now - timedelta(days=40))
+        stage_result = run.stage_results.first()
+        substage_id = SubStageResult.objects.filter(stage_result=stage_result).values_list('substage_id', flat=True).first()
+        compact_run_batch([run.id])
+        url = f'/api/runs/{run.id}/update_stage/'
+        for payload in ({'stage_id': stage_result.stage_id, 'completion_percent': 50},
+                        {'substage_id': substage_id, 'completion_percent': 50}):
+            with self.subTest(payload=payload):
+                self.assertEqual(self.client.post(url, payload).status_code, 404)
+        self.assertEqual(compact_run_batch([run.id]), 0)
+
+
+class ResultLockTests(TestCase):
+    @skipUnlessDBFeature('has_select_for_update_of')
+    def test_batch_updates_lock_no_joined_rows(self):
+        # Locks are taken substage result -> stage result -> run; a FOR UPDATE over a join would lock
+        # the joined parent rows out of that order
+        run = Run.objects.create(pipeline=create_pipeline(), triggered_by='tests')
+        results = list(SubStageResult.objects.of_run(run.id).select_related('stage_result'))
+        updates = [{'substage_id': ssr.substage_id, 'completion_percent': 50.0} for ssr in results[:4]]
+        updates.append({'stage_id': results[-1].stage_result.stage_id, 'completion_percent': 10.0})
+        with CaptureQueriesContext(connection) as queries:
+            apply_result_updates(run, updates)
+        locking = [query['sql'] for query in queries if 'FOR UPDATE' in query['sql']]
+        self.assertTrue(locking)
+        for sql in locking:
+            self.assertNotIn(' JOIN ', sql)
+
+
+class ConcurrentWriterTests(TransactionTestCase):
+    # Exercises the row locks of update_result and apply_result_updates (PostgreSQL) and the IMMEDIATE
+    # transactions of SQLite
+
+    def test_single_and_batch_updates_lose_no_writes(self):
+        out = io.StringIO()
+        # Fails with CommandError on lost writes, stale rollups or scores, deadlocks and other errors
+        call_command('check_concurrency', writers=8, updates=20, runs=1, substages=8, batch=2, seed=1, stdout=out)
+        self.assertIn('lost writes: 0', out.getvalue())
@@ -0,0 +1,275 @@
+"""Run history export/import as NDJSON, for moving or archiving runs between environments.
+
+Each line is one run with its stage and substage results. Pipelines, stages and substages are
+referenced by name rather than id, since ids differ between databases; the pinned weights of the
+results travel with them, so imported runs keep their original scores. ``pipeline_version`` is the
+content hash of the definition the run was created with, and is linked again on import when the
+target pipeline has a version with that hash. Compacted runs (see tracker/retention.py) carry their
+``stage_summary`` instead of results, with stage names in place of stage ids.
+
+Exports iterate the runs server-side in chunks (``aexport_run_lines`` hands them to an async
+streaming response); imports write batches of runs with bulk INSERTs, one transaction per batch,
+folding finished runs into the trend rollups of the same transaction.
+"""
+import json
+from datetime import datetime
+from itertools import islice
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+from .models import Pipeline, PipelineVersion, Run, Stage, StageResult, SubStageResult
+from .services import add_trend_observation, add_trend_totals, stage_contribution
+
+RESULT_FIELDS = ('start_time', 'end_time', 'status', 'completion_percent', 'weight')
+EXPORT_CHUNK_SIZE = 500
+IMPORT_BATCH_SIZE = 500
+
+
+class TransferJSONEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder that keeps the microseconds of datetimes, which it rounds to milliseconds."""
+
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def run_record(run: Run, stage_names: Dict[int, str]) -> dict:
+    """Portable representation of a run loaded with ``Run.objects.with_results()``.
+
+    ``stage_names`` maps the stage ids of a compacted run's summary to names.
+    """
+    return {
+        'pipeline': run.pipeline.name,
+        'pipeline_version': run.pipeline_version.content_hash if run.pipeline_version else None,
+        'triggered_by': run.triggered_by,
+        'start_time': run.start_time,
+        'end_time': run.end_time,
+        'status': run.status,
+        'score': run.score,
+        'stage_results': [
+            {
+                'stage': sr.stage.name,
+                **{field: getattr(sr, field) for field in RESULT_FIELDS},
+                'substage_results': [
+                    {'substage': sub.substage.name, **{field: getattr(sub, field) for field in RESULT_FIELDS}}
+                    for sub in sr.substage_results.all()
+                ],
+            }
+            for sr in run.stage_results.all()
+        ],
+        'compacted': run.compacted,
+        'stage_summary': [
+            [stage_names.get(stage_id), *figures] for stage_id, *figures in run.stage_summary
+        ] if run.compacted else None,
+    }
+
+
+def export_run_lines(runs, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[str]:
+    """NDJSON lines of ``runs`` (oldest first), reading ``chunk_size`` runs and their results at a time."""
+    runs = runs.select_related('pipeline', 'pipeline_version').with_results().order_by('start_time', 'id')
+    stage_names: Dict[int, str] = {}
+    for run in runs.iterator(chunk_size=chunk_size):
+        if run.compacted:
+            missing = {row[0] for row in run.stage_summary} - stage_names.keys()
+            if missing:
+                stage_names.update(Stage.objects.filter(id__in=missing).values_list('id', 'name'))
+        yield json.dumps(run_record(run, stage_names), cls=TransferJSONEncoder) + '\n'
+
+
+async def aexport_run_lines(runs, chunk_size: int = EXPORT_CHUNK_SIZE) -> AsyncIterator[str]:
+    """``export_run_lines`` as an async iterator, for StreamingHttpResponse under ASGI.
+
+    Each chunk of ``chunk_size`` lines is read in the request's sync thread through sync_to_async
+    (which keeps the database connection and its server-side cursor), so the response is sent
+    chunk by chunk instead of being collected into one list first.
+    """
+    lines = export_run_lines(runs, chunk_size)
+    next_chunk = sync_to_async(lambda: list(islice(lines, chunk_size)))
+    while True:
+        chunk = await next_chunk()
+        if not chunk:
+            return
+        for line in chunk:
+            yield line
+
+
+class PipelineLayout:
+    """Stage/substage ids of a target pipeline by name, plus its versions by content hash."""
+
+    def __init__(self, pipeline: Pipeline):
+        self.pipeline = pipeline
+        self.stages: Dict[str, Tuple[int, Dict[str, int]]] = {}
+        for stage in Stage.objects.filter(pipeline=pipeline).prefetch_related('substages'):
+            if stage.name in self.stages:
+                raise ValueError(f'Pipeline "{pipeline.name}" has several stages named "{stage.name}"')
+            substages = {}
+            for sub in stage.substages.all():
+                if sub.name in substages:
+                    raise ValueError(f'Stage "{stage.name}" has several substages named "{sub.name}"')
+                substages[sub.name] = sub.id
+            self.stages[stage.name] = (stage.id, substages)
+        self.versions = dict(PipelineVersion.objects.filter(pipeline=pipeline).values_list('content_hash', 'id'))
+
+
+def _datetime(record: dict, field: str):
+    value = record.get(field)
+    if value is None:
+        return None
+    parsed = parse_datetime(value) if isinstance(value, str) else None
+    if parsed is None:
+        raise ValueError(f'{field}: expected an ISO 8601 datetime, got {value!r}')
+    return parsed
+
+
+def _result_values(record: dict) -> dict:
+    return {
+        'start_time': _datetime(record, 'start_time'),
+        'end_time': _datetime(record, 'end_time'),
+        'status': record.get('status', 'pending'),
+        'completion_percent': float(record.get('completion_percent', 0.0)),
+        'weight': float(record.get('weight', 0.0)),
+    }
+
+
+def build_run(record: dict, layout: PipelineLayout) -> Tuple[Run, List[Tuple[StageResult, List[SubStageResult]]]]:
+    """Unsaved Run and result rows for one exported record."""
+    results = []
+    for stage_record in record.get('stage_results', []):
+        if stage_record.get('stage') not in layout.stages:
+            raise ValueError(f'pipeline "{layout.pipeline.name}" has no stage "{stage_record.get("stage")}"')
+        stage_id, substages = layout.stages[stage_record['stage']]
+        sub_results = []
+        for sub_record in stage_record.get('substage_results', []):
+            if sub_record.get('substage') not in substages:
+                raise ValueError(f'stage "{stage_record["stage"]}" has no substage "{sub_record.get("substage")}"')
+            sub_results.append(SubStageResult(substage_id=substages[sub_record['substage']], **_result_values(sub_record)))
+        values = _result_values(stage_record)
+        results.append((StageResult(
+            stage_id=stage_id, weighted_score=stage_contribution(values['weight'], values['completion_percent']), **values,
+        ), sub_results))
+
+    start_time = _datetime(record, 'start_time')
+    if start_time is None:
+        raise ValueError('start_time is required')
+    end_time = _datetime(record, 'end_time')
+    stage_summary = None
+    if record.get('compacted'):
+        stage_summary = []
+        for name, *figures in record.get('stage_summary') or []:
+            if name not in layout.stages:
+                raise ValueError(f'pipeline "{layout.pipeline.name}" has no stage "{name}"')
+            stage_summary.append([layout.stages[name][0], *figures])
+    run = Run(
+        pipeline=layout.pipeline,
+        pipeline_version_id=layout.versions.get(record.get('pipeline_version')),
+        triggered_by=record.get('triggered_by', ''),
+        start_time=start_time,
+        end_time=end_time,
+        status=record.get('status', 'running'),
+        score=float(record.get('score', 0.0)),
+        compacted=stage_summary is not None,
+        stage_summary=stage_summary,
+        # Finished runs are folded into the trend rollups in the same transaction (see write_runs)
+        trend_recorded=end_time is not None,
+    )
+    return run, results
+
+
+def write_runs(batch: List[Tuple[Run, List[Tuple[StageResult, List[SubStageResult]]]]]) -> None:
+    """Insert built runs and their results with three bulk INSERTs and record the finished ones.
+
+    bulk_create bypasses the Run signals, so no results are materialized and no version is pinned.
+    Trend buckets are incremented in place (add_trend_totals), so imports can run next to live writers.
+    """
+    totals = {}
+    with transaction.atomic():
+        runs = [run for run, _ in batch]
+        if connection.features.can_return_rows_from_bulk_insert:
+            Run.objects.bulk_create(runs)
+        else:
+            # Backends that cannot return ids from a bulk INSERT: insert the runs one at a time, raw
+            # so that the Run signals skip them just as they skip bulk_create
+            for run in runs:
+                run.save_base(raw=True)
+        for run, results in batch:
+            for sr, _ in results:
+                sr.run_id = run.pk
+        stage_results = [sr for _, results in batch for sr, _ in results]
+        StageResult.objects.bulk_create(stage_results)
+        if any(sr.pk is None for sr in stage_results):
+            # Backends that cannot return ids from a bulk INSERT
+            result_ids = {
+                (run_id, stage_id): pk
+                for pk, run_id, stage_id in StageResult.objects.filter(run__in=runs).values_list('id', 'run_id', 'stage_id')
+            }
+            for sr in stage_results:
+                sr.pk = result_ids[(sr.run_id, sr.stage_id)]
+        sub_results = []
+        for _, results in batch:
+            for sr, subs in results:
+                for sub in subs:
+                    sub.stage_result_id = sr.pk
+                sub_results.extend(subs)
+        SubStageResult.objects.bulk_create(sub_results)
+
+        for run, results in batch:
+            if run.end_time is None:
+                continue
+            add_trend_observation(
+                totals, run.pipeline_id, None, run.start_time, run.score, (run.end_time - run.start_time).total_seconds(),
+            )
+            if run.compacted:
+                stage_rows = [(stage_id, percent, duration) for stage_id, _, percent, duration in run.stage_summary]
+            else:
+                stage_rows = [
+                    (sr.stage_id, sr.completion_percent,
+                     (sr.end_time - sr.start_time).total_seconds() if sr.start_time and sr.end_time else None)
+                    for sr, _ in results
+                ]
+            for stage_id, percent, duration in stage_rows:
+                add_trend_observation(totals, run.pipeline_id, stage_id, run.start_time, percent / 100.0, duration)
+        add_trend_totals(totals)
+
+
+def import_run_lines(
+    lines: Iterable[str], pipeline: Optional[Pipeline] = None, batch_size: int = IMPORT_BATCH_SIZE,
+) -> Iterator[int]:
+    """Import NDJSON run records, yielding the number of runs written after each committed batch.
+
+    Records go to ``pipeline`` if given, else to the pipeline of the same name. Raises ValueError
+    naming the offending line; batches committed before it stay imported.
+    """
+    layouts: Dict[Optional[str], PipelineLayout] = {}
+    if pipeline is not None:
+        layouts[None] = PipelineLayout(pipeline)
+    batch = []
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if pipeline is not None:
+                layout = layouts[None]
+            else:
+                name = record.get('pipeline')
+                if name not in layouts:
+                    matches = list(Pipeline.objects.filter(name=name)[:2])
+                    if len(matches) != 1:
+                        raise ValueError(
+                            f'{"several" if matches else "no"} pipelines named "{name}"; choose the target pipeline explicitly'
+                        )
+                    layouts[name] = PipelineLayout(matches[0])
+                layout = layouts[name]
+            batch.append(build_run(record, layout))
+        except (AttributeError, TypeError, ValueError) as e:
+            raise ValueError(f'line {number}: {e}')
+        if len(batch) >= batch_size:
+            write_runs(batch)
+            yield len(batch)
+            batch = []
+    if batch:
+        write_runs(batch)
+        yield len(batch)
@@ -1,11 +1,20 @@
 from django.urls import path, include
 from rest_framework import routers
-from .views import PipelineViewSet, RunViewSet
+from . import async_views
+from .metrics import metrics_view
+from .views import PipelineViewSet, RunViewSet, ScorecardViewSet, run_event_stream
 
 router = routers.DefaultRouter()
 router.register(r'pipelines', PipelineViewSet, basename='pipeline')
 router.register(r'runs', RunViewSet, basename='run')
+router.register(r'scorecard', ScorecardViewSet, basename='scorecard')
 
 urlpatterns = [
+    path('metrics', metrics_view, name='metrics'),
+    path('api/runs/<int:pk>/stream/', run_event_stream, name='run-stream'),
+    path('api/async/runs/', async_views.create_run, name='async-run-create'),
+    path('api/async/runs/<int:pk>/update_stage/', async_views.update_stage, name='async-run-update-stage'),
+    path('api/async/runs/<int:pk>/summary/', async_views.run_summary, name='async-run-summary'),
+    path('api/async/pipelines/<int:pk>/trend/', async_views.pipeline_trend, name='async-pipeline-trend'),
     path('api/', include(router.urls)),
 ]
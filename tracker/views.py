@@ -1,38 +1,171 @@
+import asyncio
+import json
+from datetime import timedelta
+from asgiref.sync import sync_to_async
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from django.shortcuts import get_object_or_404
-from django.db.models import Avg
-from .models import Pipeline, Run, StageResult, SubStageResult
-from .serializers import PipelineSerializer, RunSerializer, StageResultSerializer, SubStageResultSerializer
-from .services import calculate_run_score
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+from django.http import Http404, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .buffer import flush_pending, flush_pending_runs, flush_pipeline_pending, report_progress
+from .caching import etag_matches, get_pipeline_representations, if_match_revision, versions_etag
+from .events import broker, run_snapshot
+from .filters import RunFilterBackend
+from .models import Pipeline, Run, Stage, SubStage, TrendBucket
+from .pagination import RunCursorPagination
+from .scorecard import build_scorecard
+from .serializers import (
+    PipelineSerializer, ResultUpdateSerializer, RunSerializer, StageResultSerializer, SubStageResultSerializer
+)
+from .services import StaleRevision, apply_result_updates
+from .transfer import aexport_run_lines
+
+
+def filter_trend_buckets(buckets, params):
+    """Apply the ``bucket`` (hour/day), ``stage``, ``since`` and ``until`` trend query parameters."""
+    granularity = params['bucket']
+    if granularity not in dict(TrendBucket.GRANULARITY_CHOICES):
+        raise ValidationError({'bucket': 'Expected one of: hour, day'})
+    buckets = buckets.filter(granularity=granularity)
+    if params.get('stage'):
+        if not params['stage'].isdigit():
+            raise ValidationError({'stage': 'Expected an integer id'})
+        buckets = buckets.filter(stage_id=int(params['stage']))
+    else:
+        buckets = buckets.filter(stage__isnull=True)
+    for param, lookup in (('since', 'bucket_start__gte'), ('until', 'bucket_start__lt')):
+        if params.get(param):
+            value = parse_datetime(params[param])
+            if value is None:
+                raise ValidationError({param: 'Expected an ISO 8601 datetime'})
+            buckets = buckets.filter(**{lookup: value})
+    return buckets
+
+
+def trend_bucket_data(b: TrendBucket) -> dict:
+    return {
+        'bucket_start': b.bucket_start,
+        'run_count': b.run_count,
+        'mean_score': round(b.mean_score * 100, 2),
+        'min_score': round((b.score_min or 0.0) * 100, 2),
+        'max_score': round((b.score_max or 0.0) * 100, 2),
+        'completion_rate': round(b.completion_rate * 100, 2),
+        'mean_duration_seconds': b.mean_duration,
+    }
 
 
 class PipelineViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Pipeline.objects.all()
+    # Archived stages/substages are no longer part of the definition
+    queryset = Pipeline.objects.all().prefetch_related(
+        Prefetch('stages', queryset=Stage.objects.filter(archived=False)),
+        Prefetch('stages__substages', queryset=SubStage.objects.filter(archived=False)),
+    )
     serializer_class = PipelineSerializer
 
+    def list(self, request, *args, **kwargs):
+        versions = self.paginate_queryset(
+            Pipeline.objects.order_by('id').values_list('id', 'structure_version')
+        )
+        page = self.paginator.page
+        etag = versions_etag('pipelines', versions, (page.paginator.count, page.number, page.paginator.per_page))
+        if etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        response = self.get_paginated_response(get_pipeline_representations(versions, self._serialize_pipelines))
+        response['ETag'] = etag
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        versions = list(Pipeline.objects.filter(pk=kwargs['pk']).values_list('id', 'structure_version'))
+        if not versions:
+            raise Http404
+        etag = versions_etag('pipeline', versions)
+        if etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        data = get_pipeline_representations(versions, self._serialize_pipelines)
+        if not data:
+            raise Http404
+        return Response(data[0], headers={'ETag': etag})
+
+    def _serialize_pipelines(self, pipeline_ids):
+        pipelines = self.get_queryset().filter(id__in=pipeline_ids)
+        return {p.id: self.get_serializer(p).data for p in pipelines}
+
     @action(detail=True, methods=['get'])
     def trend(self, request, pk=None):
-        """Return trend metrics (last N runs) for pipeline."""
+        """Return trend metrics (last N runs) for pipeline.
+
+        With ``?bucket=hour|day`` (optionally ``since``, ``until`` and ``stage``) the pre-aggregated
+        TrendBuckets are returned instead, without reading any runs.
+        """
         pipeline = self.get_object()
+        flush_pipeline_pending(pipeline.id)
+        if request.query_params.get('bucket'):
+            return self._bucketed_trend(pipeline, request.query_params)
         n = int(request.query_params.get('n', 10))
-        runs = pipeline.runs.all().order_by('-start_time')[:n]
+        # Stored scores make this a single query, however many runs are requested
+        runs = pipeline.runs.order_by('-start_time').values_list('id', 'start_time', 'score')[:n]
         data = []
-        for r in runs:
-            data.append({'run_id': r.id, 'start_time': r.start_time, 'overall_score': round(r.overall_score * 100, 2)})
+        for run_id, start_time, score in runs:
+            data.append({'run_id': run_id, 'start_time': start_time, 'overall_score': round(score * 100, 2)})
         return Response(data)
 
+    def _bucketed_trend(self, pipeline, params):
+        buckets = filter_trend_buckets(pipeline.trend_buckets.all(), params)
+        return Response([trend_bucket_data(b) for b in buckets])
+
 
 class RunViewSet(viewsets.ModelViewSet):
     queryset = Run.objects.all().select_related('pipeline')
     serializer_class = RunSerializer
+    pagination_class = RunCursorPagination
+    filter_backends = [RunFilterBackend]
+    # Actions that only write results and never serialize the nested tree
+    result_write_actions = ('update_stage', 'update_stages')
+    # Read actions that honour ?view=compact, ?fields= and ?expand=
+    field_selection_actions = ('list', 'retrieve', 'summary')
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = self.get_requested_fields()
+        if self.action not in self.result_write_actions and (fields is None or 'stage_results' in fields):
+            queryset = queryset.with_results()
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_requested_fields()
+        if fields is not None:
+            kwargs.setdefault('fields', fields)
+        return super().get_serializer(*args, **kwargs)
+
+    def get_requested_fields(self):
+        """Return the run fields selected via ?fields= or ?view=compact (plus ?expand=), or None for all.
+
+        e.g. ``?fields=id,status,overall_score`` or ``?view=compact&expand=stage_results``
+        """
+        if self.request is None or self.action not in self.field_selection_actions:
+            return None
+        params = self.request.query_params
+        if params.get('fields'):
+            fields = [name for name in params['fields'].split(',') if name]
+        elif params.get('view') == 'compact':
+            fields = list(RunSerializer.compact_fields)
+        else:
+            return None
+        expand = params.get('expand', '').split(',')
+        return fields + [name for name in RunSerializer.expandable_fields if name in expand]
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         run = serializer.save()
-        # The signals will create StageResult/SubStageResult instances
+        # The signals will create StageResult/SubStageResult instances; re-read them prefetched
+        run = self.get_queryset().get(pk=run.pk)
         return Response(RunSerializer(run).data, status=status.HTTP_201_CREATED)
 
     @action(detail=True, methods=['post'])
@@ -40,32 +173,189 @@ class RunViewSet(viewsets.ModelViewSet):
         """Update a stage or substage result. Expect payload like:
         {"stage_id": 1, "completion_percent": 100} or
         {"substage_id": 5, "completion_percent": 100}
+        Send the run's ETag as If-Match to apply the update only if the run has not changed since
+        (412 Precondition Failed otherwise); the response carries the run's new ETag.
         """
         run = self.get_object()
-        stage_id = request.data.get('stage_id')
-        substage_id = request.data.get('substage_id')
-        completion_percent = float(request.data.get('completion_percent', 0))
-
-        if substage_id:
-            ssr = get_object_or_404(SubStageResult, substage_id=substage_id, stage_result__run=run)
-            ssr.completion_percent = completion_percent
-            ssr.status = request.data.get('status', ssr.status)
-            ssr.save()
-        elif stage_id:
-            sr = get_object_or_404(StageResult, stage_id=stage_id, run=run)
-            sr.completion_percent = completion_percent
-            sr.status = request.data.get('status', sr.status)
-            sr.save()
-        else:
-            return Response({'detail': 'stage_id or substage_id required'}, status=400)
+        try:
+            report = report_progress(run.id, request.data, if_match_revision(request, f'run-{run.id}'))
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=400)
+        except ObjectDoesNotExist:
+            raise Http404
+        except StaleRevision as e:
+            return self._precondition_failed(e)
+        headers = {'ETag': Run(id=run.id, revision=report.revision).etag} if report.revision else None
+        return Response(report.data, headers=headers)
 
-        # Recalculate overall score
-        new_score = calculate_run_score(run.id)
-        # Optionally update run.status or save metrics; the property computes on the fly
-        return Response({'overall_score': round(new_score * 100, 2)})
+    @action(detail=True, methods=['post'])
+    def update_stages(self, request, pk=None):
+        """Apply many stage/substage updates at once. Expect payload like:
+        {"updates": [{"substage_id": 5, "completion_percent": 100, "status": "completed"},
+                     {"stage_id": 2, "completion_percent": 40}]}
+        (a bare list of updates is accepted as well). If-Match is honored as in update_stage.
+        """
+        run = self.get_object()
+        updates = request.data if isinstance(request.data, list) else request.data.get('updates')
+        if not isinstance(updates, list) or not updates:
+            return Response({'detail': 'updates must be a non-empty list'}, status=400)
+
+        serializer = ResultUpdateSerializer(data=updates, many=True)
+        serializer.is_valid(raise_exception=True)
+        flush_pending(run.id)
+        try:
+            new_score = apply_result_updates(
+                run, serializer.validated_data, expected_revision=if_match_revision(request, f'run-{run.id}'),
+            )
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=400)
+        except StaleRevision as e:
+            return self._precondition_failed(e)
+
+        # The results are re-read after commit and may include later writes; the ETag is this update's
+        run = Run.objects.with_results().get(pk=run.pk)
+        return Response({
+            'overall_score': round(new_score.score * 100, 2),
+            'stage_results': StageResultSerializer(run.stage_results.all(), many=True).data,
+        }, headers={'ETag': Run(id=run.id, revision=new_score.revision).etag})
+
+    def _precondition_failed(self, error: StaleRevision) -> Response:
+        """412 for an If-Match that no longer matches, with the current ETag to re-read and retry."""
+        return Response(
+            {'detail': error.detail}, status=status.HTTP_412_PRECONDITION_FAILED,
+            headers={'ETag': Run(id=error.run_id, revision=error.revision).etag},
+        )
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        # Only the runs on the page need their buffered progress written before they are serialized
+        if page and self.action == 'list' and flush_pending_runs([run.id for run in page]):
+            fresh = queryset.in_bulk([run.id for run in page])
+            page = [fresh[run.id] for run in page if run.id in fresh]
+        return page
+
+    def update(self, request, *args, **kwargs):
+        # Setting end_time snapshots the run into the trend buckets (signals.record_finished_run_trend),
+        # so buffered progress must be written first
+        if str(kwargs['pk']).isdigit():
+            flush_pending(int(kwargs['pk']))
+        return super().update(request, *args, **kwargs)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream the filtered runs with all results as NDJSON, oldest first (see tracker/transfer.py).
+
+        Accepts the list filters, e.g. ``?pipeline=1&started_after=2024-01-01T00:00:00Z``; load the
+        output elsewhere with ``manage.py import_runs``.
+        """
+        flush_pending()
+        runs = self.filter_queryset(Run.objects.all())
+        response = StreamingHttpResponse(aexport_run_lines(runs), content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="runs.ndjson"'
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._conditional_get(request, super().retrieve, *args, **kwargs)
 
     @action(detail=True, methods=['get'])
     def summary(self, request, pk=None):
+        return self._conditional_get(request, self._summary, pk=pk)
+
+    def _summary(self, request, *args, **kwargs):
         run = self.get_object()
         serializer = self.get_serializer(run)
         return Response(serializer.data)
+
+    def _conditional_get(self, request, view, *args, **kwargs):
+        """Answer If-None-Match from Run.revision alone, without reading any result rows."""
+        pk = kwargs['pk']
+        try:
+            flush_pending(int(pk))
+            revision = Run.objects.filter(pk=pk).values_list('revision', flat=True).first()
+        except (TypeError, ValueError):
+            revision = None  # malformed pk; let the regular view answer 404
+        if revision is not None:
+            etag = Run(id=pk, revision=revision).etag
+            if etag_matches(request, etag):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        response = view(request, *args, **kwargs)
+        if revision is not None and response.status_code == status.HTTP_200_OK:
+            # The ETag is read before serializing, so it can only be older than the body, never newer
+            response['ETag'] = etag
+        return response
+
+
+class ScorecardViewSet(viewsets.ViewSet):
+    """Read-only scorecards: latest-run score and pass rate per pipeline, rolled up to project, team
+    and organization (see tracker/scorecard.py).
+
+    Query parameters: ``organization``, ``team`` or ``project`` (ids) to restrict the tree, and
+    ``days`` (default 30) for the pass-rate window.
+    """
+    default_days = 30
+
+    def list(self, request):
+        params = request.query_params
+        scope = {}
+        for param in ('organization', 'team', 'project', 'days'):
+            if params.get(param):
+                try:
+                    scope[param] = int(params[param])
+                except ValueError:
+                    raise ValidationError({param: 'Expected an integer'})
+        days = scope.pop('days', self.default_days)
+        if days < 1:
+            raise ValidationError({'days': 'Expected a positive number of days'})
+        since = timezone.now() - timedelta(days=days)
+        # Pending buffered progress would make latest-run scores lag behind the runs API
+        flush_pending()
+        return Response({
+            'days': days,
+            'since': since,
+            'organizations': build_scorecard(since, **scope),
+        })
+
+
+def _sse_message(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+async def run_event_stream(request, pk):
+    """Stream live progress of a run as server-sent events (requires the ASGI app, see project/asgi.py).
+
+    Sends a ``snapshot`` event first, then an ``update`` event with the changed stage/substage
+    results and the new overall score after every committed write, and ``end`` once the run
+    has an end_time. Comment lines are sent as keep-alives while the run is idle.
+    """
+    # Subscribe before reading the snapshot, so a write committed in between is still delivered
+    # (as an update that may repeat what the snapshot already shows) rather than lost
+    queue = broker.subscribe(pk)
+    snapshot = await sync_to_async(run_snapshot)(pk)
+    if snapshot is None:
+        broker.unsubscribe(pk, queue)
+        raise Http404
+    keepalive = getattr(settings, 'TRACKER_EVENT_STREAM_KEEPALIVE', 15)
+
+    async def events():
+        try:
+            yield _sse_message('snapshot', snapshot)
+            if snapshot['end_time']:
+                yield _sse_message('end', snapshot)
+                return
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                yield _sse_message('update', event)
+                if event['end_time']:
+                    yield _sse_message('end', event)
+                    return
+        finally:
+            broker.unsubscribe(pk, queue)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response